@@ -0,0 +1,149 @@
+'''
+Bring-up and teardown of fleets of growing size, broken down per stage of `Router.__init__` and `Router.start`.
+Needs root, docker and the jaringkan-openwrt image, like `run.py`.
+
+Usage example:
+$ python -m benchmarks.bringup --max 32 --repeat 5 --output baseline.json
+$ python -m benchmarks.bringup --max 32 --repeat 5 --output current.json --compare baseline.json
+$ python -m benchmarks.bringup --results current.json --compare baseline.json     # compare saved runs only
+'''
+
+from contextlib import ExitStack
+from datetime import datetime, timezone
+import argparse
+import os
+import platform
+import sys
+
+from .harness import StageTimer, summarize, save, load, compare, format_comparison
+
+import logging
+log = logging.getLogger('benchmarks.bringup')
+
+
+def stages() -> list[tuple[type, str, str]]:
+    # (owner, attribute, stage), in the order they run
+    from docker.api import APIClient
+    from docker.models.containers import Container
+    from node_manager.router import Router, ULed
+    from node_manager.radio import PhyManagement, RadioPhy
+    from node_manager.mapping import WirelessMedium
+
+    return [
+        (Router, '__init__', 'router_init'),
+        (ULed, '__init__', 'uled_create'),
+        (PhyManagement, 'pop', 'phy_pop'),
+        (APIClient, 'create_container', 'container_create'),
+        (Router, 'start', 'router_start'),
+        (Container, 'start', 'container_start'),
+        (Router, '_wait_for_host', 'wait_for_host'),
+        (Router, '_create_veth', 'create_veth'),
+        (RadioPhy, 'bind_many', 'radio_bind'),
+        (Router, '_bind_leds', 'led_mounts'),
+        (WirelessMedium, 'commit', 'medium_commit'),
+    ]
+
+def run_size(timer: StageTimer, size: int, workers: int, spacing: float) -> int:
+    from node_manager import Fleet, WirelessMedium
+    from node_manager.wmediumd import Wmediumd
+
+    # short hostnames, veth names only keep the first 8 characters
+    hostnames = [f'b{i:05x}' for i in range(size)]
+    fleet = Fleet(max_workers=workers)
+    medium = WirelessMedium()
+    try:
+        with timer.measure('fleet_up'):
+            results = fleet.up(hostnames)
+        failed = [hostname for hostname, error in results.items() if error]
+
+        # a square grid, everyone hears a few neighbors
+        columns = max(1, int(size ** 0.5))
+        for i, hostname in enumerate(h for h in hostnames if h not in failed):
+            medium.add(fleet[hostname], (i % columns) * spacing, (i // columns) * spacing)
+        medium.commit()
+    finally:
+        with timer.measure('teardown'):
+            fleet.shutdown()
+            Wmediumd.stop()
+    return len(failed)
+
+def run(sizes: list[int], repeat: int, workers: int, spacing: float) -> dict:
+    import node_manager
+    node_manager.init(radios=max(sizes))
+
+    timer = StageTimer()
+    results = {
+        'meta': {
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'kernel': platform.release(),
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+            'workers': workers,
+            'repeat': repeat,
+            'failures': {},
+        },
+        'sizes': {},
+    }
+
+    with ExitStack() as patches:
+        for owner, name, stage in stages():
+            patches.enter_context(timer.patch(owner, name, stage))
+
+        for size in sizes:
+            failures = 0
+            for rep in range(repeat):
+                failures += run_size(timer, size, workers, spacing)
+                log.info(f"size {size}: run {rep + 1}/{repeat} done")
+            results['sizes'][str(size)] = {stage: summarize(samples) for stage, samples in timer.reset().items()}
+            results['meta']['failures'][str(size)] = failures
+
+    return results
+
+def parse_sizes(args: argparse.Namespace) -> list[int]:
+    if args.sizes:
+        return sorted({int(size) for size in args.sizes.split(',')})
+    # 1, 2, 4, ... up to max
+    sizes = []
+    size = 1
+    while size < args.max:
+        sizes.append(size)
+        size *= 2
+    return sizes + [args.max]
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.bringup', description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--max', type=int, default=16, help='largest fleet, sizes double from 1 up to it')
+    parser.add_argument('--sizes', default=None, help='comma separated fleet sizes instead of --max')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=16, help='Fleet max_workers')
+    parser.add_argument('--spacing', type=float, default=50.0, help='meters between neighbors on the grid')
+    parser.add_argument('--output', default=None, help='write results as JSON')
+    parser.add_argument('--results', default=None, help='load results from JSON instead of running')
+    parser.add_argument('--compare', default=None, metavar='BASELINE', help='compare against saved results, exit 1 on regression')
+    parser.add_argument('--metric', default='p50', help='summary field to compare (p50, p90, p99, mean...)')
+    parser.add_argument('--threshold', type=float, default=0.10, help='relative slowdown counted as regression')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if args.results:
+        results = load(args.results)
+    else:
+        results = run(parse_sizes(args), args.repeat, args.workers, args.spacing)
+    if args.output:
+        save(args.output, results)
+
+    for size, stage_summaries in results['sizes'].items():
+        print(f'size {size}')
+        for stage, summary in stage_summaries.items():
+            print(f'  {stage:<20} n={summary["count"]:<5} p50={summary["p50"] * 1000:9.3f}ms p90={summary["p90"] * 1000:9.3f}ms p99={summary["p99"] * 1000:9.3f}ms')
+
+    if args.compare:
+        rows = compare(load(args.compare), results, args.metric, args.threshold)
+        print(format_comparison(rows, args.metric))
+        if any(row['regression'] for row in rows):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,134 @@
+from contextlib import contextmanager
+from functools import wraps
+from time import perf_counter
+from typing import Callable, Iterator
+import json
+import threading
+
+
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(samples: list[float], p: float) -> float:
+    '''Linear interpolation between closest ranks, like numpy's default.'''
+    if not samples:
+        raise ValueError('No samples')
+    ordered = sorted(samples)
+    rank = (len(ordered) - 1) * p / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+def summarize(samples: list[float]) -> dict[str, float]:
+    summary = {
+        'count': len(samples),
+        'total': sum(samples),
+        'mean': sum(samples) / len(samples),
+        'min': min(samples),
+        'max': max(samples),
+    }
+    for p in PERCENTILES:
+        summary[f'p{p}'] = percentile(samples, p)
+    return summary
+
+
+class StageTimer:
+    '''
+    Times calls to existing functions by wrapping them in place, without touching the code under test.
+    Calls may come from any thread, each call is one sample of its stage.
+
+    Usage example:
+    >>> timer = StageTimer()
+    >>> with timer.patch(Router, '_create_veth', 'veth'):
+    ...     fleet.up(hostnames)
+    >>> timer.samples['veth']
+    [0.0012, 0.0011, ...]
+    '''
+
+    samples: dict[str, list[float]]
+
+    _lock: threading.Lock
+
+    def __init__(self):
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, elapsed: float):
+        with self._lock:
+            self.samples.setdefault(stage, []).append(elapsed)
+
+    @contextmanager
+    def measure(self, stage: str) -> Iterator[None]:
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, perf_counter() - start)
+
+    def _timed(self, fn: Callable, stage: str) -> Callable:
+        @wraps(fn)
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.record(stage, perf_counter() - start)
+        return timed
+
+    @contextmanager
+    def patch(self, owner: type, name: str, stage: str) -> Iterator[None]:
+        original = owner.__dict__[name]
+        if isinstance(original, (classmethod, staticmethod)):
+            # already bound to the class, keep it that way
+            setattr(owner, name, staticmethod(self._timed(getattr(owner, name), stage)))
+        else:
+            setattr(owner, name, self._timed(original, stage))
+        try:
+            yield
+        finally:
+            setattr(owner, name, original)
+
+    def reset(self) -> dict[str, list[float]]:
+        with self._lock:
+            samples = self.samples
+            self.samples = {}
+        return samples
+
+
+def save(path: str, results: dict):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=1)
+
+def load(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+def compare(baseline: dict, current: dict, metric: str = 'p50', threshold: float = 0.10) -> list[dict]:
+    '''
+    Every stage measured in both, as relative change of `metric` from `baseline` to `current`.
+    A change above `threshold` (0.10 for 10% slower) is marked as a regression.
+    '''
+    rows = []
+    for size, stages in current['sizes'].items():
+        baseline_stages = baseline['sizes'].get(size, {})
+        for stage, summary in stages.items():
+            if stage not in baseline_stages:
+                continue
+            before, after = baseline_stages[stage][metric], summary[metric]
+            change = (after - before) / before if before else 0.0
+            rows.append({
+                'size': int(size),
+                'stage': stage,
+                'baseline': before,
+                'current': after,
+                'change': change,
+                'regression': change > threshold,
+            })
+    return rows
+
+def format_comparison(rows: list[dict], metric: str = 'p50') -> str:
+    lines = [f'{"size":>6}  {"stage":<20} {"baseline " + metric:>14} {"current " + metric:>14} {"change":>8}']
+    for row in rows:
+        flag = '  REGRESSION' if row['regression'] else ''
+        lines.append(f'{row["size"]:>6}  {row["stage"]:<20} {row["baseline"] * 1000:>12.3f}ms {row["current"] * 1000:>12.3f}ms {row["change"]:>+8.1%}{flag}')
+    return '\n'.join(lines)
@@ -1,3 +1,76 @@
-from .router import Router, ULed
-from .radio import RadioPhy
-from .mapping import WirelessMedium
+'''
+Importing this package is free of side effects: submodules (and docker with them) load on
+first access of their names, and the radio stub namespace is set up by `init()` or by the
+first router created.
+'''
+
+import importlib
+
+TYPE_CHECKING = False   # spares importing typing, type checkers read it as typing.TYPE_CHECKING
+if TYPE_CHECKING:
+    from .router import Router, ULed, LedMonitor
+    from .radio import RadioPhy, PhyManagement
+    from .mapping import WirelessMedium
+    from .fleet import Fleet
+    from .dockerpool import DockerPool
+    from .journal import StateJournal
+    from .metrics import Metrics
+    from .topology import Topology
+    from .mobility import MobilityEngine, RandomWaypoint, Trace, GroupMobility
+    from .aio import AsyncDockerClient, AsyncRouter, AsyncWirelessMedium
+
+_exports = {
+    'Router': 'router',
+    'ULed': 'router',
+    'LedMonitor': 'router',
+    'RadioPhy': 'radio',
+    'PhyManagement': 'radio',
+    'WirelessMedium': 'mapping',
+    'Fleet': 'fleet',
+    'DockerPool': 'dockerpool',
+    'StateJournal': 'journal',
+    'Metrics': 'metrics',
+    'Topology': 'topology',
+    'MobilityEngine': 'mobility',
+    'RandomWaypoint': 'mobility',
+    'Trace': 'mobility',
+    'GroupMobility': 'mobility',
+    'AsyncDockerClient': 'aio',
+    'AsyncRouter': 'aio',
+    'AsyncWirelessMedium': 'aio',
+}
+
+__all__ = ['init', *_exports]
+
+KERNEL_MODULES = (
+    ('mac80211_hwsim', 'radios=0'),     # radios are created on demand
+    ('uleds',),
+    ('ledtrig-netdev',),
+)
+
+
+def __getattr__(name: str):
+    module_name = _exports.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f'.{module_name}', __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_exports))
+
+def init(radios: int = 0, load_modules: bool = True):
+    '''
+    Load the kernel modules, create the radio stub namespace and keep `radios` radios pre-created.
+    Needs root. Safe to call more than once.
+    '''
+    if load_modules:
+        import subprocess
+        for module in KERNEL_MODULES:
+            subprocess.run(['modprobe', *module], check=True)
+
+    from .radio import PhyManagement
+    PhyManagement.prepare()
+    if radios:
+        PhyManagement.configure_pool(radios)
@@ -0,0 +1,131 @@
+'''
+Bring up a topology, run it, and tear it down without an interactive session.
+
+Usage example:
+$ python -m node_manager --duration 60 test1=0,0 test2=100,50 test3=20,49,15
+$ python -m node_manager --topology farm.json     # edit farm.json, then SIGHUP to apply the changes
+'''
+
+from time import monotonic
+from typing import Callable
+import argparse
+import os
+import signal
+import sys
+import threading
+
+from . import init, Fleet, Metrics, StateJournal, Topology, WirelessMedium
+from .wmediumd import Wmediumd
+
+import logging
+log = logging.getLogger('node_manager')
+
+
+def parse_node(spec: str) -> tuple[str, float, float, float | None]:
+    # HOSTNAME=X,Y[,TX_POWER]
+    try:
+        hostname, coords = spec.split('=', 1)
+        values = [float(value) for value in coords.split(',')]
+        if not hostname or len(values) not in (2, 3):
+            raise ValueError
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected HOSTNAME=X,Y[,TX_POWER], got {spec!r}")
+    return (hostname, values[0], values[1], values[2] if len(values) == 3 else None)
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='python -m node_manager', description='Bring up a jaringkan mesh, run it, then tear it down.')
+    parser.add_argument('nodes', nargs='*', type=parse_node, metavar='HOSTNAME=X,Y[,TX_POWER]', help='routers and where to place them')
+    parser.add_argument('--topology', default=None, metavar='FILE', help='routers from a topology file (.json, .jsonl, .toml), reapplied on SIGHUP')
+    parser.add_argument('--duration', type=float, default=None, help='seconds to run before tearing down (default: until SIGINT/SIGTERM)')
+    parser.add_argument('--interactive', action='store_true', help='drop into IPython instead of waiting')
+    parser.add_argument('--workers', type=int, default=16, help='routers brought up concurrently')
+    parser.add_argument('--radios', type=int, default=None, help='radios to keep pre-created (default: one per router)')
+    parser.add_argument('--no-modprobe', dest='load_modules', action='store_false', help='kernel modules are already loaded')
+    parser.add_argument('--state-dir', default=None, help='journal state here, see StateJournal')
+    parser.add_argument('--metrics-port', type=int, default=None, help='serve Prometheus metrics on this port')
+    parser.add_argument('--metrics-json', default=None, help='write a metrics snapshot to this file every 10s')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    return parser
+
+def load_topology(args: argparse.Namespace) -> Topology:
+    topology = Topology.load(args.topology) if args.topology else Topology()
+    for hostname, x, y, tx_power in args.nodes:
+        topology.add(hostname, x, y, tx_power)
+    return topology
+
+def wait(duration: float | None, reload: Callable[[], None] | None = None):
+    stopping = threading.Event()
+    reloading = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda signum, frame: stopping.set())
+    if reload is not None:
+        signal.signal(signal.SIGHUP, lambda signum, frame: (reloading.set(), stopping.set()))
+
+    deadline = None if duration is None else monotonic() + duration
+    while True:
+        stopping.wait(None if deadline is None else max(0.0, deadline - monotonic()))
+        if not reloading.is_set():
+            return
+        # woken up by SIGHUP, not to stop
+        reloading.clear()
+        stopping.clear()
+        reload()
+
+def main(argv: list[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+
+    if os.geteuid() != 0:
+        log.error('Must be run as root')
+        return 1
+
+    if args.state_dir:
+        StateJournal.enable(args.state_dir)
+    if args.verbose:
+        Wmediumd.log_level = 7
+    if args.metrics_port is not None:
+        Metrics.serve(args.metrics_port)
+    if args.metrics_json:
+        Metrics.dump_every(args.metrics_json)
+    topology = load_topology(args)
+    init(radios=len(topology) if args.radios is None else args.radios, load_modules=args.load_modules)
+
+    fleet = Fleet(max_workers=args.workers)
+    medium = WirelessMedium()
+    failed = []
+
+    def reload():
+        try:
+            topology = load_topology(args)
+        except (OSError, ValueError) as e:
+            log.error(f"Keeping the current topology: {e}")
+            return
+        try:
+            results = topology.apply(fleet, medium)
+        except Exception as e:
+            # routers stay as far as apply got, the next SIGHUP tries again from there
+            log.exception(f"Failed to apply topology, keeping the mesh running: {e}")
+            return
+        log.info(f"Topology applied, {sum(1 for error in results.values() if error)} routers failed")
+
+    try:
+        results = topology.apply(fleet, medium)
+        failed = [hostname for hostname, error in results.items() if error]
+        log.info(f"{len(topology) - len(failed)} routers up, {len(failed)} failed")
+
+        if args.interactive:
+            from IPython import embed
+            embed()
+        else:
+            wait(args.duration, reload if args.topology else None)
+    finally:
+        log.info('Tearing down...')
+        fleet.shutdown()
+        Wmediumd.stop()
+        Metrics.stop()
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
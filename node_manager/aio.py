@@ -0,0 +1,288 @@
+import asyncio
+import json
+from random import randint
+from urllib.parse import urlencode, quote
+from .router import Router
+from .mapping import WirelessMedium
+from .radio import PhyManagement
+from .wmediumd import Wmediumd, AsyncWmediumdClient
+from .linuxutils import wait_for_path_async
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class DockerError(RuntimeError):
+
+    status: int
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f"docker API error {status}: {message}")
+        self.status = status
+
+
+class AsyncDockerClient:
+    '''
+    Small asyncio docker API client speaking HTTP/1.1 over the daemon's unix socket.
+    Keeps up to `max_connections` keep-alive connections.
+    '''
+
+    api_version = '1.41'
+
+    socket_path: str
+    max_connections: int
+
+    _idle: list[tuple[asyncio.StreamReader, asyncio.StreamWriter]]
+    _slots: asyncio.Semaphore
+
+    def __init__(self, socket_path: str = '/var/run/docker.sock', max_connections: int = 16):
+        self.socket_path = socket_path
+        self.max_connections = max_connections
+        self._idle = []
+        self._slots = asyncio.Semaphore(max_connections)
+
+    def __repr__(self):
+        return f'<AsyncDockerClient {self.socket_path} {len(self._idle)} idle>'
+
+    async def _read_body(self, reader: asyncio.StreamReader, headers: dict[str, str]) -> bytes:
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = bytearray()
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    return bytes(body)
+                body += await reader.readexactly(size)
+                await reader.readline()
+        elif 'content-length' in headers:
+            return await reader.readexactly(int(headers['content-length']))
+        return b''
+
+    async def request(self, method: str, path: str, params: dict | None = None, body: dict | None = None):
+        '''
+        Returns the decoded JSON response, or None for empty responses. Raises DockerError for 4xx/5xx.
+        '''
+        target = f'/v{self.api_version}{path}'
+        if params:
+            target += '?' + urlencode(params)
+        payload = json.dumps(body).encode() if body is not None else b''
+
+        async with self._slots:
+            reader, writer = self._idle.pop() if self._idle else await asyncio.open_unix_connection(self.socket_path)
+            try:
+                writer.write(
+                    f'{method} {target} HTTP/1.1\r\nHost: docker\r\n'
+                    f'Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n\r\n'.encode() + payload
+                )
+                await writer.drain()
+
+                status = int((await reader.readline()).split()[1])
+                headers = {}
+                while (line := await reader.readline()) not in (b'\r\n', b''):
+                    name, _, value = line.decode().partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                data = await self._read_body(reader, headers)
+            except BaseException:
+                writer.close()
+                raise
+
+            if headers.get('connection', '').lower() == 'close':
+                writer.close()
+            else:
+                self._idle.append((reader, writer))
+
+        if status >= 400:
+            try:
+                message = json.loads(data)['message']
+            except (ValueError, KeyError):
+                message = data.decode(errors='replace')
+            raise DockerError(status, message)
+        return json.loads(data) if data else None
+
+    async def create_container(self, name: str, config: dict) -> str:
+        return (await self.request('POST', '/containers/create', {'name': name}, config))['Id']
+
+    async def start_container(self, container_id: str):
+        await self.request('POST', f'/containers/{quote(container_id)}/start')
+
+    async def stop_container(self, container_id: str, timeout: int = 10):
+        await self.request('POST', f'/containers/{quote(container_id)}/stop', {'t': timeout})
+
+    async def inspect_container(self, container_id: str) -> dict:
+        return await self.request('GET', f'/containers/{quote(container_id)}/json')
+
+    async def remove_container(self, container_id: str, force: bool = False):
+        await self.request('DELETE', f'/containers/{quote(container_id)}', {'force': int(force)})
+
+    async def close(self):
+        while self._idle:
+            _, writer = self._idle.pop()
+            writer.close()
+
+
+class AsyncRouter(Router):
+    '''
+    Router driven from asyncio. Docker calls go through `AsyncDockerClient`, and the
+    namespace work of attaching the router runs in a worker thread, so the loop never blocks.
+
+    Usage example:
+    >>> router = AsyncRouter('test1', docker)
+    >>> await router.create()
+    >>> await router.start()
+    '''
+
+    container_id: str | None
+
+    _adocker: AsyncDockerClient
+    _status: str
+
+    def __init__(self, hostname: str = None, docker: AsyncDockerClient | None = None):
+        self._adocker = docker or AsyncDockerClient()
+        self.container = None
+        self.container_id = None
+        self._running_ns = None
+        self._status = 'absent'
+        # LEDs and the PHY come with create(), popping a radio may have to create one
+        self.hostname = hostname or f'{randint(0x100000, 0xffffff):x}'
+
+    def __del__(self):
+        # containers are removed by close(), nothing can be awaited here
+        pass
+
+    def __repr__(self):
+        return f'<AsyncRouter hostname={self.hostname!r} {self._status}>'
+
+    @property
+    def status(self) -> str:
+        '''Last known status, without asking docker. See `get_status()`.'''
+        return self._status
+
+    def _container_config(self) -> dict:
+        return {
+            'Image': 'jaringkan-openwrt:latest',
+            'Hostname': self.hostname,
+            'Tty': True,
+            'HostConfig': {
+                'CapAdd': ['NET_ADMIN'],
+                'Memory': 128 * 1024 * 1024,
+                'Mounts': [
+                    {'Target': '/tmp', 'Type': 'tmpfs', 'TmpfsOptions': {'SizeBytes': 128 * 1024 * 1024, 'Mode': 0o777}}
+                ],
+                'NetworkMode': 'bridge',    # for wan interface
+            },
+        }
+
+    async def create(self):
+        await asyncio.to_thread(self._init_host_side, self.hostname)
+        self.container_id = await self._adocker.create_container(self.container_name, self._container_config())
+        self._status = 'created'
+
+    async def get_status(self) -> str:
+        state = (await self._adocker.inspect_container(self.container_id))['State']
+        if self._status == 'running' and state['Status'] == 'exited':
+            await asyncio.to_thread(self._on_stop)
+        self._status = state['Status']
+        return self._status
+
+    async def start(self):
+        if await self.get_status() == 'running':
+            return
+
+        await self._adocker.start_container(self.container_id)
+        pid = (await self._adocker.inspect_container(self.container_id))['State']['Pid']
+        self._status = 'running'
+        log.info(f"Router {self.hostname} started with PID {pid}")
+
+        if not await wait_for_path_async(f'/proc/{pid}/root{self.waitlock_path}', self.waitlock_timeout):
+            log.warning(f"Timed out waiting for container to be ready for host. Continuing with initialization.")
+
+        # namespaces are switched per thread, keep that away from the loop thread
+        await asyncio.to_thread(self._attach, pid)
+
+    async def stop(self, timeout: int = 10):
+        if await self.get_status() != 'running':
+            return
+
+        log.info(f"Stopping router {self.hostname}...")
+        await self._adocker.stop_container(self.container_id, timeout)
+        self._status = 'exited'
+        await asyncio.to_thread(self._on_stop)
+
+    async def close(self):
+        if self.container_id:
+            await self.stop()
+            await self._adocker.remove_container(self.container_id)
+            self.container_id = None
+            self._status = 'absent'
+
+
+class AsyncWirelessMedium(WirelessMedium):
+    '''
+    WirelessMedium whose commit never blocks the loop. Moves go to wmediumd through
+    an `AsyncWmediumdClient`, restarts run in a worker thread. Like the synchronous medium,
+    it may be changed from other threads, also while a commit is awaiting wmediumd.
+    '''
+
+    _client: AsyncWmediumdClient | None
+
+    def __init__(self):
+        super().__init__()
+        self._client = None
+
+    async def _commit_live_async(self, moved: dict[Router, tuple[float, float]]) -> bool:
+        if not Wmediumd.running() or Wmediumd.live_update is False:
+            return False
+
+        try:
+            if self._client is None:
+                self._client = await AsyncWmediumdClient.connect()
+            await asyncio.gather(*(
+                self._client.set_position(router._radio.macaddr, *coord) for router, coord in moved.items()
+            ))
+        except ValueError as e:
+            log.warning(f"wmediumd does not take live updates ({e}), restarting it instead")
+            Wmediumd.live_update = False
+            return False
+
+        Wmediumd.live_update = True
+        return True
+
+    async def _restart(self):
+        if self._client:
+            await self._client.close()
+            self._client = None
+
+        await asyncio.to_thread(Wmediumd.stop)
+        await asyncio.to_thread(Wmediumd.start, self._wmdconfig_file.name, PhyManagement.stub_ns.net)
+
+    async def commit(self):
+        # the lock is not held across awaits: take what is to be pushed and reset it under the lock,
+        # whatever changes meanwhile (another thread, the mobility engine) is left for the next commit
+        with self._lock:
+            if self._dirty is False:
+                return
+            elif len(self._coords) < 1:
+                return
+
+            self._export_config()
+            restart = self._restart_needed
+            moved = {router: self._coords[router] for router in self._moved}
+            self._dirty = False
+            self._restart_needed = False
+            self._moved.clear()
+
+        try:
+            if restart or not await self._commit_live_async(moved):
+                await self._restart()
+        except BaseException:
+            # not pushed after all, keep it for the next commit
+            with self._lock:
+                self._dirty = True
+                self._restart_needed = self._restart_needed or restart
+                self._moved |= {router for router in moved if router in self._coords}
+            raise
+
+    async def close(self):
+        if self._client:
+            await self._client.close()
+            self._client = None
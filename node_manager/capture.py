@@ -0,0 +1,363 @@
+from queue import Queue, Empty
+from struct import Struct
+from typing import Callable, Iterable
+import asyncio
+import threading
+import time
+from .wmediumd import AsyncWmediumdClient, WmediumdEvent, WmediumdSubscription, WmediumdMsgType, HwsimAttr
+
+import logging
+log = logging.getLogger(__name__)
+
+
+HWSIM_CMD_FRAME = 2
+LINKTYPE_IEEE802_11_RADIOTAP = 127
+
+
+class FrameFilter:
+    '''
+    In-memory filter on 802.11 frames, by any address in the header and by frame type.
+
+    Usage example:
+    >>> FrameFilter(macaddrs={'02:00:00:00:01:00'}, frame_types={'mgmt', 'data'})
+    '''
+
+    FRAME_TYPES = {'mgmt': 0, 'ctrl': 1, 'data': 2, 'ext': 3}
+
+    macaddrs: frozenset[bytes] | None
+    frame_types: frozenset[int] | None
+
+    def __init__(self, macaddrs: Iterable[str] | None = None, frame_types: Iterable[str] | None = None):
+        self.macaddrs = frozenset(bytes.fromhex(macaddr.replace(':', '')) for macaddr in macaddrs) if macaddrs else None
+        try:
+            self.frame_types = frozenset(self.FRAME_TYPES[frame_type] for frame_type in frame_types) if frame_types else None
+        except KeyError as e:
+            raise ValueError(f"Invalid frame type {e}, expected one of {', '.join(self.FRAME_TYPES)}")
+
+    def __call__(self, frame: memoryview) -> bool:
+        if len(frame) < 10:
+            return False
+        if self.frame_types is not None and (frame[0] >> 2) & 0x3 not in self.frame_types:
+            return False
+        if self.macaddrs is not None:
+            # addr1 is always there, addr2/addr3 only on longer frames
+            if not any(bytes(frame[offset:offset+6]) in self.macaddrs for offset in (4, 10, 16) if len(frame) >= offset + 6):
+                return False
+        return True
+
+
+class PcapngRing:
+    '''
+    pcapng output through a preallocated ring of chunks. The producer encodes blocks straight into
+    the current chunk, full chunks are written by a writer thread in one write each. If the writer
+    falls behind and every chunk is in flight, blocks are dropped and counted in `dropped`.
+
+    Files rotate once they reach `rotate_bytes` or are `rotate_seconds` old, as
+    `<stem>-0001.pcapng`, `<stem>-0002.pcapng`, ...
+
+    Everything on the producer side, `tick()` included, must be called from one thread. Call `tick()`
+    every `flush_interval` so a quiet capture still reaches the disk and still rotates on time.
+    '''
+
+    _struct_shb = Struct('=IIIHHq')
+    _struct_idb = Struct('=IIHHI')
+    _struct_epb = Struct('=IIIIIII')
+    _struct_option = Struct('=HH')
+    _struct_u32 = Struct('=I')
+
+    chunk_size: int
+    chunk_count: int
+    flush_interval: float
+    rotate_bytes: int | None
+    rotate_seconds: float | None
+
+    dropped: int
+    written: int
+
+    _stem: str
+    _file_index: int
+    _file: object
+    _file_bytes: int
+    _file_opened: float
+    _chunks: list[bytearray]
+    _free: Queue
+    _full: Queue
+    _current: int | None
+    _offset: int
+    _idbs: list[bytes]
+    _chunk_idb_base: list[int]
+    _thread: threading.Thread
+    _last_flush: float
+
+    def __init__(self, path: str, chunk_size: int = 1 << 20, chunk_count: int = 16, flush_interval: float = 1.0,
+                 rotate_bytes: int | None = None, rotate_seconds: float | None = None):
+        self.chunk_size = chunk_size
+        self.chunk_count = chunk_count
+        self.flush_interval = flush_interval
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.dropped = 0
+        self.written = 0
+
+        self._stem = path.removesuffix('.pcapng')
+        self._file_index = 0
+        self._file = None
+
+        self._chunks = [bytearray(chunk_size) for _ in range(chunk_count)]
+        self._chunk_idb_base = [0] * chunk_count
+        self._free = Queue()
+        self._full = Queue()
+        for index in range(chunk_count):
+            self._free.put(index)
+        self._idbs = []
+        self._current = None
+        self._offset = 0
+        self._last_flush = time.monotonic()
+
+        self._thread = threading.Thread(target=self._writer_loop, name='jk-pcapng', daemon=True)
+        self._thread.start()
+
+    def __repr__(self):
+        return f'<PcapngRing {self._stem} {self.written} bytes written, {self.dropped} dropped>'
+
+    def _shb(self) -> bytes:
+        return self._struct_shb.pack(0x0A0D0D0A, 28, 0x1A2B3C4D, 1, 0, -1) + self._struct_u32.pack(28)
+
+    @classmethod
+    def _options(cls, *options: tuple[int, bytes]) -> bytes:
+        out = bytearray()
+        for code, value in options:
+            out += cls._struct_option.pack(code, len(value)) + value + b'\0' * (-len(value) % 4)
+        out += cls._struct_option.pack(0, 0)
+        return bytes(out)
+
+    # --- writer thread
+
+    def _open_next(self, idb_count: int):
+        if self._file:
+            self._file.close()
+        self._file_index += 1
+        self._file = open(f'{self._stem}-{self._file_index:04d}.pcapng', 'wb', buffering=0)
+        self._file_opened = time.monotonic()
+
+        # a fresh section needs every interface declared before the chunk being written
+        header = self._shb() + b''.join(self._idbs[:idb_count])
+        self._file.write(header)
+        self._file_bytes = len(header)
+
+    def _due_rotation(self) -> bool:
+        if self.rotate_bytes and self._file_bytes >= self.rotate_bytes:
+            return True
+        if self.rotate_seconds and time.monotonic() - self._file_opened >= self.rotate_seconds:
+            return True
+        return False
+
+    def _writer_loop(self):
+        while True:
+            item = self._full.get()
+            if item is None:
+                break
+            index, length = item
+            if index is None:
+                # idle tick, nothing pending: every interface so far is already in a written chunk
+                if self._file is not None and self._due_rotation():
+                    self._open_next(length)
+                continue
+
+            if self._file is None or self._due_rotation():
+                self._open_next(self._chunk_idb_base[index])
+            self._file.write(memoryview(self._chunks[index])[:length])
+            self._file_bytes += length
+            self.written += length
+            self._free.put(index)
+
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    # --- producer side
+
+    def _flush_current(self):
+        if self._current is not None and self._offset:
+            self._full.put((self._current, self._offset))
+            self._current = None
+            self._offset = 0
+        self._last_flush = time.monotonic()
+
+    def _reserve(self, length: int) -> memoryview | None:
+        if length > self.chunk_size:
+            return None
+        if self._current is not None and self._offset + length > self.chunk_size:
+            self._flush_current()
+        if self._current is None:
+            try:
+                self._current = self._free.get_nowait()
+            except Empty:
+                return None
+            self._offset = 0
+            self._chunk_idb_base[self._current] = self._current_idb_base
+
+        view = memoryview(self._chunks[self._current])[self._offset:self._offset+length]
+        self._offset += length
+        return view
+
+    @property
+    def _current_idb_base(self) -> int:
+        # interfaces declared before the first block of the current chunk
+        return len(self._idbs)
+
+    def add_interface(self, name: str, linktype: int = LINKTYPE_IEEE802_11_RADIOTAP) -> int:
+        options = self._options((2, name.encode()))     # if_name
+        length = self._struct_idb.size + len(options) + 4
+        block = self._struct_idb.pack(1, length, linktype, 0, 0) + options + self._struct_u32.pack(length)
+
+        view = self._reserve(length)
+        if view is None:
+            raise BufferError('pcapng ring is full, cannot declare interface')
+        view[:] = block
+        self._idbs.append(block)
+        return len(self._idbs) - 1
+
+    def add_packet(self, interface_id: int, timestamp_ns: int, *parts: memoryview | bytes) -> bool:
+        captured = sum(len(part) for part in parts)
+        padding = -captured % 4
+        length = self._struct_epb.size + captured + padding + 4
+
+        view = self._reserve(length)
+        if view is None:
+            self.dropped += 1
+            return False
+
+        timestamp_us = timestamp_ns // 1000
+        self._struct_epb.pack_into(view, 0, 6, length, interface_id, timestamp_us >> 32, timestamp_us & 0xffffffff, captured, captured)
+        offset = self._struct_epb.size
+        for part in parts:
+            view[offset:offset+len(part)] = part
+            offset += len(part)
+        view[offset:offset+padding] = b'\0' * padding
+        self._struct_u32.pack_into(view, offset + padding, length)
+
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self._flush_current()
+        return True
+
+    def flush(self):
+        self._flush_current()
+
+    def tick(self):
+        '''
+        Flushes the current chunk if it is `flush_interval` old, and lets the writer rotate an idle file.
+        '''
+        if time.monotonic() - self._last_flush < self.flush_interval:
+            return
+        self._flush_current()
+        self._full.put((None, len(self._idbs)))
+
+    def close(self):
+        self._flush_current()
+        self._full.put(None)
+        self._thread.join()
+
+
+class MediumCapture:
+    '''
+    Capture of everything on the simulated air, from the wmediumd API.
+    One pcapng stream for the whole medium, with one interface per transmitter MAC address.
+
+    Usage example:
+    >>> client = await AsyncWmediumdClient.connect()
+    >>> capture = MediumCapture(client, '/tmp/medium.pcapng', rotate_bytes=100 << 20)
+    >>> await capture.start()
+    >>> ...
+    >>> await capture.stop()
+    '''
+
+    _struct_radiotap = Struct('<BBHIHHb')
+    _struct_s32 = Struct('=i')
+    _struct_u32 = Struct('=I')
+
+    ring: PcapngRing
+    frame_filter: Callable[[memoryview], bool] | None
+    filtered: int
+
+    _client: AsyncWmediumdClient
+    _subscription: WmediumdSubscription | None
+    _task: asyncio.Task | None
+    _flush_task: asyncio.Task | None
+    _interfaces: dict[bytes, int]
+
+    def __init__(self, client: AsyncWmediumdClient, path: str, frame_filter: Callable[[memoryview], bool] | None = None,
+                 queue_size: int = 4096, **ring_kwargs):
+        self._client = client
+        self._queue_size = queue_size
+        self.ring = PcapngRing(path, **ring_kwargs)
+        self.frame_filter = frame_filter
+        self.filtered = 0
+        self._subscription = None
+        self._task = None
+        self._flush_task = None
+        self._interfaces = {}
+
+    def __repr__(self):
+        dropped = self.ring.dropped + (self._subscription.dropped if self._subscription else 0)
+        return f'<MediumCapture {len(self._interfaces)} transmitters, {self.filtered} filtered, {dropped} dropped>'
+
+    def _interface_of(self, macaddr: bytes) -> int:
+        interface_id = self._interfaces.get(macaddr)
+        if interface_id is None:
+            interface_id = self._interfaces[macaddr] = self.ring.add_interface(macaddr.hex(':'))
+        return interface_id
+
+    def _radiotap(self, attrs: dict[int, memoryview]) -> bytes:
+        # present: channel (bit 3) and antenna signal in dBm (bit 5)
+        freq = self._struct_u32.unpack(attrs[HwsimAttr.FREQ])[0] if HwsimAttr.FREQ in attrs else 0
+        signal = self._struct_s32.unpack(attrs[HwsimAttr.SIGNAL])[0] if HwsimAttr.SIGNAL in attrs else -128
+        channel_flags = 0x0100 if freq > 4000 else 0x0080
+        return self._struct_radiotap.pack(0, 0, self._struct_radiotap.size, (1 << 3) | (1 << 5), freq, channel_flags, max(-128, min(127, signal)))
+
+    def _capture(self, event: WmediumdEvent):
+        cmd, attrs = event.netlink()
+        frame = attrs.get(HwsimAttr.FRAME)
+        if cmd != HWSIM_CMD_FRAME or frame is None:
+            return
+        if self.frame_filter and not self.frame_filter(frame):
+            self.filtered += 1
+            return
+
+        if len(frame) >= 16:
+            transmitter = bytes(frame[10:16])
+        else:
+            # ACK/CTS carry no transmitter address, use the radio hwsim says sent it
+            transmitter = bytes(attrs.get(HwsimAttr.ADDR_TRANSMITTER, b'\0' * 6))
+        self.ring.add_packet(self._interface_of(transmitter), time.time_ns(), self._radiotap(attrs), frame)
+
+    async def _run(self):
+        async for event in self._subscription:
+            try:
+                self._capture(event)
+            except Exception as e:
+                log.warning(f"Failed to capture frame: {e}")
+
+    async def _flush_loop(self):
+        # on the loop thread, same as the producer, so the ring needs no lock
+        while True:
+            await asyncio.sleep(self.ring.flush_interval)
+            self.ring.tick()
+
+    async def start(self):
+        self._subscription = self._client.subscribe({WmediumdMsgType.NETLINK}, self._queue_size)
+        await self._client.enable_frames(tx_start=False)
+        loop = asyncio.get_running_loop()
+        self._task = loop.create_task(self._run())
+        self._flush_task = loop.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._flush_task:
+            self._flush_task.cancel()
+            self._flush_task = None
+        if self._subscription:
+            self._subscription.close()
+        if self._task:
+            await self._task
+            self._task = None
+        await asyncio.to_thread(self.ring.close)
@@ -0,0 +1,177 @@
+from typing import Callable
+from time import sleep
+import threading
+import weakref
+from docker import DockerClient
+from docker.errors import DockerException
+from requests.exceptions import RequestException
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class ContainerStateCache:
+    '''
+    State of the `jk-` containers, kept up to date from one long-lived docker `/events` stream.
+    One cache is shared by everything using the same DockerClient.
+
+    Usage example:
+    >>> cache = ContainerStateCache.shared(docker_client)
+    >>> cache.status('jk-test1')
+    'running'
+    >>> cache.watch('jk-test1', lambda name, action, attributes: ...)
+
+    Watchers are called from the events thread with the container name, the docker action
+    (create, start, die, destroy, ...) and the event's actor attributes.
+    '''
+
+    name_prefix = 'jk-'
+    reconnect_delay = 1.0
+
+    # container status after each action, actions not listed leave it as is
+    ACTION_STATUS = {
+        'create': 'created',
+        'start': 'running',
+        'restart': 'running',
+        'unpause': 'running',
+        'pause': 'paused',
+        'die': 'exited',
+        'stop': 'exited',
+        'destroy': 'removed',
+    }
+
+    _shared: 'weakref.WeakKeyDictionary[DockerClient, ContainerStateCache]' = weakref.WeakKeyDictionary()
+    _shared_lock = threading.Lock()
+
+    _dockclt: DockerClient
+    _states: dict[str, str]
+    _exit_codes: dict[str, int]
+    _watchers: dict[str, list[Callable[[str, str, dict], None]]]
+    _lock: threading.Lock
+    _synced: threading.Event
+    _stream = None
+    _thread: threading.Thread | None
+    _stopping: bool
+
+    def __init__(self, docker_client: DockerClient):
+        self._dockclt = docker_client
+        self._states = {}
+        self._exit_codes = {}
+        self._watchers = {}
+        self._lock = threading.Lock()
+        self._synced = threading.Event()
+        self._stream = None
+        self._thread = None
+        self._stopping = False
+
+    def __repr__(self):
+        return f'<ContainerStateCache {len(self._states)} containers{"" if self._synced.is_set() else " syncing"}>'
+
+    @classmethod
+    def shared(cls, docker_client: DockerClient) -> 'ContainerStateCache':
+        with cls._shared_lock:
+            cache = cls._shared.get(docker_client)
+            if cache is None:
+                cache = cls._shared[docker_client] = cls(docker_client)
+                cache.start()
+            return cache
+
+    def _seed(self):
+        containers = self._dockclt.containers.list(all=True, filters={'name': self.name_prefix})
+        with self._lock:
+            self._states = {container.name: container.status for container in containers if container.name.startswith(self.name_prefix)}
+        self._synced.set()
+
+    def _handle(self, event: dict):
+        actor = event.get('Actor', {})
+        attributes = actor.get('Attributes', {})
+        name = attributes.get('name', '')
+        if not name.startswith(self.name_prefix):
+            return
+
+        # exec_start: ..., health_status: ... carry a suffix after the action itself
+        action = event.get('Action', event.get('status', '')).split(':')[0]
+        status = self.ACTION_STATUS.get(action)
+        with self._lock:
+            if action == 'die' and 'exitCode' in attributes:
+                self._exit_codes[name] = int(attributes['exitCode'])
+            if status == 'removed':
+                self._states.pop(name, None)
+                self._exit_codes.pop(name, None)
+            elif status:
+                self._states[name] = status
+            watchers = list(self._watchers.get(name, ()))
+
+        for watcher in watchers:
+            try:
+                watcher(name, action, attributes)
+            except Exception as e:
+                log.warning(f"Container {name} {action} watcher failed: {type(e).__name__}: {e}")
+
+    def _run(self):
+        while not self._stopping:
+            try:
+                # subscribe first so nothing falls between listing and streaming
+                self._stream = self._dockclt.events(decode=True, filters={'type': 'container'})
+                self._seed()
+                for event in self._stream:
+                    self._handle(event)
+            except (DockerException, RequestException, OSError, ValueError) as e:
+                if self._stopping:
+                    break
+                log.warning(f"Docker events stream broke ({e}), reconnecting")
+            finally:
+                self._synced.clear()
+                self._stream = None
+
+            if not self._stopping:
+                sleep(self.reconnect_delay)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='jk-dockerevents', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping = True
+        if self._stream is not None:
+            self._stream.close()
+        if self._thread is not None:
+            self._thread.join(timeout=5.0)
+            self._thread = None
+
+    def wait_synced(self, timeout: float | None = None) -> bool:
+        return self._synced.wait(timeout)
+
+    def status(self, name: str) -> str | None:
+        '''
+        Cached status of container `name`, 'removed' if docker does not know it. Returns None while
+        the stream is not (re)synced, callers fall back to asking docker then.
+        '''
+        if not self._synced.is_set():
+            return None
+        with self._lock:
+            return self._states.get(name, 'removed')
+
+    def exit_code(self, name: str) -> int | None:
+        with self._lock:
+            return self._exit_codes.get(name)
+
+    def update(self, name: str, status: str):
+        '''Record a status learnt elsewhere, e.g. from an inspect done anyway.'''
+        with self._lock:
+            self._states[name] = status
+
+    def watch(self, name: str, watcher: Callable[[str, str, dict], None]):
+        with self._lock:
+            self._watchers.setdefault(name, []).append(watcher)
+
+    def unwatch(self, name: str, watcher: Callable[[str, str, dict], None]):
+        with self._lock:
+            watchers = self._watchers.get(name, [])
+            if watcher in watchers:
+                watchers.remove(watcher)
+            if not watchers:
+                self._watchers.pop(name, None)
@@ -0,0 +1,55 @@
+import threading
+from docker import DockerClient
+
+import logging
+log = logging.getLogger(__name__)
+
+
+FLEET_LABEL = 'jaringkan.fleet'
+
+
+class DockerPool:
+    '''
+    Process-wide docker client. Everything created without an explicit client shares its
+    keep-alive connection pool, instead of every router holding a pool of its own.
+
+    Usage example:
+    >>> DockerPool.configure(pool_size=64)      # before first use
+    >>> client = DockerPool.client()
+
+    urllib3 does not fail when the pool is exhausted, it opens and then discards extra
+    connections, so `pool_size` should cover the number of concurrent docker calls.
+    '''
+
+    pool_size = 32
+    base_url: str | None = None
+
+    _client: DockerClient | None = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def configure(cls, pool_size: int | None = None, base_url: str | None = None):
+        with cls._lock:
+            if cls._client is not None:
+                if (base_url or cls.base_url) != cls.base_url or (pool_size or 0) > cls.pool_size:
+                    log.warning("Docker client already created, pool configuration unchanged")
+                return
+
+            if pool_size is not None:
+                cls.pool_size = pool_size
+            if base_url is not None:
+                cls.base_url = base_url
+
+    @classmethod
+    def client(cls) -> DockerClient:
+        with cls._lock:
+            if cls._client is None:
+                cls._client = DockerClient(cls.base_url, max_pool_size=cls.pool_size)
+            return cls._client
+
+    @classmethod
+    def close(cls):
+        with cls._lock:
+            if cls._client is not None:
+                cls._client.close()
+                cls._client = None
@@ -0,0 +1,312 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Iterable
+from time import monotonic
+import atexit
+import os
+import select
+import signal
+import subprocess
+from random import randint
+from docker import DockerClient
+from docker.errors import DockerException
+from .router import Router
+from .linuxutils import RtNetlink
+from .dockerpool import DockerPool, FLEET_LABEL
+from .journal import StateJournal
+from .wmediumd import Wmediumd
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class Fleet:
+    '''
+    A group of routers that are created and started concurrently.
+
+    Usage example:
+    >>> fleet = Fleet(max_workers=32)
+    >>> results = fleet.up(f'node{i}' for i in range(200))
+    >>> failed = [hostname for hostname, error in results.items() if error]
+
+    Every batch operation returns a dict of hostname to the exception raised for it,
+    or its result if it succeeded (None for most). One bad router never aborts the rest of the batch.
+    '''
+
+    routers: dict[str, Router]
+    max_workers: int
+    fleet_id: str
+
+    _dockclt: DockerClient
+    _pool: ThreadPoolExecutor | None
+
+    def __init__(self, max_workers: int = 16, docker_connection: None|str|DockerClient = None, fleet_id: str | None = None):
+        if docker_connection is None:
+            # the process-wide client, its connection pool sized for the workers
+            DockerPool.configure(pool_size=max(max_workers, DockerPool.pool_size))
+            self._dockclt = DockerPool.client()
+        elif isinstance(docker_connection, str):
+            self._dockclt = DockerClient(docker_connection, max_pool_size=max_workers)
+        elif isinstance(docker_connection, DockerClient):
+            self._dockclt = docker_connection
+        else:
+            raise TypeError(f"docker_connection must be str or DockerClient, not {type(docker_connection)}")
+
+        self.routers = {}
+        self.max_workers = max_workers
+        # the journaled one by default, so `attach` finds what the previous controller left behind
+        self.fleet_id = fleet_id or StateJournal.fleet_id() or f'{randint(0x100000, 0xffffff):x}'
+        StateJournal.record_fleet_id(self.fleet_id)
+        self._pool = None
+
+        # atexit runs before interpreter finalization, unlike __del__ of each router
+        atexit.register(self.shutdown)
+
+    def __del__(self):
+        if getattr(self, '_pool', None):
+            self._pool.shutdown(wait=False)
+
+    def __repr__(self):
+        return f'<Fleet {self.fleet_id} {len(self.routers)} routers>'
+
+    def __len__(self):
+        return len(self.routers)
+
+    def __iter__(self):
+        return iter(self.routers.values())
+
+    def __getitem__(self, hostname: str):
+        return self.routers[hostname]
+
+    @property
+    def labels(self) -> dict[str, str]:
+        return {FLEET_LABEL: self.fleet_id}
+
+    @property
+    def _label_filter(self) -> dict[str, str]:
+        return {'label': f'{FLEET_LABEL}={self.fleet_id}'}
+
+    def _map(self, fn: Callable[[str], object], hostnames: Iterable[str]) -> dict[str, object]:
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(self.max_workers, thread_name_prefix='jk-fleet')
+
+        futures = {self._pool.submit(fn, hostname): hostname for hostname in hostnames}
+        results = {}
+        for future in as_completed(futures):
+            hostname = futures[future]
+            try:
+                results[hostname] = future.result()
+            except Exception as e:
+                log.warning(f"Router {hostname}: {type(e).__name__}: {e}")
+                results[hostname] = e
+        return results
+
+    def _create_one(self, hostname: str):
+        if hostname in self.routers:
+            raise ValueError(f"Router {hostname} already exist in fleet")
+        router = Router(hostname, self._dockclt, self.labels)
+        # teardown is the fleet's job, see shutdown()
+        atexit.unregister(router.__del__)
+        self.routers[hostname] = router
+
+    def _attach_one(self, hostname: str):
+        if hostname in self.routers:
+            raise ValueError(f"Router {hostname} already exist in fleet")
+        router = Router.attach(hostname, self._dockclt)
+        atexit.unregister(router.__del__)
+        self.routers[hostname] = router
+
+    def _up_one(self, hostname: str):
+        if hostname not in self.routers:
+            self._create_one(hostname)
+        self.routers[hostname].start()
+
+    def _remove_one(self, hostname: str):
+        self.routers[hostname].remove()
+        del self.routers[hostname]
+
+    def create(self, hostnames: Iterable[str]) -> dict[str, Exception | None]:
+        return self._map(self._create_one, hostnames)
+
+    def start_all(self) -> dict[str, Exception | None]:
+        return self._map(lambda hostname: self.routers[hostname].start(), list(self.routers))
+
+    def stop_all(self) -> dict[str, Exception | None]:
+        return self._map(lambda hostname: self.routers[hostname].stop(), list(self.routers))
+
+    def attach(self) -> dict[str, Exception | None]:
+        '''
+        Adopt the routers of this fleet (found by `fleet_id`, the journaled one unless given) that a previous
+        controller left behind, see `Router.attach`.
+        '''
+        hostnames = [container['Names'][0].lstrip('/').removeprefix('jk-') for container in self.containers()]
+        return self._map(self._attach_one, hostnames)
+
+    def detach(self):
+        '''
+        Leave every router running and let go of them, so the next controller can `attach` again.
+        wmediumd is left running with them, for `WirelessMedium.restore` to reconnect to.
+        '''
+        atexit.unregister(self.shutdown)
+        for router in self.routers.values():
+            router.detach()
+        self.routers.clear()
+        Wmediumd.detach()
+
+    def up(self, hostnames: Iterable[str]) -> dict[str, Exception | None]:
+        '''
+        Create and start routers in one pass. Each worker creates and immediately starts its router,
+        so docker round-trips of one router overlap with namespace work of the others.
+        '''
+        return self._map(self._up_one, hostnames)
+
+    def run_all(self, cmd: str | list[str], hostnames: Iterable[str] | None = None, **kwargs) -> dict[str, subprocess.CompletedProcess | Exception]:
+        '''
+        Runs the same command in every router (or in `hostnames`) concurrently, see `Router.run`.
+
+        Usage example:
+        >>> results = fleet.run_all('uci set network.lan.ipaddr=10.0.0.1 && uci commit')
+        >>> failed = [hostname for hostname, result in results.items() if isinstance(result, Exception) or result.returncode]
+        '''
+        return self._map(lambda hostname: self.routers[hostname].run(cmd, **kwargs), list(hostnames or self.routers))
+
+    def call_all(self, fn: Callable, *args, hostnames: Iterable[str] | None = None, **kwargs) -> dict[str, object]:
+        '''
+        Calls `fn(*args, **kwargs)` inside every router (or `hostnames`) at once, each on its router's
+        namespace worker (see `Router.submit`) instead of the fleet's pool.
+
+        Usage example:
+        >>> results = fleet.call_all(os.listdir, '/sys/class/net')
+        '''
+        futures = {}
+        results = {}
+        for hostname in list(hostnames or self.routers):
+            try:
+                futures[hostname] = self.routers[hostname].submit(fn, *args, **kwargs)
+            except Exception as e:
+                results[hostname] = e
+
+        for hostname, future in futures.items():
+            try:
+                results[hostname] = future.result()
+            except Exception as e:
+                log.warning(f"Router {hostname}: {type(e).__name__}: {e}")
+                results[hostname] = e
+        return results
+
+    def remove(self, hostnames: Iterable[str]) -> dict[str, Exception | None]:
+        '''
+        Stops and removes routers `hostnames` concurrently, the rest of the fleet keeps running.
+        '''
+        return self._map(self._remove_one, list(hostnames))
+
+    def containers(self) -> list[dict]:
+        '''
+        Summary of every container of this fleet (Id, Names, State, Status, Labels...) in one API call,
+        including containers of routers this process no longer knows about.
+        '''
+        return self._dockclt.api.containers(all=True, filters=self._label_filter)
+
+    def states(self) -> dict[str, str]:
+        return {container['Names'][0].lstrip('/'): container['State'] for container in self.containers()}
+
+    def remove_all(self) -> dict[str, Exception | None]:
+        '''
+        Stops every router, then removes all containers of the fleet with one prune call.
+        Routers whose container is still there afterwards, e.g. because it failed to stop, stay in the fleet.
+        '''
+        results = self.stop_all()
+        self._dockclt.containers.prune(filters=self._label_filter)
+
+        # prune only takes stopped containers, whatever survived is still ours to deal with
+        survivors = {container['Names'][0].lstrip('/') for container in self.containers()}
+        for hostname, router in list(self.routers.items()):
+            if router.container_name in survivors:
+                if results.get(hostname) is None:
+                    results[hostname] = RuntimeError(f"Router {hostname} is still there after removal")
+                continue
+            # already gone, don't let the router remove it again one by one
+            router._forget_container()
+            StateJournal.forget_router(hostname)
+            del self.routers[hostname]
+        return results
+
+    @staticmethod
+    def _wait_exit(pidfds: dict[int, str], deadline: float):
+        # a pidfd turns readable once its process exits
+        poller = select.poll()
+        for pidfd in pidfds:
+            poller.register(pidfd, select.POLLIN)
+        while pidfds and (remaining := deadline - monotonic()) > 0:
+            for pidfd, _ in poller.poll(remaining * 1000):
+                poller.unregister(pidfd)
+                pidfds.pop(pidfd)
+                os.close(pidfd)
+
+    def shutdown(self, deadline: float = 10.0) -> dict[str, Exception | None]:
+        '''
+        Tears the whole fleet down, bounded by `deadline` seconds for the routers to stop on their own.
+
+        Every container is sent SIGTERM at once, whatever is still alive at the deadline gets SIGKILL.
+        Then veths are deleted in one rtnetlink batch, PHYs are returned to the pool by the workers,
+        and the containers are removed by label. Registered with atexit, so it also runs on exit.
+        '''
+        atexit.unregister(self.shutdown)
+        until = monotonic() + deadline
+        routers = dict(self.routers)
+        results = {hostname: None for hostname in routers}
+
+        # stop signal to everyone, straight to the container init instead of one docker stop each
+        pidfds = {}
+        for hostname, router in routers.items():
+            router._forget_container()
+            if router.pid is None:
+                continue
+            try:
+                pidfd = os.pidfd_open(router.pid)
+                signal.pidfd_send_signal(pidfd, signal.SIGTERM)
+                pidfds[pidfd] = hostname
+            except ProcessLookupError:
+                pass
+
+        self._wait_exit(pidfds, until)
+        if pidfds:
+            log.warning(f"{len(pidfds)} routers did not stop in {deadline}s, killing them")
+            for pidfd in pidfds:
+                try:
+                    signal.pidfd_send_signal(pidfd, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+            self._wait_exit(pidfds, monotonic() + 1.0)
+            for pidfd, hostname in pidfds.items():
+                results[hostname] = TimeoutError(f"Router {hostname} survived SIGKILL")
+                os.close(pidfd)
+
+        # host side cleanup, veths in one batch, radios and LEDs on the workers
+        try:
+            with RtNetlink.host().batch() as batch:
+                for router in routers.values():
+                    batch.link_del(router.veth_name, missing_ok=True)
+        except OSError as e:
+            log.warning(f"Failed to remove veths: {e}")
+        for hostname, error in self._map(lambda hostname: routers[hostname]._on_stop(remove_veth=False), list(routers)).items():
+            results[hostname] = results[hostname] or error
+
+        # docker may still be catching up with the deaths, prune what it considers stopped and force the rest
+        try:
+            self._dockclt.containers.prune(filters=self._label_filter)
+            leftovers = {container['Id']: container['Names'][0].lstrip('/') for container in self.containers()}
+            if leftovers:
+                self._map(lambda container_id: self._dockclt.api.remove_container(container_id, force=True), list(leftovers))
+        except DockerException as e:
+            log.warning(f"Failed to remove containers of fleet {self.fleet_id}: {e}")
+
+        for hostname in routers:
+            StateJournal.forget_router(hostname)
+        self.routers.clear()
+        self.close()
+        return results
+
+    def close(self):
+        if self._pool:
+            self._pool.shutdown()
+            self._pool = None
@@ -0,0 +1,160 @@
+import json
+import os
+import threading
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class StateJournal:
+    '''
+    Small JSON file recording what the controller has set up, so a restarted controller can
+    adopt it instead of rebuilding the mesh (see `Router.attach`, `WirelessMedium.restore` and `Wmediumd.reattach`).
+
+    Journaling is off unless a state directory is set, through `enable()` or the
+    JARINGKAN_STATE_DIR environment variable. With it on, the radio stub netns is also
+    pinned there, so the radios inside routers keep working with the next controller.
+
+    Usage example:
+    >>> StateJournal.enable('/run/jaringkan')
+    >>> StateJournal.router('test1')
+    {'container_id': '4f1c...', 'hwsim': 'hwsim3', 'phy': 'phy3', 'macaddr': '02:00:00:00:03:00', 'veth': 'vjk-test1'}
+
+    The file is rewritten atomically on every change, callers should record at lifecycle
+    events (create, start, commit), not on every move.
+    '''
+
+    version = 1
+    directory: str | None = os.environ.get('JARINGKAN_STATE_DIR') or None
+
+    _state: dict | None = None
+    _lock = threading.RLock()
+
+    @classmethod
+    def enable(cls, directory: str | None):
+        with cls._lock:
+            cls.directory = directory
+            cls._state = None
+
+    @classmethod
+    def enabled(cls) -> bool:
+        return cls.directory is not None
+
+    @classmethod
+    def path(cls) -> str:
+        return os.path.join(cls.directory, 'state.json')
+
+    @classmethod
+    def stub_netns_path(cls) -> str | None:
+        return os.path.join(cls.directory, 'stub-net') if cls.directory else None
+
+    @classmethod
+    def _load(cls) -> dict:
+        if cls._state is None:
+            try:
+                with open(cls.path()) as f:
+                    state = json.load(f)
+                if state.get('version') != cls.version:
+                    raise ValueError(f"unsupported version {state.get('version')}")
+            except FileNotFoundError:
+                state = {}
+            except ValueError as e:
+                log.warning(f"Ignoring state journal {cls.path()}: {e}")
+                state = {}
+            state.setdefault('routers', {})
+            state.setdefault('medium', {})
+            state.setdefault('wmediumd', {})
+            state.setdefault('fleet_id', None)
+            state['version'] = cls.version
+            cls._state = state
+        return cls._state
+
+    @classmethod
+    def _save(cls):
+        os.makedirs(cls.directory, exist_ok=True)
+        tmp_path = cls.path() + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(cls._state, f, indent=1)
+        os.replace(tmp_path, cls.path())
+
+    @classmethod
+    def fleet_id(cls) -> str | None:
+        if not cls.enabled():
+            return None
+        with cls._lock:
+            return cls._load()['fleet_id']
+
+    @classmethod
+    def record_fleet_id(cls, fleet_id: str):
+        if not cls.enabled():
+            return
+        with cls._lock:
+            state = cls._load()
+            if state['fleet_id'] != fleet_id:
+                state['fleet_id'] = fleet_id
+                cls._save()
+
+    @classmethod
+    def routers(cls) -> dict[str, dict]:
+        if not cls.enabled():
+            return {}
+        with cls._lock:
+            return {hostname: dict(record) for hostname, record in cls._load()['routers'].items()}
+
+    @classmethod
+    def router(cls, hostname: str) -> dict | None:
+        return cls.routers().get(hostname)
+
+    @classmethod
+    def record_router(cls, hostname: str, **fields):
+        if not cls.enabled():
+            return
+        with cls._lock:
+            cls._load()['routers'].setdefault(hostname, {}).update(fields)
+            cls._save()
+
+    @classmethod
+    def forget_router(cls, hostname: str):
+        if not cls.enabled():
+            return
+        with cls._lock:
+            state = cls._load()
+            removed = [state[section].pop(hostname, None) for section in ('routers', 'medium')]
+            if any(record is not None for record in removed):
+                cls._save()
+
+    @classmethod
+    def medium(cls) -> dict[str, dict]:
+        if not cls.enabled():
+            return {}
+        with cls._lock:
+            return {hostname: dict(record) for hostname, record in cls._load()['medium'].items()}
+
+    @classmethod
+    def record_medium(cls, placements: dict[str, dict]):
+        '''Replace the recorded medium, hostname -> {'x', 'y', 'tx_power'}.'''
+        if not cls.enabled():
+            return
+        with cls._lock:
+            cls._load()['medium'] = placements
+            cls._save()
+
+    @classmethod
+    def wmediumd(cls) -> dict:
+        '''The running wmediumd, {'pid', 'api_socket', 'config'}, or {} if none was recorded.'''
+        if not cls.enabled():
+            return {}
+        with cls._lock:
+            return dict(cls._load()['wmediumd'])
+
+    @classmethod
+    def record_wmediumd(cls, **fields):
+        '''Replace the recorded wmediumd, nothing given forgets it.'''
+        if not cls.enabled():
+            return
+        with cls._lock:
+            state = cls._load()
+            if state['wmediumd'] == fields:
+                return
+            state['wmediumd'] = fields
+            cls._save()
@@ -0,0 +1,196 @@
+from typing import Sequence
+import numpy as np
+from .wmediumd import WmediumdConfigPathLoss, WmediumdConfigSNR, WmediumdConfigErrorProb
+
+
+# same constants as wmediumd's path_loss model
+FREQ_1CH = 2.412e9
+SPEED_LIGHT = 2.99792458e8
+NOISE_LEVEL = -91.0
+PATH_LOSS_REF = 20 * np.log10(4 * np.pi * 1.0 * FREQ_1CH / SPEED_LIGHT)    # free-space loss at 1 meter
+
+
+def erfc(x: np.ndarray) -> np.ndarray:
+    # Abramowitz & Stegun 7.1.26, good to 1.5e-7, for x >= 0
+    t = 1.0 / (1.0 + 0.3275911 * x)
+    poly = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429))))
+    return poly * np.exp(-x * x)
+
+
+class LinkBudget:
+    '''
+    Pairwise link quality under wmediumd's log-distance path loss model, computed with NumPy.
+
+    Usage example:
+    >>> budget = LinkBudget(macaddrs, positions, tx_powers, path_loss_exp=3.5, xg=0.0, min_snr=0.0)
+    >>> src, dst, snr = budget.links
+    >>> budget.to_error_prob_config().export(out_file)
+
+    Links are directional, `src` transmits and `dst` receives. Only links at or above `min_snr`
+    are kept, as sparse (src, dst, snr) arrays. The matrices are computed in blocks of rows,
+    so memory stays bounded for thousands of nodes.
+    '''
+
+    block_size = 1024
+    min_distance = 1.0      # the model is referenced at 1 meter
+
+    macaddrs: list[str]
+    positions: np.ndarray
+    tx_powers: np.ndarray
+    path_loss_exp: float
+    xg: float
+    min_snr: float
+    frame_len: int
+
+    _links: tuple[np.ndarray, np.ndarray, np.ndarray] | None
+
+    def __init__(self, macaddrs: Sequence[str], positions, tx_powers, path_loss_exp: float = 3.5, xg: float = 0.0, min_snr: float = 0.0, frame_len: int = 1500):
+        self.macaddrs = list(macaddrs)
+        self.positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        self.tx_powers = np.broadcast_to(np.asarray(tx_powers, dtype=np.float64), (len(self.macaddrs),)).copy()
+        if len(self.positions) != len(self.macaddrs):
+            raise ValueError(f"Got {len(self.positions)} positions for {len(self.macaddrs)} interfaces")
+
+        self.path_loss_exp = path_loss_exp
+        self.xg = xg
+        self.min_snr = min_snr
+        self.frame_len = frame_len
+        self._links = None
+
+    def __len__(self):
+        return len(self.macaddrs)
+
+    def __repr__(self):
+        return f'<LinkBudget {len(self)} nodes, {len(self.links[0])} links>'
+
+    @classmethod
+    def from_config(cls, wmdconfig: WmediumdConfigPathLoss, **kwargs):
+        return cls(wmdconfig.ifaces, wmdconfig.positions, wmdconfig.tx_powers, wmdconfig.path_loss_exp, wmdconfig.xg, **kwargs)
+
+    @classmethod
+    def path_loss(cls, distance: np.ndarray, path_loss_exp: float, xg: float) -> np.ndarray:
+        return PATH_LOSS_REF + 10.0 * path_loss_exp * np.log10(np.maximum(distance, cls.min_distance)) + xg
+
+    @staticmethod
+    def error_prob(snr: np.ndarray, frame_len: int = 1500) -> np.ndarray:
+        '''
+        Frame error probability from SNR in dB, BPSK bit errors over a whole frame. An approximation,
+        wmediumd itself picks from per-rate tables.
+        '''
+        snr_linear = np.power(10.0, np.asarray(snr, dtype=np.float64) / 10.0)
+        ber = np.minimum(0.5 * erfc(np.sqrt(snr_linear)), 0.5)
+        return -np.expm1(8 * frame_len * np.log1p(-ber))
+
+    def _snr_block(self, rows: slice) -> np.ndarray:
+        delta = self.positions[rows, None, :] - self.positions[None, :, :]
+        distance = np.sqrt(np.einsum('ijk,ijk->ij', delta, delta))
+        snr = self.tx_powers[rows, None] - self.path_loss(distance, self.path_loss_exp, self.xg) - NOISE_LEVEL
+
+        # nobody hears themselves
+        index = np.arange(rows.start, rows.stop)
+        snr[index - rows.start, index] = -np.inf
+        return snr
+
+    def _blocks(self):
+        for start in range(0, len(self), self.block_size):
+            yield slice(start, min(start + self.block_size, len(self)))
+
+    def distance_matrix(self) -> np.ndarray:
+        delta = self.positions[:, None, :] - self.positions[None, :, :]
+        return np.sqrt(np.einsum('ijk,ijk->ij', delta, delta))
+
+    def snr_matrix(self) -> np.ndarray:
+        '''Dense SNR matrix, only sensible for small topologies.'''
+        return np.concatenate([self._snr_block(rows) for rows in self._blocks()]) if len(self) else np.empty((0, 0))
+
+    @property
+    def links(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        if self._links is None:
+            srcs, dsts, snrs = [], [], []
+            for rows in self._blocks():
+                snr = self._snr_block(rows)
+                src, dst = np.nonzero(snr >= self.min_snr)
+                srcs.append(src + rows.start)
+                dsts.append(dst)
+                snrs.append(snr[src, dst])
+
+            if srcs:
+                self._links = (np.concatenate(srcs), np.concatenate(dsts), np.concatenate(snrs))
+            else:
+                self._links = (np.empty(0, np.intp), np.empty(0, np.intp), np.empty(0))
+        return self._links
+
+    @property
+    def error_probs(self) -> np.ndarray:
+        return self.error_prob(self.links[2], self.frame_len)
+
+    def _keys(self) -> np.ndarray:
+        src, dst, _ = self.links
+        return src * len(self) + dst
+
+    def symmetric_links(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        '''
+        Links usable in both directions as (i, j, snr) with i < j, taking the worse direction.
+        wmediumd's snr and prob models only know symmetric links.
+        '''
+        src, dst, snr = self.links
+        n = len(self)
+        forward = src < dst
+        reverse = ~forward
+        keys_forward = src[forward] * n + dst[forward]
+        keys_reverse = dst[reverse] * n + src[reverse]
+
+        keys, index_forward, index_reverse = np.intersect1d(keys_forward, keys_reverse, assume_unique=True, return_indices=True)
+        return keys // n, keys % n, np.minimum(snr[forward][index_forward], snr[reverse][index_reverse])
+
+    def diff(self, other: 'LinkBudget', tolerance: float = 1.0) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        '''
+        Links that differ from `other` (same nodes in the same order) as (src, dst, old_snr, new_snr):
+        links whose SNR moved more than `tolerance` dB, and links that appeared or disappeared,
+        with -inf standing in for the missing side.
+        '''
+        if other.macaddrs != self.macaddrs:
+            raise ValueError('Can only diff link budgets of the same nodes')
+
+        n = len(self)
+        keys_new, keys_old = self._keys(), other._keys()
+        snr_new, snr_old = self.links[2], other.links[2]
+
+        common, index_new, index_old = np.intersect1d(keys_new, keys_old, assume_unique=True, return_indices=True)
+        changed = np.abs(snr_new[index_new] - snr_old[index_old]) > tolerance
+
+        appeared = np.isin(keys_new, common, assume_unique=True, invert=True)
+        vanished = np.isin(keys_old, common, assume_unique=True, invert=True)
+
+        keys = np.concatenate((common[changed], keys_new[appeared], keys_old[vanished]))
+        old = np.concatenate((snr_old[index_old][changed], np.full(appeared.sum(), -np.inf), snr_old[vanished]))
+        new = np.concatenate((snr_new[index_new][changed], snr_new[appeared], np.full(vanished.sum(), -np.inf)))
+        return keys // n, keys % n, old, new
+
+    def _config(self, wmdconfig):
+        for macaddr in self.macaddrs:
+            wmdconfig.add(macaddr)
+        return wmdconfig
+
+    def to_snr_config(self, floor_snr: int = -10) -> WmediumdConfigSNR:
+        '''
+        wmediumd would treat a missing link as a good one, so links that were cut off are written with `floor_snr`.
+        '''
+        wmdconfig = self._config(WmediumdConfigSNR())
+        n = len(self)
+
+        snr_pairs = np.full((n, n), floor_snr, dtype=np.int64)
+        i, j, snr = self.symmetric_links()
+        snr_pairs[i, j] = np.rint(snr)
+
+        i, j = np.triu_indices(n, 1)
+        wmdconfig.add_links(i.tolist(), j.tolist(), snr_pairs[i, j].tolist())
+        return wmdconfig
+
+    def to_error_prob_config(self) -> WmediumdConfigErrorProb:
+        # anything not listed is lost for sure
+        wmdconfig = self._config(WmediumdConfigErrorProb(default_prob=1.0))
+        i, j, snr = self.symmetric_links()
+        for i, j, prob in zip(i.tolist(), j.tolist(), self.error_prob(snr, self.frame_len).tolist()):
+            wmdconfig.add_link(i, j, prob)
+        return wmdconfig
@@ -1,16 +1,47 @@
-from enum import IntEnum
-from typing import Iterable
+import asyncio
+from enum import IntEnum, IntFlag
+from errno import EEXIST, EINVAL, ENODEV, ENOENT, ENOSYS, ESRCH
+from concurrent.futures import Future
+from queue import SimpleQueue
+from typing import Callable, Iterable
 import os
+import subprocess
+import threading
 from os import strerror, open as open_fd, close as close_fd, readlink, getcwd, chdir, setns, unshare
+from select import select
+from socket import socket, AF_NETLINK, SOCK_RAW, SOCK_CLOEXEC
+from struct import Struct
+from time import monotonic
 import ctypes, ctypes.util
+from .metrics import Metrics
 
 
 libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
 libc.mount.argtypes = (ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_ulong, ctypes.c_char_p)
 libc.umount.argtypes = (ctypes.c_char_p, ctypes.c_ulong)
+libc.inotify_init1.argtypes = (ctypes.c_int,)
+libc.inotify_add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+
+
+CLONE_FS = 0x00000200
+ENTER_ORDER = ('user', 'ipc', 'uts', 'net', 'time', 'pid', 'mnt')     # mnt last, it moves our root
 
 
 class Namespace:
+    '''
+    Namespaces to enter with `with`, each type given as a PID, a path, or True for a new anonymous one.
+
+    When several types come from the same PID, they are entered together with a single setns()
+    on a pidfd (Linux 5.8+). Leaving goes back to the namespaces this process started in, whose fds
+    are opened once at import, or to whatever the thread was in when nested inside another Namespace.
+    `only()` gives a view entering a subset, sharing the handles instead of reopening them.
+
+    Usage example:
+    >>> ns = Namespace(mnt=pid, net=pid, uts=pid)
+    >>> with ns.only('net'):
+    ...     sock = socket(AF_NETLINK, SOCK_RAW)
+    '''
+
     TYPES = frozenset(('ipc', 'mnt', 'net', 'pid', 'time', 'user', 'uts'))
     UNSHARE_FLAGS = {
         'ipc': os.CLONE_NEWIPC,
@@ -22,31 +53,49 @@ class Namespace:
         'uts': os.CLONE_NEWUTS
     }
 
+    # turned off for good the first time the kernel refuses setns() on a pidfd
+    use_pidfd = True
+
     _nstarget: dict[str,tuple[str,int|str]]
     _fd: dict[str,int]
-    _pre_enter_fd: dict[str,int]
+    _types: tuple[str, ...]
+    _pidfd: int | None
+    _parent: 'Namespace | None'
+    _tls: threading.local
 
-    _outside_wd: str | None
     _inside_wd: str | None
 
+    _host_fd: dict[str,int] = {}
+    _thread = threading.local()
+
     def __init__(self, **kwargs):
         self._nstarget = {}
         self._fd = {}
-        self._pre_enter_fd = {}
-        self._outside_wd = None
+        self._types = tuple(t for t in ENTER_ORDER if t in kwargs)
+        self._pidfd = None
+        self._parent = None
+        self._tls = threading.local()
         self._inside_wd = None
 
-        anon_ns = []
-        for t, target in kwargs.items():
+        for t in kwargs:
             if t not in Namespace.TYPES:
                 raise ValueError(f"Invalid namespace type '{t}'")
-            
+
+        pids = {target for target in kwargs.values() if type(target) is int}
+        if Namespace.use_pidfd and len(kwargs) > 1 and len(pids) == 1 and len(set(kwargs.values())) == 1:
+            # all from one process, enter them at once through its pidfd
+            self._pidfd = os.pidfd_open(pids.pop())
+
+        anon_ns = []
+        for t, target in kwargs.items():
             if target is True:
                 anon_ns.append(t)
             
             elif isinstance(target, int):     # PID
-                self._fd[t] = open_fd(f'/proc/{target}/ns/{t}', 0)
                 self._nstarget[t] = ('pid', target)
+                if self._pidfd is None or t == 'net':
+                    # net is handed to netlink too, and the fd keeps the netns alive with the PHYs in it
+                    self._fd[t] = open_fd(f'/proc/{target}/ns/{t}', 0)
 
             elif isinstance(target, str):   # absolute path
                 self._fd[t] = open_fd(target, 0)
@@ -57,7 +106,7 @@ class Namespace:
             
         if anon_ns:
             for t in anon_ns:
-                self._pre_enter_fd[t] = open_fd(f'/proc/self/ns/{t}', 0)
+                self._pre_enter_fd[t] = open_fd(f'/proc/thread-self/ns/{t}', 0)
 
             if 'mnt' in anon_ns:
                 # anonymount mnt namespace have my special ability to stay in the same cwd
@@ -66,8 +115,8 @@ class Namespace:
 
             unshare(sum(Namespace.UNSHARE_FLAGS[t] for t in anon_ns))
             for t in anon_ns:
-                self._fd[t] = open_fd(f'/proc/self/ns/{t}', 0)
-                self._nstarget[t] = ('anon', readlink(f'/proc/self/ns/{t}'))
+                self._fd[t] = open_fd(f'/proc/thread-self/ns/{t}', 0)
+                self._nstarget[t] = ('anon', readlink(f'/proc/thread-self/ns/{t}'))
 
             # restore namespace
             for t, fd in self._pre_enter_fd.items():
@@ -78,77 +127,167 @@ class Namespace:
             if 'mnt' in anon_ns:
                 chdir(self._outside_wd)
 
+    def only(self, *types: str) -> 'Namespace':
+        '''
+        A view of this Namespace entering only `types`. It shares (and keeps alive) the handles of this one.
+        '''
+        for t in types:
+            if t not in self._nstarget:
+                raise ValueError(f"Namespace type '{t}' not in {self}")
+
+        view = Namespace.__new__(Namespace)
+        view._nstarget = {t: self._nstarget[t] for t in types}
+        view._fd = {}
+        view._types = tuple(t for t in ENTER_ORDER if t in types)
+        view._pidfd = self._pidfd
+        view._parent = self._parent or self
+        view._tls = threading.local()
+        view._inside_wd = self._inside_wd
+        return view
+
     def __repr__(self):
         nstargets = []
         for t, (target_type, target) in self._nstarget.items():
+            handle = self._fd_of(t) if self._pidfd is None else f'pidfd{self._pidfd}'
             if target_type == 'pid':
-                nstargets.append(f'{t}@{self._fd[t]}=PID:{target}')
+                nstargets.append(f'{t}@{handle}=PID:{target}')
             elif target_type == 'path':
-                nstargets.append(f'{t}@{self._fd[t]}=Path:{target}')
+                nstargets.append(f'{t}@{handle}=Path:{target}')
             elif target_type == 'anon':
-                nstargets.append(f'{t}@{self._fd[t]}={target}')
+                nstargets.append(f'{t}@{handle}={target}')
         return f'<Namespace {",".join(nstargets)}>'
 
+    # NOTE: setns() only switches the calling thread, so whatever we need to return to
+    #       is kept per thread. This allows the same Namespace to be entered concurrently.
+    @property
+    def _pre_enter_fd(self) -> dict[str,int]:
+        if not hasattr(self._tls, 'pre_enter_fd'):
+            self._tls.pre_enter_fd = {}
+        return self._tls.pre_enter_fd
+
+    @property
+    def _outside_wd(self) -> str | None:
+        return getattr(self._tls, 'outside_wd', None)
+
+    @_outside_wd.setter
+    def _outside_wd(self, wd: str | None):
+        self._tls.outside_wd = wd
+
     def __del__(self):
         for t, fd in self._pre_enter_fd.items():
             # in a likelihood we had __enter__'d without __exit__, return to original namespace
             setns(fd, 0)     # nstype is 0 because we cannot be bothered to determine it at this stage.
             if t == 'mnt':
-                chdir(self._mnt_cwd)
+                chdir(self._outside_wd)
 
             # close namespace
-            close_fd(fd)
+            if fd != Namespace._host_fd.get(t):
+                close_fd(fd)
+
+        if self._parent is not None:
+            # a view, the handles belong to the parent
+            return
 
         for fd in self._fd.values():
             # close all namespace targets
             close_fd(fd)
+        if self._pidfd is not None:
+            close_fd(self._pidfd)
 
     def __getattr__(self, name):
         if name in Namespace.TYPES:
-            return self._fd.get(name, None)
-
-    def __enter__(self):
-        for t, fd in self._fd.items():
-            # save current namespace
-            self._pre_enter_fd[t] = open_fd(f'/proc/self/ns/{t}', 0)
+            return self._fd_of(name) if name in self._types else None
 
-            if t == 'mnt':
-                self._outside_wd = getcwd()
+    def _fd_of(self, t: str) -> int | None:
+        owner = self._parent or self
+        fd = owner._fd.get(t)
+        if fd is None and owner._nstarget.get(t, ('',))[0] == 'pid':
+            # entered through the pidfd so far, open the namespace itself on demand
+            new_fd = open_fd(f'/proc/{owner._nstarget[t][1]}/ns/{t}', 0)
+            fd = owner._fd.setdefault(t, new_fd)
+            if fd != new_fd:
+                close_fd(new_fd)
+        return fd
 
-            # enter new namespace
+    def _setns(self):
+        if self._pidfd is not None and Namespace.use_pidfd:
             try:
-                unshare(Namespace.UNSHARE_FLAGS[t])    # HACK: i don't know why, but without this causes EINVAL
-                setns(fd, Namespace.UNSHARE_FLAGS[t])
+                setns(self._pidfd, sum(Namespace.UNSHARE_FLAGS[t] for t in self._types))
+                return
+            except OSError as e:
+                if e.errno not in (EINVAL, ESRCH):
+                    raise
+                # a failed setns() changes nothing, try one by one. after ESRCH the process is gone, but
+                # the namespace fds we hold (net always) keep its namespaces alive and still enter them
+                for t in self._types:
+                    setns(self._fd_of(t), Namespace.UNSHARE_FLAGS[t])
+                if e.errno == EINVAL:
+                    # that worked, so the kernel is older than 5.8 and only takes namespace fds
+                    Namespace.use_pidfd = False
+                return
 
-                if t == 'mnt' and self._inside_wd:
-                    chdir(self._inside_wd)
-
-            except OSError:
-                # revert
-                for revert_t, revert_fd in self._pre_enter_fd.items():
-                    if revert_t == t: continue
-                    setns(revert_fd, 0)
-                    if revert_t == 'mnt':
-                        chdir(self._outside_wd)
-                self._pre_enter_fd.clear()
-                raise
+        for t in self._types:
+            setns(self._fd_of(t), Namespace.UNSHARE_FLAGS[t])
+
+    @Metrics.timed('namespace_enter')
+    def __enter__(self):
+        thread = Namespace._thread
+        depth = getattr(thread, 'depth', 0)
+        if 'mnt' in self._types and not getattr(thread, 'fs_unshared', False):
+            # setns() into a mount namespace is EINVAL while the thread shares its root and cwd
+            # with the rest of the process. unsharing them once per thread is enough
+            unshare(CLONE_FS)
+            thread.fs_unshared = True
+
+        # save current namespace. outside any other Namespace that is where the process started,
+        # see the NOTE at _host_fd
+        for t in self._types:
+            self._pre_enter_fd[t] = Namespace._host_fd[t] if depth == 0 else open_fd(f'/proc/thread-self/ns/{t}', 0)
+        if 'mnt' in self._types:
+            self._outside_wd = getcwd()
+
+        # enter new namespace
+        try:
+            self._setns()
+            if 'mnt' in self._types and self._inside_wd:
+                chdir(self._inside_wd)
+        except OSError:
+            self._restore()
+            raise
 
+        thread.depth = depth + 1
         return self
-    
-    def __exit__(self, exc_type, exc_value, traceback):
-        for t, fd in self._pre_enter_fd.items():
-            if t == 'mnt':
-                self._inside_wd = getcwd()
+
+    def _restore(self):
+        for t in reversed(self._types):
+            fd = self._pre_enter_fd.pop(t)
 
             # return to original namespace
             setns(fd, Namespace.UNSHARE_FLAGS[t])
-
             if t == 'mnt':
                 chdir(self._outside_wd)
 
-            # close original fd
-            close_fd(fd)
-        self._pre_enter_fd.clear()
+            # close original fd, unless it is one of the process'
+            if fd != Namespace._host_fd.get(t):
+                close_fd(fd)
+    
+    @Metrics.timed('namespace_exit')
+    def __exit__(self, exc_type, exc_value, traceback):
+        if 'mnt' in self._types and self._inside_wd:
+            self._inside_wd = getcwd()
+        self._restore()
+        Namespace._thread.depth -= 1
+
+
+# NOTE: nobody can be inside a Namespace before this module is loaded, so these are where the
+#       process started. Threads are assumed to be started from there too.
+for t in Namespace.TYPES:
+    try:
+        Namespace._host_fd[t] = open_fd(f'/proc/thread-self/ns/{t}', 0)
+    except FileNotFoundError:
+        # namespace type not supported by this kernel
+        pass
+del t
 
 
 class MountOptions(IntEnum):
@@ -227,8 +366,719 @@ def mount(source: str, target: str, fs: str | None, options: Iterable[MountOptio
         errno = ctypes.get_errno()
         raise OSError(errno, strerror(errno))
 
+def is_mountpoint(path: str) -> bool:
+    '''True if something is mounted right at `path`, including bind mounts onto files.'''
+    path = os.path.realpath(path)
+    with open('/proc/thread-self/mountinfo') as f:
+        return any(line.split()[4] == path for line in f)
+
 def umount(target: str):
     ret = libc.umount(target.encode(), 0)
     if ret != 0:
         errno = ctypes.get_errno()
         raise OSError(errno, strerror(errno))
+
+
+# new mount API, Linux 5.2+ (mount_setattr 5.12+). new syscalls share one number on every architecture
+SYS_OPEN_TREE     = 428
+SYS_MOVE_MOUNT    = 429
+SYS_FSOPEN        = 430
+SYS_FSCONFIG      = 431
+SYS_FSMOUNT       = 432
+SYS_MOUNT_SETATTR = 442
+
+AT_FDCWD        = -100
+AT_EMPTY_PATH   = 0x1000
+AT_RECURSIVE    = 0x8000
+OPEN_TREE_CLONE = 1
+FSOPEN_CLOEXEC  = 1
+FSMOUNT_CLOEXEC = 1
+MOVE_MOUNT_T_SYMLINKS   = 0x10
+MOVE_MOUNT_F_EMPTY_PATH = 0x04
+FSCONFIG_SET_STRING = 1
+FSCONFIG_CMD_CREATE = 6
+
+libc.syscall.restype = ctypes.c_long
+
+
+class MountAttr(IntFlag):
+    RDONLY      = 0x000001
+    NOSUID      = 0x000002
+    NODEV       = 0x000004
+    NOEXEC      = 0x000008
+    NOATIME     = 0x000010
+    STRICTATIME = 0x000020
+    NODIRATIME  = 0x000080
+    NOSYMFOLLOW = 0x200000
+
+
+class _MountAttrStruct(ctypes.Structure):
+    _fields_ = [('attr_set', ctypes.c_uint64), ('attr_clr', ctypes.c_uint64), ('propagation', ctypes.c_uint64), ('userns_fd', ctypes.c_uint64)]
+
+
+def _syscall(number: int, *args) -> int:
+    ret = libc.syscall(ctypes.c_long(number), *args)
+    if ret < 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, strerror(errno))
+    return ret
+
+def fsopen(fs: str) -> int:
+    '''
+    Filesystem context fd for `fs`. Namespaced filesystems (sysfs, proc...) are tied to the
+    namespaces of the calling thread now, not when the mount gets attached.
+    '''
+    return _syscall(SYS_FSOPEN, ctypes.c_char_p(fs.encode()), ctypes.c_uint(FSOPEN_CLOEXEC))
+
+def fsconfig(fs_fd: int, cmd: int, key: str | None = None, value: str | None = None, aux: int = 0):
+    _syscall(SYS_FSCONFIG, ctypes.c_int(fs_fd), ctypes.c_uint(cmd),
+             ctypes.c_char_p(key.encode() if key else None), ctypes.c_char_p(value.encode() if value else None), ctypes.c_int(aux))
+
+def fsmount(fs_fd: int, attrs: MountAttr | int = 0) -> int:
+    '''Detached mount fd of a configured filesystem context. It is in no mount table until `move_mount`.'''
+    return _syscall(SYS_FSMOUNT, ctypes.c_int(fs_fd), ctypes.c_uint(FSMOUNT_CLOEXEC), ctypes.c_uint(attrs))
+
+def open_tree(path: str, clone: bool = True, recursive: bool = False, dir_fd: int = AT_FDCWD) -> int:
+    '''With `clone`, a detached copy of the mount at `path`, like a bind mount not attached anywhere yet.'''
+    flags = os.O_CLOEXEC | (OPEN_TREE_CLONE if clone else 0) | (AT_RECURSIVE if recursive else 0)
+    return _syscall(SYS_OPEN_TREE, ctypes.c_int(dir_fd), ctypes.c_char_p(path.encode()), ctypes.c_uint(flags))
+
+def move_mount(mount_fd: int, target: str, target_dir_fd: int = AT_FDCWD, follow_symlinks: bool = True):
+    '''Attach a detached mount (or move an attached one) onto `target`, in the caller's mount namespace.'''
+    flags = MOVE_MOUNT_F_EMPTY_PATH | (MOVE_MOUNT_T_SYMLINKS if follow_symlinks else 0)
+    _syscall(SYS_MOVE_MOUNT, ctypes.c_int(mount_fd), ctypes.c_char_p(b''),
+             ctypes.c_int(target_dir_fd), ctypes.c_char_p(target.encode()), ctypes.c_uint(flags))
+
+def mount_setattr(mount_fd: int, attr_set: MountAttr | int = 0, attr_clr: MountAttr | int = 0, propagation: MountPropagationMode | int = 0, recursive: bool = False):
+    attr = _MountAttrStruct(attr_set, attr_clr, propagation, 0)
+    flags = AT_EMPTY_PATH | (AT_RECURSIVE if recursive else 0)
+    _syscall(SYS_MOUNT_SETATTR, ctypes.c_int(mount_fd), ctypes.c_char_p(b''), ctypes.c_uint(flags),
+             ctypes.byref(attr), ctypes.c_size_t(ctypes.sizeof(attr)))
+
+_mount_api: bool | None = None
+
+def mount_api_supported() -> bool:
+    '''Whether the kernel has the new mount API (fsopen and friends), probed once.'''
+    global _mount_api
+    if _mount_api is None:
+        try:
+            close_fd(fsopen('tmpfs'))
+            _mount_api = True
+        except OSError as e:
+            if e.errno != ENOSYS:
+                raise
+            _mount_api = False
+    return _mount_api
+
+
+class SysfsMount:
+    '''
+    A sysfs instance of one network namespace, as a detached mount. Files are read relative to it,
+    so nothing gets mounted in any mount namespace, and no namespace has to be entered to read it.
+
+    Usage example:
+    >>> sysfs = SysfsMount(Namespace(net=pid))
+    >>> sysfs.read('class/ieee80211/phy3/macaddress')
+    '02:00:00:00:03:00'
+    '''
+
+    fd: int | None
+
+    def __init__(self, netns: 'Namespace | None' = None):
+        '''sysfs of the netns of `netns`, or of the calling thread.'''
+        self.fd = None
+        if netns is not None:
+            with netns.only('net'):
+                fs_fd = fsopen('sysfs')
+        else:
+            fs_fd = fsopen('sysfs')
+        try:
+            fsconfig(fs_fd, FSCONFIG_CMD_CREATE)
+            self.fd = fsmount(fs_fd, MountAttr.NOSUID | MountAttr.NODEV | MountAttr.NOEXEC)
+        finally:
+            close_fd(fs_fd)
+
+    def __del__(self):
+        self.close()
+
+    def __repr__(self):
+        return f'<SysfsMount fd={self.fd}>'
+
+    def open(self, path: str, flags: int = os.O_RDONLY) -> int:
+        return open_fd(path.lstrip('/'), flags | os.O_CLOEXEC, dir_fd=self.fd)
+
+    def read(self, path: str) -> str:
+        fd = self.open(path)
+        try:
+            return os.read(fd, 4096).decode().strip()
+        finally:
+            close_fd(fd)
+
+    def listdir(self, path: str) -> list[str]:
+        fd = self.open(path, os.O_DIRECTORY)
+        try:
+            return os.listdir(fd)
+        finally:
+            close_fd(fd)
+
+    def close(self):
+        if self.fd is not None:
+            close_fd(self.fd)
+            self.fd = None
+
+
+class InotifyMask(IntFlag):
+    ACCESS      = 0x001
+    MODIFY      = 0x002
+    ATTRIB      = 0x004
+    CLOSE_WRITE = 0x008
+    CLOSE_NOWRITE = 0x010
+    OPEN        = 0x020
+    MOVED_FROM  = 0x040
+    MOVED_TO    = 0x080
+    CREATE      = 0x100
+    DELETE      = 0x200
+    DELETE_SELF = 0x400
+    MOVE_SELF   = 0x800
+
+
+_struct_inotify_event = Struct('iIII')
+
+def _inotify_watch(directory: str, mask: int) -> int:
+    fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if fd < 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, strerror(errno))
+
+    if libc.inotify_add_watch(fd, directory.encode(), mask) < 0:
+        errno = ctypes.get_errno()
+        close_fd(fd)
+        raise OSError(errno, strerror(errno), directory)
+    return fd
+
+def _inotify_names(fd: int) -> Iterable[str]:
+    buf = os.read(fd, 4096)
+    offset = 0
+    while offset < len(buf):
+        _, _, _, length = _struct_inotify_event.unpack_from(buf, offset)
+        offset += _struct_inotify_event.size
+        yield buf[offset:offset+length].rstrip(b'\0').decode()
+        offset += length
+
+def wait_for_path(path: str, timeout: float) -> bool:
+    '''
+    Block until `path` is created (or moved into place), or `timeout` seconds have passed.
+    Returns whether the path exists. Wakes up as soon as the entry appears, no polling involved.
+    '''
+    directory, name = os.path.split(path)
+    fd = _inotify_watch(directory, InotifyMask.CREATE | InotifyMask.MOVED_TO)
+    try:
+        # it might have been created before the watch was set up
+        if os.path.lexists(path):
+            return True
+
+        deadline = monotonic() + timeout
+        while (remaining := deadline - monotonic()) > 0:
+            ready, _, _ = select([fd], [], [], remaining)
+            if not ready:
+                break
+            if name in _inotify_names(fd):
+                return True
+
+        return os.path.lexists(path)
+    finally:
+        close_fd(fd)
+
+async def wait_for_path_async(path: str, timeout: float) -> bool:
+    '''
+    Same as `wait_for_path`, but waits on the running asyncio loop.
+    '''
+    directory, name = os.path.split(path)
+    fd = _inotify_watch(directory, InotifyMask.CREATE | InotifyMask.MOVED_TO)
+    loop = asyncio.get_running_loop()
+    created = loop.create_future()
+
+    def on_readable():
+        if name in _inotify_names(fd) and not created.done():
+            created.set_result(True)
+
+    try:
+        if os.path.lexists(path):
+            return True
+
+        loop.add_reader(fd, on_readable)
+        try:
+            return await asyncio.wait_for(created, timeout)
+        except asyncio.TimeoutError:
+            return os.path.lexists(path)
+        finally:
+            loop.remove_reader(fd)
+    finally:
+        close_fd(fd)
+
+
+def run_in_namespace(ns: 'Namespace', argv: list[str], input: bytes | None = None, timeout: float | None = None,
+                     check: bool = False, env: dict[str, str] | None = None, cwd: str = '/') -> subprocess.CompletedProcess:
+    '''
+    Runs `argv` inside the namespaces of `ns`, the way `nsenter` does: the calling thread enters them and
+    spawns the command from there, so it starts inside. Output is captured, like `subprocess.run(..., capture_output=True)`.
+    '''
+    # NOTE: no os.fork() and no Python in the child, this is called from thread pools. setns() to a pid
+    #       namespace applies to the children of the calling thread, which is all it takes here
+    with ns:
+        return subprocess.run(argv, input=input, capture_output=True, timeout=timeout, check=check, env=env, cwd=cwd)
+
+
+class NamespaceWorker:
+    '''
+    A thread that enters `ns` once and stays there, running whatever is submitted to it in order.
+    Submitted work pays no namespace switches, and workers of different namespaces run side by side.
+    `setup` runs once in the thread after entering, e.g. to mount something.
+
+    Usage example:
+    >>> worker = NamespaceWorker(Namespace(net=pid), name='jk-test1')
+    >>> worker.call(os.listdir, '/sys/class/net')
+    >>> await worker.acall(socket.if_nameindex)
+    >>> worker.run(['ip', 'link']).result().stdout
+    '''
+
+    ns: Namespace
+    name: str
+
+    _queue: SimpleQueue
+    _thread: threading.Thread
+    _lock: threading.Lock
+    _closed: bool
+    _error: BaseException | None
+
+    def __init__(self, ns: Namespace, setup: Callable[[], None] | None = None, name: str = 'jk-nsworker'):
+        self.ns = ns
+        self.name = name
+        self._queue = SimpleQueue()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._error = None
+
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(setup, ready), name=name, daemon=True)
+        self._thread.start()
+        ready.wait()
+        if self._error is not None:
+            self._closed = True
+            raise self._error
+
+    def __repr__(self):
+        return f'<NamespaceWorker {self.name} {"closed" if self._closed else "running"} in {self.ns}>'
+
+    def _run(self, setup: Callable[[], None] | None, ready: threading.Event):
+        try:
+            self.ns.__enter__()
+        except BaseException as e:
+            self._error = e
+            ready.set()
+            return
+
+        try:
+            if setup is not None:
+                setup()
+        except BaseException as e:
+            self._error = e
+            self.ns.__exit__(None, None, None)
+            ready.set()
+            return
+
+        ready.set()
+        try:
+            while (item := self._queue.get()) is not None:
+                future, fn, args, kwargs = item
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    future.set_result(fn(*args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+        finally:
+            self.ns.__exit__(None, None, None)
+
+    @classmethod
+    def with_sysfs(cls, netns: Namespace, name: str = 'jk-nsworker-sysfs') -> 'NamespaceWorker':
+        '''
+        A worker in the network namespace of `netns` and a private mount namespace with a sysfs of that netns
+        mounted on /sys, the rest of the filesystem is the host's. Its PHYs and interfaces show up in /sys/class.
+        '''
+        def mount_sysfs():
+            mount(None, '/', None, None, propagation='rprivate')    # change propagation
+            mount('sysfs', '/sys', 'sysfs', None)                   # in-place mount sysfs
+
+        return cls(Namespace(mnt=True, net=f'/proc/self/fd/{netns.net}'), mount_sysfs, name)
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"{self.name} is closed")
+            future = Future()
+            self._queue.put((future, fn, args, kwargs))
+        return future
+
+    def call(self, fn: Callable, *args, **kwargs):
+        return self.submit(fn, *args, **kwargs).result()
+
+    async def acall(self, fn: Callable, *args, **kwargs):
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def run(self, argv: list[str], input: bytes | None = None, timeout: float | None = None, check: bool = False,
+            env: dict[str, str] | None = None, cwd: str = '/') -> Future:
+        '''
+        Runs `argv` from the worker, so it starts in the worker's namespaces. Output is captured.
+        '''
+        return self.submit(subprocess.run, argv, input=input, capture_output=True, timeout=timeout, check=check, env=env, cwd=cwd)
+
+    def close(self, wait: bool = True):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        if wait and threading.current_thread() is not self._thread:
+            self._thread.join()
+
+
+NETLINK_ROUTE   = 0
+NETLINK_GENERIC = 16
+
+
+class NetlinkFlags(IntFlag):
+    REQUEST = 0x001
+    MULTI   = 0x002
+    ACK     = 0x004
+    ECHO    = 0x008
+    ROOT    = 0x100     # for GET requests
+    MATCH   = 0x200
+    DUMP    = ROOT | MATCH
+    REPLACE = 0x100     # for NEW requests
+    EXCL    = 0x200
+    CREATE  = 0x400
+    APPEND  = 0x800
+
+
+class NetlinkMsgType(IntEnum):
+    NOOP    = 1
+    ERROR   = 2
+    DONE    = 3
+    OVERRUN = 4
+
+
+_struct_nlmsghdr = Struct('=IHHII')
+_struct_nlmsgerr = Struct('=i')
+_struct_nlattr = Struct('=HH')
+_struct_u32 = Struct('=I')
+NLA_F_NESTED = 1 << 15
+
+
+def nla(attr_type: int, data: bytes) -> bytes:
+    length = _struct_nlattr.size + len(data)
+    return _struct_nlattr.pack(length, attr_type) + data + b'\0' * (-length % 4)
+
+def nla_str(attr_type: int, value: str) -> bytes:
+    return nla(attr_type, value.encode() + b'\0')
+
+def nla_u32(attr_type: int, value: int) -> bytes:
+    return nla(attr_type, _struct_u32.pack(value))
+
+def nla_nested(attr_type: int, *attrs: bytes) -> bytes:
+    return nla(attr_type | NLA_F_NESTED, b''.join(attrs))
+
+def nla_parse(buf: bytes | memoryview, offset: int = 0, end: int | None = None) -> dict[int, memoryview]:
+    view = memoryview(buf)
+    end = len(view) if end is None else end
+    attrs = {}
+    while offset + _struct_nlattr.size <= end:
+        length, attr_type = _struct_nlattr.unpack_from(view, offset)
+        if length < _struct_nlattr.size:
+            break
+        attrs[attr_type & ~NLA_F_NESTED] = view[offset+_struct_nlattr.size:offset+length]
+        offset += (length + 3) & ~3
+    return attrs
+
+
+class NetlinkSocket:
+    '''
+    Bare netlink socket, bound to the network namespace of the thread that created it.
+    Requests are pipelined: many messages are sent in one write and their ACKs collected together.
+    '''
+
+    recv_size = 65536
+
+    _sock: socket
+    _seq: int
+    _lock: threading.Lock
+
+    def __init__(self, protocol: int):
+        self._sock = socket(AF_NETLINK, SOCK_RAW | SOCK_CLOEXEC, protocol)
+        self._sock.bind((0, 0))
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def __del__(self):
+        if hasattr(self, '_sock'):
+            self._sock.close()
+
+    def close(self):
+        self._sock.close()
+
+    def transact(self, msgs: Iterable[tuple[int, int, bytes]]) -> list[tuple[int, list[bytes]]]:
+        '''
+        Send (type, flags, payload) messages in one round-trip. Every message is acknowledged.
+        Returns (error, replies) for each message in order: error is 0 or positive on success,
+        negative errno on failure; replies holds the payload of any non-ACK response.
+        '''
+        with self._lock:
+            pending = {}
+            results = []
+            buf = bytearray()
+            for msg_type, flags, payload in msgs:
+                self._seq = (self._seq + 1) & 0xffffffff
+                flags |= NetlinkFlags.REQUEST | NetlinkFlags.ACK
+                buf += _struct_nlmsghdr.pack(_struct_nlmsghdr.size + len(payload), msg_type, flags, self._seq, 0)
+                buf += payload
+                buf += b'\0' * (-len(payload) % 4)
+
+                pending[self._seq] = len(results)
+                results.append([None, []])
+
+            if not pending:
+                return []
+            self._sock.sendall(buf)
+
+            while pending:
+                data = memoryview(self._sock.recv(self.recv_size))
+                offset = 0
+                while offset + _struct_nlmsghdr.size <= len(data):
+                    length, msg_type, flags, seq, _ = _struct_nlmsghdr.unpack_from(data, offset)
+                    if length < _struct_nlmsghdr.size:
+                        break
+                    body = data[offset+_struct_nlmsghdr.size:offset+length]
+                    offset += (length + 3) & ~3
+
+                    index = pending.get(seq)
+                    if index is None:
+                        continue
+
+                    if msg_type == NetlinkMsgType.ERROR:
+                        results[index][0] = _struct_nlmsgerr.unpack_from(body)[0]
+                        del pending[seq]
+                    elif msg_type == NetlinkMsgType.DONE:
+                        results[index][0] = 0
+                        del pending[seq]
+                    else:
+                        results[index][1].append(bytes(body))
+
+            return [tuple(result) for result in results]
+
+    @staticmethod
+    def check(error: int, what: str | None = None) -> int:
+        if error < 0:
+            raise OSError(-error, strerror(-error), what)
+        return error
+
+    def batch(self) -> 'NetlinkBatch':
+        return NetlinkBatch(self)
+
+
+class NetlinkBatch:
+    '''
+    Collects netlink requests and sends them in one round-trip on commit.
+
+    Usage example:
+    >>> with RtNetlink.host().batch() as batch:
+    >>>     batch.link_del('vjk-test1', missing_ok=True)
+    >>>     batch.veth_add('vjk-test1', 'eth1', peer_netns_fd=fd)
+    '''
+
+    _nlsock: NetlinkSocket
+    _msgs: list[tuple[int, int, bytes]]
+    _ignore: list[tuple[str, frozenset[int]]]
+
+    def __init__(self, nlsock: NetlinkSocket):
+        self._nlsock = nlsock
+        self._msgs = []
+        self._ignore = []
+
+    def __len__(self):
+        return len(self._msgs)
+
+    def __getattr__(self, name):
+        # forward msg_* builders of the socket, e.g. batch.link_del(...) -> nlsock.msg_link_del(...)
+        builder = getattr(type(self._nlsock), f'msg_{name}', None)
+        if builder is None:
+            raise AttributeError(name)
+
+        def add(*args, missing_ok: bool = False, exist_ok: bool = False, **kwargs):
+            ignore = set()
+            if missing_ok:
+                ignore.update((ENODEV, ENOENT))
+            if exist_ok:
+                ignore.add(EEXIST)
+            self.add(builder(self._nlsock, *args, **kwargs), str(args[0]) if args else name, ignore)
+        return add
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit(check=True)
+
+    def add(self, msg: tuple[int, int, bytes], what: str | None = None, ignore: Iterable[int] = ()):
+        self._msgs.append(msg)
+        self._ignore.append((what, frozenset(ignore)))
+
+    def commit(self, check: bool = True) -> list[int]:
+        '''
+        Send everything collected so far. Returns the error code of every request,
+        raising OSError for the first failure that is not ignored if `check` is set.
+        '''
+        results = [error for error, _ in self._nlsock.transact(self._msgs)]
+        ignores = self._ignore
+        self._msgs = []
+        self._ignore = []
+
+        if check:
+            for error, (what, ignore) in zip(results, ignores):
+                if error < 0 and -error not in ignore:
+                    NetlinkSocket.check(error, what)
+        return results
+
+
+class RtNetlink(NetlinkSocket):
+    '''
+    rtnetlink link operations, in place of spawning `ip link`.
+    '''
+
+    RTM_NEWLINK = 16
+    RTM_DELLINK = 17
+    RTM_GETLINK = 18
+
+    IFLA_IFNAME     = 3
+    IFLA_LINKINFO   = 18
+    IFLA_NET_NS_PID = 19
+    IFLA_NET_NS_FD  = 28
+    IFLA_INFO_KIND  = 1
+    IFLA_INFO_DATA  = 2
+    VETH_INFO_PEER  = 1
+
+    IFF_UP = 0x1
+
+    _struct_ifinfomsg = Struct('=BxHiII')
+
+    _host: 'RtNetlink | None' = None
+    _host_lock = threading.Lock()
+
+    def __init__(self):
+        super().__init__(NETLINK_ROUTE)
+
+    @classmethod
+    def host(cls) -> 'RtNetlink':
+        '''Shared socket in the namespace of the first caller, which should be the host netns.'''
+        with cls._host_lock:
+            if cls._host is None:
+                cls._host = cls()
+            return cls._host
+
+    @classmethod
+    def _ifinfomsg(cls, up: bool | None = None, index: int = 0) -> bytes:
+        flags = cls.IFF_UP if up else 0
+        change = cls.IFF_UP if up is not None else 0
+        return cls._struct_ifinfomsg.pack(0, 0, index, flags, change)
+
+    def msg_veth_add(self, name: str, peer_name: str, peer_netns_fd: int | None = None, up: bool = False, peer_up: bool = False):
+        peer = self._ifinfomsg(peer_up) + nla_str(self.IFLA_IFNAME, peer_name)
+        if peer_netns_fd is not None:
+            peer += nla_u32(self.IFLA_NET_NS_FD, peer_netns_fd)
+
+        payload = self._ifinfomsg(up) + nla_str(self.IFLA_IFNAME, name) + nla_nested(self.IFLA_LINKINFO,
+            nla_str(self.IFLA_INFO_KIND, 'veth'),
+            nla_nested(self.IFLA_INFO_DATA, nla(self.VETH_INFO_PEER | NLA_F_NESTED, peer)),
+        )
+        return (self.RTM_NEWLINK, NetlinkFlags.CREATE | NetlinkFlags.EXCL, payload)
+
+    def msg_link_del(self, name: str):
+        return (self.RTM_DELLINK, 0, self._ifinfomsg() + nla_str(self.IFLA_IFNAME, name))
+
+    def msg_link_get(self, name: str):
+        return (self.RTM_GETLINK, 0, self._ifinfomsg() + nla_str(self.IFLA_IFNAME, name))
+
+    def msg_link_set(self, name: str, up: bool | None = None, netns_fd: int | None = None):
+        payload = self._ifinfomsg(up) + nla_str(self.IFLA_IFNAME, name)
+        if netns_fd is not None:
+            payload += nla_u32(self.IFLA_NET_NS_FD, netns_fd)
+        return (self.RTM_NEWLINK, 0, payload)
+
+    def veth_add(self, name: str, peer_name: str, peer_netns_fd: int | None = None, up: bool = False, peer_up: bool = False):
+        with self.batch() as batch:
+            batch.veth_add(name, peer_name, peer_netns_fd, up, peer_up)
+
+    def link_del(self, name: str, missing_ok: bool = False):
+        with self.batch() as batch:
+            batch.link_del(name, missing_ok=missing_ok)
+
+    def link_set(self, name: str, up: bool | None = None, netns_fd: int | None = None):
+        with self.batch() as batch:
+            batch.link_set(name, up, netns_fd)
+
+    def links_exist(self, names: Iterable[str]) -> dict[str, bool]:
+        '''Which of `names` exist in this namespace, in one round-trip.'''
+        names = list(names)
+        results = self.transact(self.msg_link_get(name) for name in names)
+        for name, (error, _) in zip(names, results):
+            if error not in (0, -ENODEV):
+                self.check(error, name)
+        return {name: error == 0 for name, (error, _) in zip(names, results)}
+
+
+
+class GenericNetlink(NetlinkSocket):
+    '''
+    Generic netlink socket talking to one family, resolved by name through the controller.
+    Subclasses set `family_name` and build their messages with `msg()`.
+    '''
+
+    GENL_ID_CTRL = 0x10
+    CTRL_CMD_GETFAMILY = 3
+    CTRL_ATTR_FAMILY_ID = 1
+    CTRL_ATTR_FAMILY_NAME = 2
+
+    _struct_genlmsghdr = Struct('=BBH')
+    _struct_u16 = Struct('=H')
+
+    family_name: str
+    family_version: int = 1
+    family_id: int
+
+    # family ids are global, not per network namespace
+    _family_ids: dict[str,int] = {}
+
+    def __init__(self):
+        super().__init__(NETLINK_GENERIC)
+        self.family_id = self._resolve_family(self.family_name)
+
+    def _resolve_family(self, name: str) -> int:
+        if name in GenericNetlink._family_ids:
+            return GenericNetlink._family_ids[name]
+
+        payload = self._struct_genlmsghdr.pack(self.CTRL_CMD_GETFAMILY, 1, 0) + nla_str(self.CTRL_ATTR_FAMILY_NAME, name)
+        error, replies = self.transact([(self.GENL_ID_CTRL, 0, payload)])[0]
+        self.check(error, f'generic netlink family {name}')
+
+        attrs = nla_parse(replies[0], self._struct_genlmsghdr.size)
+        family_id = self._struct_u16.unpack_from(attrs[self.CTRL_ATTR_FAMILY_ID])[0]
+        GenericNetlink._family_ids[name] = family_id
+        return family_id
+
+    def msg(self, cmd: int, *attrs: bytes, flags: int = 0):
+        return (self.family_id, flags, self._struct_genlmsghdr.pack(cmd, self.family_version, 0) + b''.join(attrs))
+
+    @classmethod
+    def parse(cls, reply: bytes) -> tuple[int, dict[int, memoryview]]:
+        cmd, _, _ = cls._struct_genlmsghdr.unpack_from(reply)
+        return cmd, nla_parse(reply, cls._struct_genlmsghdr.size)
@@ -1,8 +1,15 @@
 from io import TextIOBase
+from math import floor, log10, pi
+from typing import Hashable, Iterable, Iterator
+from functools import wraps
 from .router import Router
 from .radio import PhyManagement
+from .journal import StateJournal
+from .metrics import Metrics
 import atexit
+import threading
 from .wmediumd import Wmediumd, WmediumdConfigPathLoss
+from .topology import MEDIUM_PARAMS
 from tempfile import NamedTemporaryFile
 
 import logging
@@ -10,15 +17,136 @@ log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
 
+class SpatialGrid:
+    '''
+    Uniform grid index over node positions.
+
+    With cells as wide as the radio range, everyone a node can hear sits in its own cell
+    or one of the 8 around it, so neighbor queries only look at nodes nearby.
+
+    Usage example:
+    >>> grid = SpatialGrid(cell_size=100.0)
+    >>> grid.add('a', 0, 0); grid.add('b', 50, 0)
+    >>> grid.neighbors('a')
+    {'b'}
+    '''
+
+    cell_size: float
+
+    _cells: dict[tuple[int, int], set[Hashable]]
+    _coords: dict[Hashable, tuple[float, float]]
+
+    def __init__(self, cell_size: float):
+        if cell_size <= 0:
+            raise ValueError(f"Cell size must be positive, got {cell_size}")
+        self.cell_size = cell_size
+        self._cells = {}
+        self._coords = {}
+
+    def __len__(self):
+        return len(self._coords)
+
+    def __contains__(self, key: Hashable):
+        return key in self._coords
+
+    def __repr__(self):
+        return f'<SpatialGrid {len(self._coords)} nodes in {len(self._cells)} cells of {self.cell_size}>'
+
+    def _cell(self, x: float, y: float) -> tuple[int, int]:
+        return (floor(x / self.cell_size), floor(y / self.cell_size))
+
+    def _iter_cells(self, x: float, y: float, radius: float) -> Iterator[set[Hashable]]:
+        cx0, cy0 = self._cell(x - radius, y - radius)
+        cx1, cy1 = self._cell(x + radius, y + radius)
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(self._cells):
+            # huge radius, cheaper to walk the occupied cells
+            yield from self._cells.values()
+            return
+
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                cell = self._cells.get((cx, cy))
+                if cell:
+                    yield cell
+
+    def position(self, key: Hashable) -> tuple[float, float]:
+        return self._coords[key]
+
+    def add(self, key: Hashable, x: float, y: float):
+        if key in self._coords:
+            raise ValueError(f"{key!r} already exist")
+        self._coords[key] = (x, y)
+        self._cells.setdefault(self._cell(x, y), set()).add(key)
+
+    def remove(self, key: Hashable):
+        cell = self._cell(*self._coords.pop(key))
+        self._cells[cell].discard(key)
+        if not self._cells[cell]:
+            del self._cells[cell]
+
+    def move(self, key: Hashable, x: float, y: float):
+        old_cell = self._cell(*self._coords[key])
+        new_cell = self._cell(x, y)
+        self._coords[key] = (x, y)
+        if old_cell != new_cell:
+            self._cells[old_cell].discard(key)
+            if not self._cells[old_cell]:
+                del self._cells[old_cell]
+            self._cells.setdefault(new_cell, set()).add(key)
+
+    def query_radius(self, x: float, y: float, radius: float) -> set[Hashable]:
+        radius_sq = radius * radius
+        found = set()
+        for cell in self._iter_cells(x, y, radius):
+            for key in cell:
+                kx, ky = self._coords[key]
+                if (kx - x) ** 2 + (ky - y) ** 2 <= radius_sq:
+                    found.add(key)
+        return found
+
+    def neighbors(self, key: Hashable, radius: float | None = None) -> set[Hashable]:
+        found = self.query_radius(*self._coords[key], self.cell_size if radius is None else radius)
+        found.discard(key)
+        return found
+
+    def links(self, key: Hashable, radius: float | None = None) -> set[frozenset]:
+        return {frozenset((key, other)) for other in self.neighbors(key, radius)}
+
+
+def _locked(method):
+    @wraps(method)
+    def wrapper(self: 'WirelessMedium', *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
 class WirelessMedium:
-    _wmd = Wmediumd()
+    path_loss_exp = 3.5
+    xg = 0.0
+    default_tx_power = 10.0
+    min_snr = 0.0           # weakest SNR still counted as a link
+    noise_level = -91.0     # as in wmediumd
 
     _coords: dict[Router, tuple[float, float]]
+    _tx_powers: dict[Router, float]
+    _grid: SpatialGrid
+    _invalidated_links: set[frozenset]
     _dirty: bool
+    _restart_needed: bool
+    _moved: set[Router]
     _wmdconfig_file: TextIOBase
+    _lock: threading.RLock    # positions also come from the mobility engine's thread, see `set_positions`
     
     def __init__(self):
+        self._lock = threading.RLock()
         self._coords = {}
+        self._tx_powers = {}
+        self._dirty = False
+        self._restart_needed = True
+        self._moved = set()
+        self._grid = SpatialGrid(self.radio_range())
+        self._invalidated_links = set()
 
         self._wmdconfig_file = NamedTemporaryFile('w', delete=False, prefix='jk_wmd_', suffix='.conf')
 
@@ -29,33 +157,194 @@ class WirelessMedium:
 
     def _get_routers(self):
         return self._coords.keys()
-    
-    def commit(self):
-        if self._dirty is False:
-            return
-        elif len(self._coords) < 1:
-            return
-        
-        wmdconfig = WmediumdConfigPathLoss(3.5, 0.0)
+
+    def radio_range(self, tx_power: float | None = None) -> float:
+        '''
+        Distance at which a link drops below `min_snr` under the log-distance model.
+        '''
+        tx_power = self.default_tx_power if tx_power is None else tx_power
+        path_loss_ref = 20 * log10(4 * pi * 2.412e9 / 2.99792458e8)
+        budget = tx_power - self.noise_level - self.min_snr - path_loss_ref - self.xg
+        return max(1.0, 10 ** (budget / (10 * self.path_loss_exp)))
+
+    def _range_of(self, router: Router) -> float:
+        return self.radio_range(self._tx_powers.get(router, self.default_tx_power))
+
+    @_locked
+    def neighbors(self, router: Router) -> set[Router]:
+        '''Routers within radio range of `router`.'''
+        candidates = self._grid.query_radius(*self._coords[router], max(self._grid.cell_size, self._range_of(router)))
+        candidates.discard(router)
+        return candidates
+
+    @_locked
+    def placements(self) -> dict[Router, tuple[float, float, float | None]]:
+        '''Position and TX power (None for `default_tx_power`) of every router.'''
+        return {router: (*coord, self._tx_powers.get(router)) for router, coord in self._coords.items()}
+
+    @_locked
+    def routers_within(self, x: float, y: float, radius: float) -> set[Router]:
+        return self._grid.query_radius(x, y, radius)
+
+    @_locked
+    def pop_invalidated_links(self) -> set[frozenset]:
+        '''
+        Links (as frozensets of two routers) that may have changed since the last call, because one end moved.
+        '''
+        links = self._invalidated_links
+        self._invalidated_links = set()
+        return links
+
+    @_locked
+    def _export_config(self):
+        wmdconfig = WmediumdConfigPathLoss(self.path_loss_exp, self.xg)
         for router, coord in self._coords.items():
-            wmdconfig.add(router._radio.macaddr, coord[0], coord[1], 10.0)
+            wmdconfig.add(router._radio.macaddr, coord[0], coord[1], self._tx_powers.get(router, self.default_tx_power))
         
         self._wmdconfig_file.seek(0)
         self._wmdconfig_file.truncate(0)
         wmdconfig.export(self._wmdconfig_file)
         self._wmdconfig_file.flush()
-        
-        Wmediumd.stop()
-        Wmediumd.start(self._wmdconfig_file.name, ns_fd=PhyManagement.stub_ns.net)
 
-    def add(self, router: Router, x: float, y: float):
+        StateJournal.record_medium({
+            router.hostname: {'x': coord[0], 'y': coord[1], 'tx_power': self._tx_powers.get(router)}
+            for router, coord in self._coords.items()
+        })
+
+    def _commit_live(self) -> bool:
+        # only moves can be applied to a running wmediumd, anything else changes its station list
+        if self._restart_needed or not Wmediumd.running() or Wmediumd.live_update is False:
+            return False
+
+        try:
+            for router in self._moved:
+                Wmediumd.api_set_position(router._radio.macaddr, *self._coords[router])
+        except ValueError as e:
+            log.warning(f"wmediumd does not take live updates ({e}), restarting it instead")
+            Metrics.count('medium_live_update_fallbacks')
+            Wmediumd.live_update = False
+            return False
+
+        Wmediumd.live_update = True
+        log.debug(f"Updated {len(self._moved)} positions in running wmediumd")
+        return True
+    
+    @Metrics.timed('medium_commit')
+    @_locked
+    def commit(self):
+        if self._dirty is False:
+            return
+        elif len(self._coords) < 1:
+            return
+
+        # the config file is what wmediumd gets started with next time, keep it current either way
+        self._export_config()
+
+        if not self._commit_live():
+            Wmediumd.stop()
+            Wmediumd.start(self._wmdconfig_file.name, ns_fd=PhyManagement.stub_ns.net)
+
+        self._dirty = False
+        self._restart_needed = False
+        self._moved.clear()
+
+    @_locked
+    def restore(self, routers: Iterable[Router]):
+        '''
+        Place `routers` where the state journal last had them, then commit.
+        Routers the journal does not know about are left out. The wmediumd a previous controller
+        left running is reconnected to, it is only started anew if it is gone.
+        '''
+        placements = StateJournal.medium()
+        for router in routers:
+            placement = placements.get(router.hostname)
+            if placement is None:
+                log.warning(f"No recorded position for router {router.hostname}")
+                continue
+            self.add(router, placement['x'], placement['y'], placement.get('tx_power'))
+
+        if not Wmediumd.running() and Wmediumd.reattach(ns_fd=PhyManagement.stub_ns.net):
+            # it was last committed with this very medium, only our own config file is behind
+            self._export_config()
+            self._dirty = False
+            self._restart_needed = False
+            self._moved.clear()
+            return
+        self.commit()
+
+    @_locked
+    def add(self, router: Router, x: float, y: float, tx_power: float | None = None):
+        if router in self._coords:
+            # already placed, as before the grid: adding again only moves it
+            self.move(router, (x, y))
+            if tx_power is not None and self._tx_powers.get(router) != tx_power:
+                self.set_tx_power(router, tx_power)
+            return
+
+        self._grid.add(router, x, y)
         self._dirty = True
+        self._restart_needed = True
         self._coords[router] = (x, y)
+        if tx_power is not None:
+            self._tx_powers[router] = tx_power
 
+    @_locked
     def remove(self, router: Router):
         self._dirty = True
+        self._restart_needed = True
         del self._coords[router]
+        self._grid.remove(router)
+        self._tx_powers.pop(router, None)
+        self._moved.discard(router)
+        self._invalidated_links = {link for link in self._invalidated_links if router not in link}
 
+    @_locked
     def move(self, router: Router, coord: tuple[float, float]):
         self._dirty = True
+
+        # links to whoever was in range before and whoever is in range now
+        self._invalidated_links |= {frozenset((router, other)) for other in self.neighbors(router)}
         self._coords[router] = coord
+        self._grid.move(router, *coord)
+        self._invalidated_links |= {frozenset((router, other)) for other in self.neighbors(router)}
+
+        self._moved.add(router)
+
+    @_locked
+    def set_positions(self, positions: dict[Router, tuple[float, float]]):
+        '''
+        Record where routers are without a live update, for callers that keep wmediumd's
+        link qualities current themselves (see `MobilityEngine`). wmediumd gets them on its next start.
+        Safe to call from another thread, like every other method of the medium.
+        '''
+        for router, coord in positions.items():
+            self._coords[router] = coord
+            self._grid.move(router, *coord)
+
+    @_locked
+    def set_tx_power(self, router: Router, tx_power: float | None):
+        # there is no live message for TX power, this needs a restart
+        self._dirty = True
+        self._restart_needed = True
+        if tx_power is None:
+            self._tx_powers.pop(router, None)
+        else:
+            self._tx_powers[router] = tx_power
+
+    @_locked
+    def configure(self, **params: float):
+        '''
+        Change path loss parameters (path_loss_exp, xg, default_tx_power, min_snr, noise_level) of this medium.
+        wmediumd is restarted with them on the next commit.
+        '''
+        for name, value in params.items():
+            if name not in MEDIUM_PARAMS:
+                raise ValueError(f"Unknown medium parameter {name!r}")
+            setattr(self, name, float(value))
+        self._dirty = True
+        self._restart_needed = True
+
+        # radio range changed, and the grid cells with it
+        self._grid = SpatialGrid(self.radio_range())
+        for router, coord in self._coords.items():
+            self._grid.add(router, *coord)
@@ -0,0 +1,284 @@
+from bisect import bisect_left
+from functools import wraps
+from time import perf_counter
+from typing import Callable
+import json
+import os
+import threading
+
+import logging
+log = logging.getLogger(__name__)
+
+
+# seconds, from a namespace switch up to a container start
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    '''
+    Fixed-bucket latency histogram, Prometheus style. Also counts operations and failures.
+    '''
+
+    buckets: tuple[float, ...]
+    counts: list[int]
+    sum: float
+    failures: int
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)     # last one is +Inf
+        self.sum = 0.0
+        self.failures = 0
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def observe(self, value: float, failed: bool = False):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        if failed:
+            self.failures += 1
+
+    def cumulative(self) -> list[tuple[float, int]]:
+        result = []
+        total = 0
+        for bound, count in zip((*self.buckets, float('inf')), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class Span:
+    '''
+    One timed operation, see `Metrics.span`. Registered as in flight until it exits.
+    '''
+
+    __slots__ = ('name', 'detail', 'thread', 'start')
+
+    def __init__(self, name: str, detail: str | None = None):
+        self.name = name
+        self.detail = detail
+
+    def __enter__(self):
+        self.thread = threading.current_thread().name
+        self.start = perf_counter()
+        Metrics._inflight[id(self)] = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = perf_counter() - self.start
+        Metrics._inflight.pop(id(self), None)
+        Metrics.observe(self.name, elapsed, exc_type is not None)
+
+
+class _NullSpan:
+    # what `Metrics.span` hands out while disabled
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+_null_span = _NullSpan()
+
+
+class Metrics:
+    '''
+    Timing spans and counters of the control plane, off by default.
+
+    While disabled, instrumented calls cost one attribute check. Enable with `enable()` or
+    the JARINGKAN_METRICS=1 environment variable, then read them as Prometheus text (`render()`,
+    or `serve()` for an HTTP endpoint) or as a JSON snapshot (`snapshot()`, `dump_every()`).
+
+    Usage example:
+    >>> Metrics.enable()
+    >>> fleet.up(hostnames)
+    >>> Metrics.snapshot()['spans']['router_start']['count']
+    16
+    >>> Metrics.inflight()      # what is taking long right now
+    [{'span': 'router_wait_for_host', 'detail': None, 'thread': 'jk-fleet_3', 'elapsed': 2.71}]
+
+    Spans are named after what they time (router_start, radio_bind, namespace_enter...),
+    counters after what they count (wmediumd_connect_retries...).
+    '''
+
+    prefix = 'jaringkan'
+    enabled: bool = os.environ.get('JARINGKAN_METRICS', '') not in ('', '0')
+
+    _spans: dict[str, Histogram] = {}
+    _counters: dict[str, int] = {}
+    _inflight: dict[int, Span] = {}
+    _lock = threading.Lock()
+    _server = None
+    _dump_thread: threading.Thread | None = None
+    _dump_stop = threading.Event()
+
+    @classmethod
+    def enable(cls):
+        cls.enabled = True
+
+    @classmethod
+    def disable(cls):
+        cls.enabled = False
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._spans.clear()
+            cls._counters.clear()
+        cls._inflight.clear()
+
+    @classmethod
+    def span(cls, name: str, detail: str | None = None) -> Span | _NullSpan:
+        if not cls.enabled:
+            return _null_span
+        return Span(name, detail)
+
+    @classmethod
+    def timed(cls, name: str) -> Callable[[Callable], Callable]:
+        '''Decorator, the whole call is one span.'''
+        def decorator(fn: Callable) -> Callable:
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not cls.enabled:
+                    return fn(*args, **kwargs)
+                with Span(name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @classmethod
+    def observe(cls, name: str, elapsed: float, failed: bool = False):
+        with cls._lock:
+            histogram = cls._spans.get(name)
+            if histogram is None:
+                histogram = cls._spans[name] = Histogram()
+            histogram.observe(elapsed, failed)
+
+    @classmethod
+    def count(cls, name: str, n: int = 1):
+        if not cls.enabled:
+            return
+        with cls._lock:
+            cls._counters[name] = cls._counters.get(name, 0) + n
+
+    @classmethod
+    def inflight(cls) -> list[dict]:
+        now = perf_counter()
+        spans = sorted(list(cls._inflight.values()), key=lambda span: span.start)
+        return [{'span': span.name, 'detail': span.detail, 'thread': span.thread, 'elapsed': now - span.start} for span in spans]
+
+    @classmethod
+    def snapshot(cls) -> dict:
+        with cls._lock:
+            spans = {
+                name: {
+                    'count': histogram.count,
+                    'failures': histogram.failures,
+                    'sum': histogram.sum,
+                    'buckets': {str(bound): count for bound, count in histogram.cumulative()},
+                }
+                for name, histogram in cls._spans.items()
+            }
+            counters = dict(cls._counters)
+        return {'spans': spans, 'counters': counters, 'inflight': cls.inflight()}
+
+    @classmethod
+    def render(cls) -> str:
+        '''Prometheus text exposition format.'''
+        prefix = cls.prefix
+        snapshot = cls.snapshot()
+        lines = [
+            f'# HELP {prefix}_span_seconds Duration of control plane operations.',
+            f'# TYPE {prefix}_span_seconds histogram',
+        ]
+        for name, span in snapshot['spans'].items():
+            for bound, count in span['buckets'].items():
+                le = '+Inf' if bound == 'inf' else bound
+                lines.append(f'{prefix}_span_seconds_bucket{{span="{name}",le="{le}"}} {count}')
+            lines.append(f'{prefix}_span_seconds_sum{{span="{name}"}} {span["sum"]}')
+            lines.append(f'{prefix}_span_seconds_count{{span="{name}"}} {span["count"]}')
+
+        lines.append(f'# HELP {prefix}_span_failures_total Operations that raised.')
+        lines.append(f'# TYPE {prefix}_span_failures_total counter')
+        for name, span in snapshot['spans'].items():
+            lines.append(f'{prefix}_span_failures_total{{span="{name}"}} {span["failures"]}')
+
+        lines.append(f'# HELP {prefix}_events_total Retries, timeouts and other events.')
+        lines.append(f'# TYPE {prefix}_events_total counter')
+        for name, count in snapshot['counters'].items():
+            lines.append(f'{prefix}_events_total{{event="{name}"}} {count}')
+
+        inflight = {}
+        for span in snapshot['inflight']:
+            inflight[span['span']] = inflight.get(span['span'], 0) + 1
+        lines.append(f'# HELP {prefix}_span_inflight Operations running right now.')
+        lines.append(f'# TYPE {prefix}_span_inflight gauge')
+        for name, count in inflight.items():
+            lines.append(f'{prefix}_span_inflight{{span="{name}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+    @classmethod
+    def serve(cls, port: int = 9464, address: str = '127.0.0.1'):
+        '''
+        Serve `render()` on http://address:port/metrics and `snapshot()` on /metrics.json, from a daemon thread.
+        '''
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body, content_type = cls.render().encode(), 'text/plain; version=0.0.4'
+                elif self.path == '/metrics.json':
+                    body, content_type = json.dumps(cls.snapshot()).encode(), 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                log.debug(format % args)
+
+        cls.enable()
+        cls._server = ThreadingHTTPServer((address, port), Handler)
+        threading.Thread(target=cls._server.serve_forever, name='jk-metrics', daemon=True).start()
+        log.info(f"Serving metrics on http://{address}:{cls._server.server_port}/metrics")
+        return cls._server
+
+    @classmethod
+    def dump_every(cls, path: str, interval: float = 10.0):
+        '''
+        Write `snapshot()` to `path` every `interval` seconds, replacing it atomically.
+        '''
+        def dump_loop():
+            while not cls._dump_stop.wait(interval):
+                try:
+                    tmp_path = path + '.tmp'
+                    with open(tmp_path, 'w') as f:
+                        json.dump(cls.snapshot(), f)
+                    os.replace(tmp_path, path)
+                except OSError as e:
+                    log.warning(f"Failed to write metrics snapshot to {path}: {e}")
+
+        cls.enable()
+        cls._dump_stop.clear()
+        cls._dump_thread = threading.Thread(target=dump_loop, name='jk-metrics-dump', daemon=True)
+        cls._dump_thread.start()
+
+    @classmethod
+    def stop(cls):
+        if cls._server is not None:
+            cls._server.shutdown()
+            cls._server.server_close()
+            cls._server = None
+        if cls._dump_thread is not None:
+            cls._dump_stop.set()
+            cls._dump_thread.join()
+            cls._dump_thread = None
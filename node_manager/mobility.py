@@ -0,0 +1,437 @@
+from time import monotonic
+from typing import Callable, Iterable, Sequence
+import csv
+import threading
+import numpy as np
+from .linkbudget import LinkBudget, PATH_LOSS_REF
+from .metrics import Metrics
+from .wmediumd import Wmediumd
+
+import logging
+log = logging.getLogger(__name__)
+
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from .mapping import WirelessMedium
+    from .router import Router
+
+
+class MobilityModel:
+    '''
+    Moves a group of nodes, all at once as an (n, 2) array of positions.
+    `reset` is called once with where the nodes start, then `step` on every tick.
+    '''
+
+    def reset(self, positions: np.ndarray):
+        pass
+
+    def step(self, positions: np.ndarray, time: float, dt: float) -> np.ndarray:
+        raise NotImplementedError
+
+
+class RandomWaypoint(MobilityModel):
+    '''
+    Every node heads for a random point in `bounds` at a random speed, pauses there, and picks the next one.
+
+    Usage example:
+    >>> engine.add(RandomWaypoint((0, 0, 5000, 5000), speed=(1.0, 8.0), pause=(0.0, 30.0)), tractors)
+    '''
+
+    bounds: tuple[float, float, float, float]     # x0, y0, x1, y1
+    speed: tuple[float, float]      # meters per second
+    pause: tuple[float, float]      # seconds
+
+    _rng: np.random.Generator
+    _targets: np.ndarray
+    _speeds: np.ndarray
+    _pauses: np.ndarray
+
+    def __init__(self, bounds: tuple[float, float, float, float], speed: tuple[float, float] = (1.0, 5.0), pause: tuple[float, float] = (0.0, 10.0), seed: int | None = None):
+        self.bounds = bounds
+        self.speed = speed
+        self.pause = pause
+        self._rng = np.random.default_rng(seed)
+
+    def _pick(self, count: int) -> tuple[np.ndarray, np.ndarray]:
+        x0, y0, x1, y1 = self.bounds
+        targets = self._rng.uniform((x0, y0), (x1, y1), size=(count, 2))
+        return targets, self._rng.uniform(*self.speed, size=count)
+
+    def reset(self, positions: np.ndarray):
+        self._targets, self._speeds = self._pick(len(positions))
+        self._pauses = np.zeros(len(positions))
+
+    def step(self, positions: np.ndarray, time: float, dt: float) -> np.ndarray:
+        positions = positions.copy()
+        paused = self._pauses > 0
+        self._pauses[paused] -= dt
+
+        delta = self._targets - positions
+        distance = np.hypot(delta[:, 0], delta[:, 1])
+        travel = self._speeds * dt
+        arrived = ~paused & (distance <= travel)
+        moving = ~paused & ~arrived
+
+        positions[moving] += delta[moving] * (travel[moving] / distance[moving])[:, None]
+        positions[arrived] = self._targets[arrived]
+
+        count = int(arrived.sum())
+        if count:
+            self._targets[arrived], self._speeds[arrived] = self._pick(count)
+            self._pauses[arrived] = self._rng.uniform(*self.pause, size=count)
+        return positions
+
+
+class Trace(MobilityModel):
+    '''
+    Scripted movement, each node follows its own list of (time, x, y) points, linearly in between.
+    Before its first point and after its last one a node stays put, or with `loop` starts over.
+
+    Usage example:
+    >>> traces = Trace.read_csv('harvest.csv')      # hostname,time,x,y
+    >>> engine.add(Trace(traces.values()), traces.keys())
+    '''
+
+    loop: bool
+
+    _times: np.ndarray      # every point of every trace, offset per node so they sort as one array
+    _points: np.ndarray
+    _first: np.ndarray      # index of each node's first and last point
+    _last: np.ndarray
+    _offsets: np.ndarray
+    _starts: np.ndarray
+    _durations: np.ndarray
+
+    def __init__(self, traces: Iterable[Sequence[tuple[float, float, float]]], loop: bool = False):
+        self.loop = loop
+        traces = [np.asarray(trace, dtype=np.float64).reshape(-1, 3) for trace in traces]
+        if any(len(trace) == 0 for trace in traces):
+            raise ValueError('Every trace needs at least one point')
+        traces = [trace[np.argsort(trace[:, 0], kind='stable')] for trace in traces]
+
+        lengths = np.array([len(trace) for trace in traces], dtype=np.intp)
+        self._last = np.cumsum(lengths) - 1
+        self._first = self._last - lengths + 1
+        self._starts = np.array([trace[0, 0] for trace in traces])
+        self._durations = np.array([trace[-1, 0] - trace[0, 0] for trace in traces])
+
+        times = np.concatenate([trace[:, 0] for trace in traces])
+        span = (times.max() - times.min() + 1.0) if len(times) else 1.0
+        self._offsets = np.arange(len(traces)) * span - times.min()
+        self._times = times + np.repeat(self._offsets, lengths)
+        self._points = np.concatenate([trace[:, 1:] for trace in traces])
+
+    @staticmethod
+    def read_csv(path: str) -> dict[str, np.ndarray]:
+        '''Traces by hostname from a CSV file of hostname,time,x,y rows, a header row is skipped.'''
+        points = {}
+        with open(path, newline='') as f:
+            for row in csv.reader(f):
+                if not row or row[0].startswith('#'):
+                    continue
+                try:
+                    point = (float(row[1]), float(row[2]), float(row[3]))
+                except (IndexError, ValueError):
+                    if not points:
+                        continue    # header
+                    raise ValueError(f"{path}: expected hostname,time,x,y, got {row!r}") from None
+                points.setdefault(row[0], []).append(point)
+        return {hostname: np.array(trace) for hostname, trace in points.items()}
+
+    def step(self, positions: np.ndarray, time: float, dt: float) -> np.ndarray:
+        if len(positions) != len(self._first):
+            raise ValueError(f"Trace has {len(self._first)} nodes, got {len(positions)}")
+
+        elapsed = time - self._starts
+        if self.loop:
+            elapsed = np.where(self._durations > 0, np.mod(elapsed, np.where(self._durations > 0, self._durations, 1.0)), 0.0)
+        elapsed = np.clip(elapsed, 0.0, self._durations)
+        query = self._starts + elapsed + self._offsets
+
+        # the segment each node is in, searched in all traces at once
+        before = np.clip(np.searchsorted(self._times, query, side='right') - 1, self._first, self._last)
+        after = np.minimum(before + 1, self._last)
+        length = self._times[after] - self._times[before]
+        fraction = np.where(length > 0, (query - self._times[before]) / np.where(length > 0, length, 1.0), 0.0)
+        return self._points[before] + (self._points[after] - self._points[before]) * fraction[:, None]
+
+
+class GroupMobility(MobilityModel):
+    '''
+    Reference point group mobility: each group's reference point moves by random waypoint,
+    members wander around it within `radius`. Convoys, herds, a harvester with its trucks.
+
+    Usage example:
+    >>> engine.add(GroupMobility([0, 0, 0, 1, 1], (0, 0, 5000, 5000), radius=50.0), convoy)
+    '''
+
+    groups: np.ndarray      # group of each node
+    radius: float
+    drift: float            # meters per second of random wandering around the reference point
+
+    _reference: RandomWaypoint
+    _centers: np.ndarray
+    _offsets: np.ndarray
+    _rng: np.random.Generator
+
+    def __init__(self, groups: Sequence[int], bounds: tuple[float, float, float, float], speed: tuple[float, float] = (1.0, 5.0), pause: tuple[float, float] = (0.0, 10.0), radius: float = 50.0, drift: float = 0.5, seed: int | None = None):
+        _, self.groups = np.unique(np.asarray(groups), return_inverse=True)
+        self.radius = radius
+        self.drift = drift
+        self._rng = np.random.default_rng(seed)
+        self._reference = RandomWaypoint(bounds, speed, pause, seed=self._rng.integers(1 << 32))
+
+    def reset(self, positions: np.ndarray):
+        if len(positions) != len(self.groups):
+            raise ValueError(f"GroupMobility has {len(self.groups)} nodes, got {len(positions)}")
+        # groups start around the centroid of their members
+        count = np.bincount(self.groups)
+        self._centers = np.stack([np.bincount(self.groups, positions[:, axis]) for axis in (0, 1)], axis=1) / count[:, None]
+        self._offsets = self._clip(positions - self._centers[self.groups])
+        self._reference.reset(self._centers)
+
+    def _clip(self, offsets: np.ndarray) -> np.ndarray:
+        length = np.hypot(offsets[:, 0], offsets[:, 1])
+        return offsets * np.minimum(1.0, self.radius / np.maximum(length, 1e-9))[:, None]
+
+    def step(self, positions: np.ndarray, time: float, dt: float) -> np.ndarray:
+        self._centers = self._reference.step(self._centers, time, dt)
+        self._offsets = self._clip(self._offsets + self._rng.normal(0.0, self.drift * dt, size=self._offsets.shape))
+        return self._centers[self.groups] + self._offsets
+
+
+class MobilityEngine:
+    '''
+    Moves the routers placed on a `WirelessMedium` at a fixed tick rate and keeps wmediumd's
+    link qualities up to date without restarting it.
+
+    Positions are kept as one array and advanced by the mobility models on every tick. The SNR of
+    each link is quantized by `thresholds` (in dB), and only links whose level changed are pushed
+    to wmediumd, as SET_SNR messages. Links below the lowest threshold are pushed as cut, at
+    `cut_snr`: 0 dB, the lowest SET_SNR carries, so the lowest threshold must be above it.
+
+    Usage example:
+    >>> engine = MobilityEngine(medium, rate=10.0)
+    >>> engine.add(RandomWaypoint((0, 0, 5000, 5000), speed=(2.0, 8.0)), fleet)
+    >>> engine.start()
+    >>> ...
+    >>> engine.stop()
+
+    Works on the routers placed when it was created, make a new engine after adding or removing
+    routers (which restarts wmediumd anyway). The medium may be used from other threads while the
+    engine runs, it takes the positions under its lock, but moves made there are not seen by the engine.
+    '''
+
+    default_thresholds = (3.0, 6.0, 12.0, 18.0, 24.0, 30.0)   # roughly where 802.11 rates step
+    cut_snr = 0.0
+
+    rate: float
+    time: float
+    routers: list['Router']
+    positions: np.ndarray
+    thresholds: np.ndarray
+
+    _medium: 'WirelessMedium'
+    _index: dict[str, int]
+    _tx_powers: np.ndarray
+    _cell_size: float
+    _keys: np.ndarray       # linked pairs as i * n + j with i < j, sorted
+    _levels: np.ndarray     # and their level, 1 and up
+    _models: list[tuple[MobilityModel, np.ndarray]]
+    _push: Callable[[list[tuple['Router', 'Router', float]]], None]
+    _thread: threading.Thread | None
+    _stop: threading.Event
+
+    def __init__(self, medium: 'WirelessMedium', rate: float = 10.0, thresholds: Sequence[float] | None = None, push: Callable[[list[tuple['Router', 'Router', float]]], None] | None = None):
+        self._medium = medium
+        self.rate = rate
+        self.time = 0.0
+        self.thresholds = np.sort(np.asarray(self.default_thresholds if thresholds is None else thresholds, dtype=np.float64))
+        if not len(self.thresholds) or self.thresholds[0] <= self.cut_snr:
+            raise ValueError(f"Lowest threshold must be above {self.cut_snr} dB, what cut links are pushed as")
+        self._push = push or self._push_wmediumd
+        self._models = []
+        self._thread = None
+        self._stop = threading.Event()
+
+        placements = medium.placements()
+        self.routers = list(placements)
+        self._index = {router.hostname: i for i, router in enumerate(self.routers)}
+        self.positions = np.array([(x, y) for x, y, _ in placements.values()], dtype=np.float64).reshape(-1, 2)
+        self._tx_powers = np.array([medium.default_tx_power if tx_power is None else tx_power for _, _, tx_power in placements.values()], dtype=np.float64)
+
+        # farthest a pair can still be linked: the strongest transmitter at the lowest threshold
+        tx_power = self._tx_powers.max() if len(self._tx_powers) else medium.default_tx_power
+        budget = tx_power - medium.noise_level - self.thresholds[0] - PATH_LOSS_REF - medium.xg
+        self._cell_size = max(1.0, 10 ** (budget / (10 * medium.path_loss_exp)))
+
+        # what wmediumd has from the positions it was started with
+        self._keys = np.empty(0, np.int64)
+        self._levels = np.empty(0, np.int8)
+        self._relevel(np.arange(len(self.routers)))
+
+    def __repr__(self):
+        return f'<MobilityEngine {len(self.routers)} routers, {len(self._keys)} links, {len(self._models)} models, {self.rate} Hz, t={self.time:.1f}s>'
+
+    def add(self, model: MobilityModel, routers: Iterable['Router | str']) -> MobilityModel:
+        '''Let `model` move `routers` (or hostnames), in that order. A router can only follow one model.'''
+        index = np.array([self._index[router if isinstance(router, str) else router.hostname] for router in routers], dtype=np.intp)
+        for _, taken in self._models:
+            if np.intersect1d(taken, index).size:
+                raise ValueError('Router already follows another mobility model')
+        model.reset(self.positions[index].copy())
+        self._models.append((model, index))
+        return model
+
+    def links(self) -> dict[frozenset, int]:
+        '''Level of every link above the lowest threshold, by pair of hostnames.'''
+        n = len(self.routers)
+        return {
+            frozenset((self.routers[i].hostname, self.routers[j].hostname)): level
+            for i, j, level in zip((self._keys // n).tolist(), (self._keys % n).tolist(), self._levels.tolist())
+        }
+
+    def _nearby(self, moved: np.ndarray) -> np.ndarray:
+        # pairs with a moved end in the same or a neighboring cell, as keys. cells are as wide as the
+        # longest link, so no pair further apart can be linked
+        n = len(self.routers)
+        cells = np.floor(self.positions / self._cell_size).astype(np.int64)
+        cells -= cells.min(axis=0) - 1      # neighbors of the edge cells stay positive too
+        width = int(cells[:, 1].max()) + 2
+        cell_keys = cells[:, 0] * width + cells[:, 1]
+        order = np.argsort(cell_keys, kind='stable')
+        sorted_keys = cell_keys[order]
+
+        firsts, seconds = [], []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                target = cell_keys[moved] + dx * width + dy
+                lo = np.searchsorted(sorted_keys, target, side='left')
+                counts = np.searchsorted(sorted_keys, target, side='right') - lo
+                # every node of the target cell, for every moved node, flattened
+                offsets = np.repeat(lo - (np.cumsum(counts) - counts), counts)
+                firsts.append(np.repeat(moved, counts))
+                seconds.append(order[np.arange(counts.sum()) + offsets])
+
+        i, j = np.concatenate(firsts), np.concatenate(seconds)
+        distinct = i != j
+        i, j = i[distinct], j[distinct]
+        return np.unique(np.minimum(i, j).astype(np.int64) * n + np.maximum(i, j))
+
+    def _snr(self, i: np.ndarray, j: np.ndarray) -> np.ndarray:
+        # symmetric, wmediumd keeps one SNR per pair: the weaker direction
+        delta = self.positions[i] - self.positions[j]
+        distance = np.hypot(delta[:, 0], delta[:, 1])
+        medium = self._medium
+        tx_power = np.minimum(self._tx_powers[i], self._tx_powers[j])
+        return tx_power - LinkBudget.path_loss(distance, medium.path_loss_exp, medium.xg) - medium.noise_level
+
+    def _relevel(self, moved: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Recompute the links of `moved` nodes, returns those whose level changed as (keys, snr).
+        '''
+        n = len(self.routers)
+        if not n or not len(moved):
+            return np.empty(0, np.int64), np.empty(0)
+
+        keys = self._nearby(moved)
+        snr = self._snr(keys // n, keys % n)
+        levels = np.searchsorted(self.thresholds, snr, side='right').astype(np.int8)
+        linked = levels > 0
+        new_keys, new_levels, new_snr = keys[linked], levels[linked], snr[linked]
+
+        # links of the moved nodes as they were
+        is_moved = np.zeros(n, dtype=bool)
+        is_moved[moved] = True
+        involved = is_moved[self._keys // n] | is_moved[self._keys % n]
+        old_keys, old_levels = self._keys[involved], self._levels[involved]
+
+        common, index_new, index_old = np.intersect1d(new_keys, old_keys, assume_unique=True, return_indices=True)
+        changed = new_levels[index_new] != old_levels[index_old]
+        appeared = np.isin(new_keys, common, assume_unique=True, invert=True)
+        vanished = np.isin(old_keys, common, assume_unique=True, invert=True)
+
+        keys = np.concatenate((self._keys[~involved], new_keys))
+        order = np.argsort(keys, kind='stable')
+        self._keys = keys[order]
+        self._levels = np.concatenate((self._levels[~involved], new_levels))[order]
+
+        return (
+            np.concatenate((common[changed], new_keys[appeared], old_keys[vanished])),
+            np.concatenate((new_snr[index_new][changed], new_snr[appeared], np.full(vanished.sum(), self.cut_snr))),
+        )
+
+    def tick(self, dt: float | None = None) -> list[tuple['Router', 'Router', float]]:
+        '''
+        Advance every model by `dt` seconds (one tick by default) and push the links that changed level.
+        Returns them as (router, router, snr), with the SNR at `cut_snr` for links that were cut.
+        '''
+        dt = 1.0 / self.rate if dt is None else dt
+        with Metrics.span('mobility_tick'):
+            self.time += dt
+            moved = []
+            for model, index in self._models:
+                positions = model.step(self.positions[index], self.time, dt)
+                changed = np.any(positions != self.positions[index], axis=1)
+                self.positions[index] = positions
+                moved.append(index[changed])
+            moved = np.concatenate(moved) if moved else np.empty(0, np.intp)
+            if not len(moved):
+                return []
+
+            n = len(self.routers)
+            keys, snr = self._relevel(moved)
+            updates = [(self.routers[key // n], self.routers[key % n], value) for key, value in zip(keys.tolist(), snr.tolist())]
+
+            # wmediumd is started from the medium's positions next time, keep them current
+            self._medium.set_positions({self.routers[k]: tuple(position) for k, position in zip(moved.tolist(), self.positions[moved].tolist())})
+            if updates:
+                self._push(updates)
+                Metrics.count('mobility_link_updates', len(updates))
+        return updates
+
+    @staticmethod
+    def _push_wmediumd(updates: list[tuple['Router', 'Router', float]]):
+        if not Wmediumd.running() or Wmediumd.live_update is False:
+            return
+        try:
+            for router1, router2, snr in updates:
+                Wmediumd.api_set_snr(router1._radio.macaddr, router2._radio.macaddr, snr)
+        except ValueError as e:
+            log.warning(f"wmediumd does not take live updates ({e}), link qualities are no longer pushed")
+            Wmediumd.live_update = False
+            return
+        Wmediumd.live_update = True
+
+    def _run(self):
+        interval = 1.0 / self.rate
+        next_tick = monotonic()
+        while not self._stop.is_set():
+            next_tick += interval
+            try:
+                self.tick(interval)
+            except Exception as e:
+                log.exception(f"Mobility tick failed: {e}")
+
+            delay = next_tick - monotonic()
+            if delay < 0:
+                # running behind, drop the missed ticks instead of bursting to catch up
+                Metrics.count('mobility_ticks_late')
+                next_tick = monotonic()
+            else:
+                self._stop.wait(delay)
+
+    def start(self):
+        '''Tick `rate` times a second from a daemon thread, simulated time advances by one interval per tick.'''
+        if self._thread is not None:
+            raise ValueError('Mobility engine already running')
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='jk-mobility', daemon=True)
+        self._thread.start()
+        log.info(f"Moving {sum(len(index) for _, index in self._models)} of {len(self.routers)} routers at {self.rate} Hz")
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
@@ -4,38 +4,123 @@
 #         To see the PHY in sysfs, we need to create a new mount namespace and remount sysfs.
 
 
-from os import listdir
+import atexit
+from collections import deque
+import os
+from os import strerror
 import logging
-from subprocess import run
-import subprocess
-from .linuxutils import Namespace, mount
+import threading
+from typing import Iterable
+from .linuxutils import Namespace, NamespaceWorker, GenericNetlink, NetlinkSocket, SysfsMount, mount, mount_api_supported, is_mountpoint, nla_u32
+from .journal import StateJournal
+from .metrics import Metrics
 
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
 
+class Nl80211(GenericNetlink):
+    '''
+    Minimal nl80211 client. Like every netlink socket, it only sees the PHYs
+    of the network namespace it was created in.
+    '''
+
+    family_name = 'nl80211'
+    family_version = 0
+
+    CMD_SET_WIPHY_NETNS = 49
+    ATTR_WIPHY = 1
+    ATTR_NETNS_FD = 219
+
+    def msg_wiphy_netns(self, phy_index: int, netns_fd: int):
+        return self.msg(self.CMD_SET_WIPHY_NETNS, nla_u32(self.ATTR_WIPHY, phy_index), nla_u32(self.ATTR_NETNS_FD, netns_fd))
+
+    def wiphy_netns(self, phy_index: int, netns_fd: int):
+        with self.batch() as batch:
+            batch.wiphy_netns(phy_index, netns_fd)
+
+    @classmethod
+    def inside(cls, netns: Namespace) -> 'Nl80211':
+        with netns:
+            return cls()
+
+
+class Hwsim(GenericNetlink):
+    '''
+    Client for the mac80211_hwsim generic netlink family. Radios are created in
+    the network namespace of the socket.
+    '''
+
+    family_name = 'MAC80211_HWSIM'
+
+    CMD_NEW_RADIO = 4
+    CMD_DEL_RADIO = 5
+    CMD_GET_RADIO = 6
+    ATTR_RADIO_ID = 10
+    ATTR_RADIO_NAME = 17
+
+    def msg_new_radio(self):
+        return self.msg(self.CMD_NEW_RADIO)
+
+    def msg_del_radio(self, radio_id: int):
+        return self.msg(self.CMD_DEL_RADIO, nla_u32(self.ATTR_RADIO_ID, radio_id))
+
+    def msg_get_radio(self, radio_id: int):
+        return self.msg(self.CMD_GET_RADIO, nla_u32(self.ATTR_RADIO_ID, radio_id))
+
+    def new_radios(self, count: int) -> list[tuple[str, str]]:
+        '''
+        Create `count` radios, returns (hwsim, phy) of each one created. Two round-trips regardless of count.
+        '''
+        radio_ids = []
+        for error, _ in self.transact([self.msg_new_radio()] * count):
+            # hwsim acknowledges NEW_RADIO with the new radio id instead of 0
+            if error < 0:
+                log.warning(f"Failed to create hwsim radio: {OSError(-error, strerror(-error))}")
+                continue
+            radio_ids.append(error)
+
+        if count and not radio_ids:
+            raise RuntimeError('Failed to create any hwsim radio!')
+
+        radios = []
+        for radio_id, (error, replies) in zip(radio_ids, self.transact([self.msg_get_radio(radio_id) for radio_id in radio_ids])):
+            self.check(error, f'hwsim{radio_id}')
+            _, attrs = self.parse(replies[0])
+            radios.append((f'hwsim{radio_id}', bytes(attrs[self.ATTR_RADIO_NAME]).rstrip(b'\0').decode()))
+        return radios
+
+    def del_radios(self, hwsims: Iterable[str]):
+        with self.batch() as batch:
+            for hwsim in hwsims:
+                batch.del_radio(int(hwsim.removeprefix('hwsim')), missing_ok=True)
+
+
 class PhyManagement:
+    '''
+    Pool of hwsim radios kept in a stub namespace until a router takes one.
+    Set `pool_target` (or call `configure_pool`) to keep that many radios pre-created,
+    refilled in the background in batches of `pool_batch`.
+    '''
 
-    tool_mgmt = 'mac80211_hwsim_mgmt/hwsim_mgmt/hwsim_mgmt'
     initialized = False
     stub_ns: Namespace
-    popped_phy: set[str] = set()
+    stub_nl80211: Nl80211
+    stub_hwsim: Hwsim
+    stub_worker: NamespaceWorker
+    stub_sysfs: SysfsMount | None
 
-    @classmethod
-    def _hwsim_mgmt_add(cls):
-        with cls.stub_ns:
-            process = run([cls.tool_mgmt, '-c'], stdout=subprocess.PIPE, check=True)
-            
-            hwsim_id = process.stdout.decode().split()[-1]
-            hwsim_id = int(hwsim_id)
-
-            hwsim = f'hwsim{hwsim_id}'
-            phys = listdir(f'/sys/devices/virtual/mac80211_hwsim/{hwsim}/ieee80211')
-            if len(phys) == 0:
-                raise RuntimeError('No PHY found in newly created hwsim!')
-        
-            return (hwsim, phys[0])
+    pool_target: int = 0
+    pool_batch: int = 16
+
+    popped_phy: set[str] = set()
+    _free: deque[tuple[str, str]] = deque()
+    _lock = threading.Lock()
+    _prepare_lock = threading.Lock()
+    _refill_wanted = threading.Event()
+    _refill_stop = threading.Event()
+    _refill_thread: threading.Thread | None = None
     
     @classmethod
     def _prepare_ns(cls):
@@ -43,48 +128,152 @@ class PhyManagement:
         #     log.warning("Stub namespace already created! Are you reloading?")
         #     return
 
-        cls.stub_ns = Namespace(mnt=True, net=True)
+        # with the new mount API, the stub sysfs is a detached mount and the stub needs no mount namespace
+        detached_sysfs = mount_api_supported()
+        ns_kwargs = {} if detached_sysfs else {'mnt': True}
+
+        pinned_path = StateJournal.stub_netns_path()
+        if pinned_path and is_mountpoint(pinned_path):
+            # a previous controller left its stub netns pinned, radios in routers still belong to it
+            log.info(f"Reusing stub netns pinned at {pinned_path}")
+            cls.stub_ns = Namespace(net=pinned_path, **ns_kwargs)
+        else:
+            cls.stub_ns = Namespace(net=True, **ns_kwargs)
+            if pinned_path:
+                cls._pin_netns(pinned_path)
+
         with cls.stub_ns:
-            mount(None, '/', None, None, propagation='rprivate')    # change propagation
-            mount('sysfs', '/sys', 'sysfs', None)                   # in-place mount sysfs
+            if detached_sysfs:
+                cls.stub_sysfs = SysfsMount()
+            else:
+                mount(None, '/', None, None, propagation='rprivate')    # change propagation
+                mount('sysfs', '/sys', 'sysfs', None)                   # in-place mount sysfs
+                cls.stub_sysfs = None
+            cls.stub_nl80211 = Nl80211()
+            cls.stub_hwsim = Hwsim()
 
     @classmethod
-    def _iter_unused_phy(cls):
+    def _pin_netns(cls, pinned_path: str):
+        # same as `ip netns add`: bind mount the netns file so it outlives this process
         try:
-            hwsims = listdir('/sys/devices/virtual/mac80211_hwsim')
-            for hwsim in hwsims:
-                phys = listdir(f'/sys/devices/virtual/mac80211_hwsim/{hwsim}/ieee80211')
-                for phy in phys:
-                    if phy in cls.popped_phy:
-                        continue
-                    yield (hwsim, phy)
-        except FileNotFoundError:
-            pass
+            os.makedirs(os.path.dirname(pinned_path), exist_ok=True)
+            open(pinned_path, 'a').close()
+            mount(f'/proc/{os.getpid()}/fd/{cls.stub_ns.net}', pinned_path, None, None, bind=True)
+        except OSError as e:
+            log.warning(f"Failed to pin stub netns at {pinned_path}, routers will not survive a controller restart: {e}")
+
+    @classmethod
+    def _refill_loop(cls):
+        while not cls._refill_stop.is_set():
+            cls._refill_wanted.wait()
+            cls._refill_wanted.clear()
+
+            while not cls._refill_stop.is_set():
+                with cls._lock:
+                    missing = cls.pool_target - len(cls._free)
+                if missing <= 0:
+                    break
+                # created outside the lock, pop() should not wait for a whole batch
+                try:
+                    radios = cls.stub_hwsim.new_radios(min(missing, cls.pool_batch))
+                except Exception as e:
+                    log.error(f"Failed to refill radio pool: {e}")
+                    Metrics.count('radio_pool_refill_failures')
+                    break
+                with cls._lock:
+                    cls._free.extend(radios)
+                    free = len(cls._free)
+                log.debug(f"Refilled radio pool with {len(radios)} radios, {free} free")
+
+    @classmethod
+    def _kick_refill(cls):
+        if len(cls._free) >= cls.pool_target:
+            return
+        if cls._refill_thread is None:
+            cls._refill_stop.clear()
+            cls._refill_thread = threading.Thread(target=cls._refill_loop, name='jk-radio-pool', daemon=True)
+            cls._refill_thread.start()
+        cls._refill_wanted.set()
 
     @classmethod
     def prepare(cls):
+        '''
+        Create the stub namespace and start the pool. Done once, on `node_manager.init()`
+        or on the first radio taken, whichever comes first.
+        '''
         # if not path.exists('/sys/devices/virtual/mac80211_hwsim'):
         #     raise RuntimeError('Linux kernel module mac80211_hwsim not loaded!')
         
-        cls._prepare_ns()
+        with cls._prepare_lock:
+            if cls.initialized:
+                return
+            cls._prepare_ns()
+            # sysfs lookups of pooled PHYs run here instead of entering the stub namespace each time
+            cls.stub_worker = NamespaceWorker(cls.stub_ns, name='jk-stub-ns')
+            cls.initialized = True
+        atexit.register(cls.drain)
+        cls._kick_refill()
+
+    @classmethod
+    def configure_pool(cls, target: int, batch: int | None = None):
+        cls.pool_target = target
+        if batch:
+            cls.pool_batch = batch
+        if cls.initialized:
+            cls._kick_refill()
 
     @classmethod
+    @Metrics.timed('phy_pop')
     def pop(cls):
-        try:
-            hwsim, phy = next(cls._iter_unused_phy())
-            log.debug(f"Popped PHY from unused pile: {phy}")
-        except StopIteration:
-            hwsim, phy = cls._hwsim_mgmt_add()
-            log.debug(f"Popped PHY from newly created hwsim: {phy}")
+        cls.prepare()
+
+        # routers may be created from several threads at once (see Fleet)
+        with cls._lock:
+            if not cls._free:
+                Metrics.count('radio_pool_misses')
+                cls._free.extend(cls.stub_hwsim.new_radios(max(1, min(cls.pool_batch, cls.pool_target))))
+                log.debug(f"Radio pool empty, created {len(cls._free)} radios")
+
+            hwsim, phy = cls._free.popleft()
+            cls.popped_phy.add(phy)
 
-        cls.popped_phy.add(phy)
+        log.debug(f"Popped PHY from pool: {phy}")
+        cls._kick_refill()
         return (hwsim, phy)
     
     @classmethod
-    def push(cls, phy: str):
-        cls.popped_phy.add(phy[1])
+    def push(cls, hwsim: str, phy: str, delete: bool = False):
+        '''
+        Return a PHY to the pool. It must be back in the stub namespace by now.
+        '''
+        with cls._lock:
+            cls.popped_phy.discard(phy)
+            if delete or len(cls._free) >= max(cls.pool_target, cls.pool_batch):
+                cls.stub_hwsim.del_radios([hwsim])
+            else:
+                cls._free.append((hwsim, phy))
 
-PhyManagement.prepare()
+    @classmethod
+    def drain(cls):
+        '''
+        Delete every free radio in the pool.
+        '''
+        cls.pool_target = 0
+        if not cls.initialized:
+            return
+
+        # a refill already under way would add radios after the clear, let it finish first
+        thread = cls._refill_thread
+        if thread is not None:
+            cls._refill_stop.set()
+            cls._refill_wanted.set()
+            thread.join()
+            cls._refill_thread = None
+        with cls._lock:
+            hwsims = [hwsim for hwsim, _ in cls._free]
+            cls._free.clear()
+        if hwsims:
+            cls.stub_hwsim.del_radios(hwsims)
 
 
 class RadioPhy:
@@ -93,8 +282,9 @@ class RadioPhy:
     Contains everything you need to control the PHY, such as binding to network namespace, etc.
     '''
 
-    _hwsim: str
+    _hwsim: str | None
     _phy: str
+    _index: int
     _macaddr: str
 
     origin_netns: Namespace
@@ -105,24 +295,80 @@ class RadioPhy:
         self._origin_netns = PhyManagement.stub_ns
         self._target_netns = None
 
-        # get MAC address
-        with self._origin_netns:
-            import os; print(os.listdir('/sys/class/ieee80211'))
-            with open(f'/sys/class/ieee80211/{self._phy}/macaddress') as f:
-                self._macaddr = f.read().strip()
+        # get MAC address and wiphy index, the index stays the same across namespaces
+        if PhyManagement.stub_sysfs is not None:
+            self._macaddr = PhyManagement.stub_sysfs.read(f'class/ieee80211/{self._phy}/macaddress')
+            self._index = int(PhyManagement.stub_sysfs.read(f'class/ieee80211/{self._phy}/index'))
+        else:
+            self._macaddr, self._index = PhyManagement.stub_worker.call(self._read_sysfs, self._phy)
+
+    @staticmethod
+    def _read_sysfs(phy: str) -> tuple[str, int]:
+        with open(f'/sys/class/ieee80211/{phy}/macaddress') as f:
+            macaddr = f.read().strip()
+        with open(f'/sys/class/ieee80211/{phy}/index') as f:
+            index = int(f.read())
+        return (macaddr, index)
 
     def __del__(self):
+        if getattr(self, '_hwsim', None) is None:
+            # abandoned, it stays where it is. or __init__ never got a PHY from the pool
+            return
         try:
             self.unbind()
         except Exception as e:
             # log.error(f"{self}: __del__: Failed to unbind PHY {self._phy}: {e}")
-            pass
-        PhyManagement.push(self._phy)
+            # the PHY is stuck elsewhere, do not hand it out again
+            return
+        PhyManagement.push(self._hwsim, self._phy)
     
     def __repr__(self):
         bound_str = f'bound' if self._target_netns else 'not bound'
         return f'<RadioPhy {self._phy} {bound_str}>'
 
+    @classmethod
+    def adopt(cls, hwsim: str, phy: str, macaddr: str, netns_pid: int) -> 'RadioPhy':
+        '''
+        Take over a PHY already bound into the netns of `netns_pid`, e.g. by a previous controller.
+        Checked against the sysfs of the target, raises LookupError if the PHY is not there.
+        '''
+        try:
+            # the container has sysfs mounted from its own netns, so its PHYs are visible there
+            with open(f'/proc/{netns_pid}/root/sys/class/ieee80211/{phy}/macaddress') as f:
+                found_macaddr = f.read().strip()
+            with open(f'/proc/{netns_pid}/root/sys/class/ieee80211/{phy}/index') as f:
+                index = int(f.read())
+        except OSError as e:
+            raise LookupError(f"PHY {phy} not found in netns of PID {netns_pid}: {e}")
+        if found_macaddr != macaddr:
+            raise LookupError(f"PHY {phy} has MAC address {found_macaddr}, expected {macaddr}")
+
+        PhyManagement.prepare()
+        radio = cls.__new__(cls)
+        radio._hwsim, radio._phy, radio._index, radio._macaddr = hwsim, phy, index, macaddr
+        radio._origin_netns = PhyManagement.stub_ns
+        radio._target_netns = Namespace(net=netns_pid)
+        with PhyManagement._lock:
+            PhyManagement.popped_phy.add(phy)
+        return radio
+
+    def abandon(self):
+        '''
+        Forget the PHY without unbinding it, so it is left in place for a later `adopt`.
+        '''
+        with PhyManagement._lock:
+            PhyManagement.popped_phy.discard(self._phy)
+        self._hwsim = None
+        self._target_netns = None
+
+    @property
+    def hwsim(self):
+        return self._hwsim
+
+    @property
+    def phy(self):
+        return self._phy
+
     @property
     def macaddr(self):
         return self._macaddr
@@ -130,27 +376,60 @@ class RadioPhy:
     def isbound(self):
         return self._target_netns is not None
     
-    def bind(self, netns_pid: int):
-        if self.isbound():
-            raise ValueError(f"PHY {self._phy} is already bound!")
-        
-        self._target_netns = Namespace(net=netns_pid, mnt=True)
-        with self._target_netns:
-            mount(None, '/', None, None, propagation='rprivate')
-            mount('sysfs', '/sys', 'sysfs', None)
-
-        # move from origin to target netns
-        with self._origin_netns:
-            run(['/usr/bin/iw', 'phy', self._phy, 'set', 'netns', 'name', f'/proc/self/fd/{self._target_netns.net}'], pass_fds=[self._target_netns.net], check=True)
+    def bind(self, netns: int | Namespace):
+        self.bind_many([(self, netns)])
     
     def unbind(self):
-        if not self.isbound():
-            return
-        
-        # return to original netns
-        with self._target_netns:
-            run(['/usr/bin/iw', 'phy', self._phy, 'set', 'netns', 'name', f'/proc/self/fd/{self._origin_netns.net}'], pass_fds=[self._origin_netns.net], check=True)
+        self.unbind_many([self])
 
-        self._target_netns = None
-        # TODO: check if by setting self._netns = None, __del__ will be called. Otherwise potential leak
-        log.warning(f"{self}: unbind(): Please check if {self._target_netns} is destroyed after this!")
+    @classmethod
+    @Metrics.timed('radio_bind')
+    def bind_many(cls, bindings: Iterable[tuple['RadioPhy', int | Namespace]]):
+        '''
+        Move many PHYs from the stub namespace into their target netns in a single nl80211 round-trip.
+        A target is a PID, or a Namespace with net already open (e.g. a router's) to spare reopening it.
+        '''
+        targets = []
+        for radio, netns in bindings:
+            if radio.isbound():
+                raise ValueError(f"PHY {radio._phy} is already bound!")
+            targets.append((radio, netns if isinstance(netns, Namespace) else Namespace(net=netns)))
+
+        # move from origin to target netns
+        batch = PhyManagement.stub_nl80211.batch()
+        for radio, netns in targets:
+            batch.wiphy_netns(radio._index, netns.net)
+        results = batch.commit(check=False)
+
+        # the ones that moved are bound whatever happened to the rest, so unbind() brings them back
+        failed = []
+        for (radio, netns), error in zip(targets, results):
+            if error < 0:
+                failed.append((radio, error))
+            else:
+                radio._target_netns = netns
+        if failed:
+            radio, error = failed[0]
+            if len(failed) > 1:
+                log.error(f"Failed to bind {len(failed)} PHYs: {', '.join(radio._phy for radio, _ in failed)}")
+            NetlinkSocket.check(error, radio._phy)
+
+    @classmethod
+    @Metrics.timed('radio_unbind')
+    def unbind_many(cls, radios: Iterable['RadioPhy']):
+        '''
+        Return many PHYs to the stub namespace. nl80211 only finds a PHY from inside its current netns,
+        so this costs one socket per bound radio, but no process spawns.
+        '''
+        for radio in radios:
+            if not radio.isbound():
+                continue
+
+            # return to original netns
+            nl80211 = Nl80211.inside(radio._target_netns)
+            try:
+                nl80211.wiphy_netns(radio._index, radio._origin_netns.net)
+            finally:
+                nl80211.close()
+
+            radio._target_netns = None
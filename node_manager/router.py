@@ -1,18 +1,34 @@
 # Dengan nama Allah yang maha pemurah lagi maha penyayang
 # Semoga projek ni cepat siap and menjadi aminnnn AHAHAHAHAHAHAH
 
+import asyncio
 import atexit
+import os
+import select
+import subprocess
+import threading
+import weakref
+from collections import deque
+from concurrent.futures import Future
+from time import monotonic
+from typing import Callable
 from os import set_blocking, path, listdir, kill as kill_pid
+from stat import S_ISFIFO
+from errno import ENOSYS
 import struct
-import subprocess
 from docker import DockerClient
+from docker.errors import NotFound
 from docker.models.containers import Container
 from docker.types import Mount
 from random import randint
 from requests.exceptions import ReadTimeout
 import logging
 from .radio import RadioPhy
-from .linuxutils import Namespace, mount
+from .linuxutils import Namespace, NamespaceWorker, RtNetlink, MountAttr, mount, open_tree, move_mount, mount_setattr, mount_api_supported, wait_for_path, run_in_namespace
+from .dockerevents import ContainerStateCache
+from .dockerpool import DockerPool
+from .journal import StateJournal
+from .metrics import Metrics
 
 log = logging.getLogger(__name__)
 
@@ -27,13 +43,21 @@ class ULed:
 
     `testbed:white:blink` will then controlled by kernel LED triggers such as blink or netdev.
     Brightness of 0 means LED is off, 1 means LED is on.
+
+    Once registered to a `LedMonitor`, reading brightness only returns what the monitor has seen.
     '''
     max_brightness = 1
     
     name: str
     _brightness: int
+    _sysfs_fd: int | None
+    _monitor: 'LedMonitor | None'
 
     def __init__(self, led_name: str):
+        self._brightness = 0
+        self._sysfs_fd = None
+        self._monitor = None
+
         # check if kernel module is loaded
         if not path.exists('/dev/uleds'):
             raise OSError('Linux kernel module uleds not loaded!')
@@ -49,33 +73,216 @@ class ULed:
         self.name = led_name
 
     def __del__(self):
+        if getattr(self, '_monitor', None):
+            self._monitor.unregister(self)
+        if getattr(self, '_sysfs_fd', None) is not None:
+            os.close(self._sysfs_fd)
+            self._sysfs_fd = None
+
         # NOTE: closing file handle will destroy LED device from kernel
         if hasattr(self, '_dev_hnd'):
             self._dev_hnd.close()
 
     def __repr__(self):
         return f'<ULeds {self.name!r}>'
-    
-    @property
-    def brightness(self):
+
+    def fileno(self) -> int:
+        return self._dev_hnd.fileno()
+
+    def _drain(self) -> int | None:
+        # uleds only keeps the latest brightness, so one read is all there is per wakeup
         recvbuf = self._dev_hnd.read(4)
         if recvbuf is None:
-            return self._brightness
-        
+            return None
+
         self._brightness = struct.unpack('i', recvbuf)[0]
         return self._brightness
     
+    @property
+    def brightness(self):
+        if self._monitor is None:
+            self._drain()
+        return self._brightness
+    
     @brightness.setter
     def brightness(self, brightness: int):
         if not isinstance(brightness, int):
             raise TypeError(f'Expected int, got {type(brightness)}')
 
-        with open(f'/sys/class/leds/{self.name}/brightness', 'w') as f:
-            f.write(str(brightness))
+        if self._sysfs_fd is None:
+            self._sysfs_fd = os.open(f'/sys/class/leds/{self.name}/brightness', os.O_WRONLY)
+        os.pwrite(self._sysfs_fd, str(brightness).encode(), 0)
         self._brightness = brightness
 
 
+class LedMonitor:
+    '''
+    Watches many ULeds with one epoll set, and keeps the recent transitions of each LED.
+
+    Usage example:
+    >>> monitor = LedMonitor()
+    >>> monitor.register(*router.leds.values())
+    >>> monitor.start()                 # background thread, or
+    >>> monitor.attach()                # reader on the running asyncio loop
+    >>> monitor.history(led)            # [(monotonic timestamp, brightness), ...]
+    >>> monitor.activity(led)           # transitions per second over the last `activity_window`
+
+    Callbacks given to `subscribe` are called as callback(led, brightness, timestamp)
+    from whichever thread is polling.
+    '''
+
+    history_size = 256
+    activity_window = 10.0
+
+    _epoll: select.epoll
+    _leds: weakref.WeakValueDictionary[int, ULed]
+    _history: dict[int, deque[tuple[float, int]]]
+    _callbacks: list[Callable[[ULed, int, float], None]]
+    _lock: threading.RLock
+    _thread: threading.Thread | None
+    _stopping: bool
+    _loop: asyncio.AbstractEventLoop | None
+
+    def __init__(self, history_size: int | None = None):
+        if history_size is not None:
+            self.history_size = history_size
+        self._epoll = select.epoll()
+        # LEDs going away unregister themselves, the monitor must not keep them alive
+        self._leds = weakref.WeakValueDictionary()
+        self._history = {}
+        self._callbacks = []
+        self._lock = threading.RLock()
+        self._thread = None
+        self._stopping = False
+        self._loop = None
+
+    def __del__(self):
+        self.close()
+
+    def __repr__(self):
+        return f'<LedMonitor {len(self._leds)} leds>'
+
+    def __len__(self):
+        return len(self._leds)
+
+    def register(self, *leds: ULed):
+        with self._lock:
+            for led in leds:
+                if led._monitor is self:
+                    continue
+                if led._monitor is not None:
+                    raise ValueError(f"LED {led.name} is already registered to another monitor")
+
+                fd = led.fileno()
+                self._epoll.register(fd, select.EPOLLIN)
+                self._leds[fd] = led
+                self._history[fd] = deque([(monotonic(), led._brightness)], maxlen=self.history_size)
+                led._monitor = self
+
+    def unregister(self, *leds: ULed):
+        with self._lock:
+            for led in leds:
+                if led._monitor is not self:
+                    continue
+
+                fd = led.fileno()
+                try:
+                    self._epoll.unregister(fd)
+                except (OSError, ValueError):
+                    pass
+                self._leds.pop(fd, None)
+                self._history.pop(fd, None)
+                led._monitor = None
+
+    def subscribe(self, callback: Callable[[ULed, int, float], None]):
+        self._callbacks.append(callback)
+
+    def unsubscribe(self, callback: Callable[[ULed, int, float], None]):
+        self._callbacks.remove(callback)
+
+    def poll(self, timeout: float = 0) -> int:
+        '''
+        Drains every LED with pending events, waiting up to `timeout` seconds for the first one.
+        Returns the number of transitions recorded.
+        '''
+        events = self._epoll.poll(timeout, max(1, len(self._leds)))
+        timestamp = monotonic()
+        changes = []
+        with self._lock:
+            for fd, _ in events:
+                led = self._leds.get(fd)
+                if led is None:
+                    continue
+                brightness = led._drain()
+                if brightness is None:
+                    continue
+                history = self._history[fd]
+                if history[-1][1] != brightness:
+                    history.append((timestamp, brightness))
+                    changes.append((led, brightness))
+
+        for led, brightness in changes:
+            for callback in self._callbacks:
+                try:
+                    callback(led, brightness, timestamp)
+                except Exception as e:
+                    log.warning(f"LED callback failed for {led.name}: {e}")
+        return len(changes)
+
+    def history(self, led: ULed) -> list[tuple[float, int]]:
+        with self._lock:
+            return list(self._history[led.fileno()])
+
+    def activity(self, led: ULed, window: float | None = None) -> float:
+        '''Transitions per second of `led` over the last `window` seconds.'''
+        window = window or self.activity_window
+        since = monotonic() - window
+        with self._lock:
+            count = sum(1 for timestamp, _ in reversed(self._history[led.fileno()]) if timestamp >= since)
+        return count / window
+
+    def _run(self):
+        while not self._stopping:
+            self.poll(0.5)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='jk-ledmon', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stopping = True
+        self._thread.join()
+        self._thread = None
+
+    def attach(self, loop: asyncio.AbstractEventLoop | None = None):
+        '''Poll from an asyncio loop instead of a thread. The epoll fd is the only reader.'''
+        self._loop = loop or asyncio.get_running_loop()
+        self._loop.add_reader(self._epoll.fileno(), self.poll)
+
+    def detach(self):
+        if self._loop:
+            self._loop.remove_reader(self._epoll.fileno())
+            self._loop = None
+
+    def close(self):
+        if getattr(self, '_epoll', None) is None or self._epoll.closed:
+            return
+        self.stop()
+        self.detach()
+        self.unregister(*list(self._leds.values()))
+        self._epoll.close()
+
+
 class Router:
+    waitlock_path = '/tmp/.wait-for-host'
+    waitlock_timeout = 3.0
+    run_env = {'PATH': '/usr/sbin:/usr/bin:/sbin:/bin', 'HOME': '/root', 'TERM': 'dumb'}
+
     _dockclt: DockerClient
     container: Container
     hostname: str
@@ -87,22 +294,134 @@ class Router:
     _radio: RadioPhy
 
     _running_ns: Namespace
+    _pid: int | None
+    _states: ContainerStateCache
+    _attached: bool
+    _died_attaching: bool
+    _attach_lock: threading.Lock
+    _workers: dict[str, NamespaceWorker]
+    _workers_lock: threading.Lock
+
+    def __init__(self, hostname:str = None, docker_connection: None|str|DockerClient = None, labels: dict[str, str] | None = None):
+        self._use_docker(docker_connection)
+        self.container = None
+        self._running_ns = None
+        self._init_host_side(hostname)
+
+        # create docker container. the low-level call spares the inspect containers.create() does,
+        # state is tracked from docker events anyway
+        api = self._dockclt.api
+        container_id = api.create_container(
+            'jaringkan-openwrt:latest',
+            hostname=self.hostname,
+            labels=labels,
+            name=self.container_name,
+            tty=True,
+            host_config=api.create_host_config(
+                cap_add=['NET_ADMIN'],
+                mem_limit='128m',
+                mounts=[
+                    Mount('/tmp', None, type='tmpfs', tmpfs_size='128m', tmpfs_mode=0o777)
+                ],
+                network_mode='bridge',  # for wan interface
+            ),
+        )['Id']
+        self.container = self._dockclt.containers.prepare_model({'Id': container_id, 'Name': '/' + self.container_name})
+        self._watch_container('created')
+        self._record()
+        
+        # register atexit
+        atexit.register(self.__del__)
 
-    def __init__(self, hostname:str = None, docker_connection: None|str|DockerClient = None):
-        if isinstance(docker_connection, str) or docker_connection is None:
+    @classmethod
+    def attach(cls, hostname: str, docker_connection: None|str|DockerClient = None) -> 'Router':
+        '''
+        Adopt router `hostname` as a previous controller left it, instead of creating it.
+        The container must exist. If it is running, its PHY (as recorded in the `StateJournal`) and veth
+        are checked and taken over, whatever is missing is set up again, and the LEDs are recreated.
+        '''
+        record = StateJournal.router(hostname) or {}
+
+        router = cls.__new__(cls)
+        router.container = None
+        router._running_ns = None
+        router._use_docker(docker_connection)
+        container = router._dockclt.containers.get(record.get('container_id') or f'jk-{hostname}')
+        pid = container.attrs['State']['Pid']
+
+        radio = None
+        if container.status == 'running' and 'phy' in record:
+            try:
+                radio = RadioPhy.adopt(record['hwsim'], record['phy'], record['macaddr'], pid)
+            except LookupError as e:
+                log.warning(f"Router {hostname}: cannot adopt its PHY, binding a new one: {e}")
+
+        router._init_host_side(hostname, radio)
+        router.container = container
+        router._watch_container(container.status)
+        atexit.register(router.__del__)
+
+        if container.status == 'running':
+            router._reattach(pid)
+        router._record()
+        log.info(f"Router {hostname} attached ({container.status})")
+        return router
+
+    def detach(self):
+        '''
+        Leave the router running as it is and let go of it, for a later `Router.attach`.
+        '''
+        with self._attach_lock:
+            self._attached = False
+        self._running_ns = None
+        self._pid = None
+        self._close_workers()
+        self._radio.abandon()
+        self._forget_container()
+
+    def _use_docker(self, docker_connection: None|str|DockerClient):
+        if docker_connection is None:
+            self._dockclt = DockerPool.client()
+        elif isinstance(docker_connection, str):
             self._dockclt = DockerClient(docker_connection)
         elif isinstance(docker_connection, DockerClient):
             self._dockclt = docker_connection
         else:
             raise TypeError(f"docker_connection must be str or DockerClient, not {type(docker_connection)}")
-        
-        self.container = None
-        self._running_ns = None
-        
+
+    def _watch_container(self, status: str):
+        # container state comes from the shared docker events stream, cleanup runs as soon as it dies
+        self._states = ContainerStateCache.shared(self._dockclt)
+        self._states.update(self.container_name, status)
+        router_ref = weakref.ref(self)
+        def on_container_event(name: str, action: str, attributes: dict):
+            router = router_ref()
+            if router is not None and action == 'die':
+                router._on_stop()
+        self._on_container_event = on_container_event
+        self._states.watch(self.container_name, on_container_event)
+
+    def _record(self):
+        StateJournal.record_router(
+            self.hostname,
+            container_id=self.container.id,
+            hwsim=self._radio.hwsim,
+            phy=self._radio.phy,
+            macaddr=self._radio.macaddr,
+            veth=self.veth_name,
+        )
+    
+    def _init_host_side(self, hostname: str | None, radio: RadioPhy | None = None):
         if hostname is None:
             # hostname not provided, autogenerate 6 characters
             hostname = f'{randint(0x100000, 0xffffff):x}'
         self.hostname = hostname
+        self._attached = False
+        self._died_attaching = False
+        self._attach_lock = threading.Lock()
+        self._pid = None
+        self._workers = {}
+        self._workers_lock = threading.Lock()
         
         # create leds
         self._led_power = ULed(f'jk-{self.hostname}:green:power')
@@ -111,25 +430,8 @@ class Router:
         self._led_wlan = ULed(f'jk-{self.hostname}:green:wlan')
 
         # create radio
-        self._radio = RadioPhy()
+        self._radio = radio or RadioPhy()
 
-        # create docker container
-        self.container = self._dockclt.containers.create(
-            'jaringkan-openwrt:latest',
-            cap_add=['NET_ADMIN'],
-            hostname=self.hostname,
-            mem_limit='128m',
-            mounts=[
-                Mount('/tmp', None, type='tmpfs', tmpfs_size='128m', tmpfs_mode=0o777)
-            ],
-            name='jk-' + self.hostname,
-            network_mode='bridge',  # for wan interface
-            tty=True,
-        )
-        
-        # register atexit
-        atexit.register(self.__del__)
-    
     def __del__(self):
         if self.container:
             try:
@@ -137,28 +439,133 @@ class Router:
             except Exception as e:
                 # log.warning(f"Failed to stop router {self.hostname}: {e}")
                 pass
+            self._remove_container()
+
+    def remove(self):
+        '''
+        Stop the router and remove its container, for good.
+        '''
+        atexit.unregister(self.__del__)
+        if self.container:
+            self.stop()
+            self._remove_container()
+
+    def _remove_container(self):
+        try:
             self.container.remove()
+        except NotFound:
+            # already removed in bulk with its fleet
+            pass
+        self._states.unwatch(self.container_name, self._on_container_event)
+        self.container = None
+        StateJournal.forget_router(self.hostname)
+
+    def _forget_container(self):
+        # the container is torn down by someone else (see Fleet.shutdown), stop watching it
+        # and don't let __del__ stop or remove it again
+        if self.container:
+            self._states.unwatch(self.container_name, self._on_container_event)
+        atexit.unregister(self.__del__)
+        self.container = None
 
     def __repr__(self):
         return f'<Router hostname={self.hostname!r} {self.status}>'
     
-    def _create_veth(self):
-        subprocess.run(['/usr/bin/ip', 'link', 'add', f'vjk-{self.hostname[:8]}', 'type', 'veth', 'peer', 'name', f'vjkp{self.hostname[:8]}'], check=True)
-        subprocess.run(['/usr/bin/ip', 'link', 'set', f'vjkp{self.hostname[:8]}', 'netns', str(self.container.attrs['State']['Pid'])], check=True)
-        # subprocess.run(['/usr/bin/nsenter', '-t', str(self.container.attrs['State']['Pid']), '-n', '/usr/bin/ip', 'link', 'set', f'vjkp{self._hostname[:8]}', 'name', 'eth1'], check=True)
-        with Namespace(net=self.container.attrs['State']['Pid']):
-            subprocess.run(['/usr/bin/ip', 'link', 'set', f'vjkp{self.hostname[:8]}', 'name', 'eth1'], check=True)
-            subprocess.run(['/usr/bin/ip', 'link', 'set', 'eth1', 'down'], check=True)
+    @property
+    def pid(self) -> int | None:
+        '''Host PID of the container's init while attached.'''
+        return self._pid
+
+    @property
+    def container_name(self):
+        return 'jk-' + self.hostname
+
+    @property
+    def veth_name(self):
+        return f'vjk-{self.hostname[:8]}'
+
+    @Metrics.timed('router_create_veth')
+    def _create_veth(self, netns: Namespace):
+        # one round-trip: drop whatever is left from a previous start, then create the pair
+        # with the peer already named eth1 inside the container netns
+        with RtNetlink.host().batch() as batch:
+            batch.link_del(self.veth_name, missing_ok=True)
+            batch.veth_add(self.veth_name, 'eth1', peer_netns_fd=netns.net)
 
     def _remove_veth(self):
         try:
-            subprocess.run(['/usr/bin/ip', 'link', 'del', f'vjk-{self.hostname[:8]}'], check=True)
-        except subprocess.CalledProcessError as e:
+            RtNetlink.host().link_del(self.veth_name, missing_ok=True)
+        except OSError as e:
             log.warning(f"Failed to remove veth: {e}")
             pass
 
-    def _on_stop(self):
-        self._remove_veth()
+    @Metrics.timed('router_wait_for_host')
+    def _wait_for_host(self, pid: int) -> bool:
+        # container preinit publishes a FIFO in its /tmp once it is ready for us, watch for it
+        # through the container's root instead of exec-ing into it
+        return wait_for_path(f'/proc/{pid}/root{self.waitlock_path}', self.waitlock_timeout)
+
+    def _release_host(self, pid: int):
+        lock_path = f'/proc/{pid}/root{self.waitlock_path}'
+        try:
+            # preinit keeps the FIFO open for reading, so this never blocks
+            fd = os.open(lock_path, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError as e:
+            log.warning(f"Failed to release container waitlock: {e}")
+            return
+
+        try:
+            if S_ISFIFO(os.fstat(fd).st_mode):
+                os.write(fd, b'\n')
+            else:
+                # older images poll for a plain file to be removed
+                os.unlink(lock_path)
+        finally:
+            os.close(fd)
+
+    @Metrics.timed('router_bind_leds')
+    def _bind_leds(self, ns: Namespace):
+        lednames = [self._led_power.name, self._led_wan.name, self._led_lan.name, self._led_wlan.name]
+        if not mount_api_supported():
+            with ns.only('mnt'):
+                for ledname in lednames:
+                    mount(f'/sys/class/leds/{ledname}', f'/sys/class/leds/{ledname}', None, None, bind=True)    # bind mount
+                    mount(None, f'/sys/class/leds/{ledname}', None, None, remount=True)     # remount read-write
+            return
+
+        # clone the LED directories off the host's sysfs as detached read-write mounts, no namespace needed,
+        # then attach them over the container's read-only ones in a single visit to its mount namespace
+        trees = []
+        try:
+            for ledname in lednames:
+                trees.append(open_tree(f'/sys/class/leds/{ledname}'))
+                try:
+                    mount_setattr(trees[-1], attr_clr=MountAttr.RDONLY)
+                except OSError as e:
+                    # before 5.12. a clone of the host's sysfs is read-write anyway, unless the host's is not
+                    if e.errno != ENOSYS:
+                        raise
+            with ns.only('mnt'):
+                for ledname, tree in zip(lednames, trees):
+                    move_mount(tree, f'/sys/class/leds/{ledname}')
+        finally:
+            for tree in trees:
+                os.close(tree)
+
+    def _on_stop(self, remove_veth: bool = True):
+        # runs from stop() and from the docker events thread, whichever comes first
+        with self._attach_lock:
+            if not self._attached:
+                # still attaching, whoever is attaching cleans up once it is done
+                self._died_attaching = True
+                return
+            self._attached = False
+
+        self._running_ns = None
+        self._pid = None
+        self._close_workers()
+        if remove_veth:
+            self._remove_veth()
         try:
             self._radio.unbind()
         except Exception as e:
@@ -171,12 +578,24 @@ class Router:
     
     @property
     def status(self):
-        self.container.reload()
-        if hasattr(self, '_status') and self._status == 'running' and self.container.status == 'exited':
-            self._on_stop()
-        self._status = self.container.status
-        return self.container.status
+        status = self._states.status(self.container_name)
+        if status is None:
+            # events stream not synced, ask docker
+            self.container.reload()
+            status = self.container.status
+            if status == 'exited':
+                self._on_stop()
+        return status
     
+    @property
+    def leds(self) -> dict[str, ULed]:
+        return {
+            'power': self._led_power,
+            'wan': self._led_wan,
+            'lan': self._led_lan,
+            'wlan': self._led_wlan
+        }
+
     def get_leds(self):
         return {
             'power': self._led_power.brightness,
@@ -189,37 +608,134 @@ class Router:
         if self.status == 'running':
             return
 
-        self.container.start()
-        self.container.reload()
-        pid = self.container.attrs['State']['Pid']
-        log.info(f"Router {self.hostname} started with PID {pid}")
-
-        # wait for container waitlock
-        wait_result = self.container.exec_run('''/bin/sh -c "
-            for i in 1 2 3; do
-                if [ -e /tmp/.wait-for-host ]; then
-                    exit 0
-                fi
-                sleep 1
-            done; exit 1
-        "''')
-        if wait_result[0] != 0:
-            log.warning(f"Timed out waiting for container to be ready for host. Continuing with initialization.")
-
-        # create lan port
-        self._create_veth()
-
-        # bind radio to container
-        self._radio.bind(pid)
-
-        # bind mount leds to read-write
-        with Namespace(mnt=pid):
-            for ledname in [self._led_power.name, self._led_wan.name, self._led_lan.name, self._led_wlan.name]:
-                mount(f'/sys/class/leds/{ledname}', f'/sys/class/leds/{ledname}', None, None, bind=True)    # bind mount
-                mount(None, f'/sys/class/leds/{ledname}', None, None, remount=True)     # remount read-write
-
-        # done. remove waitlock from container
-        self.container.exec_run('rm -f /tmp/.wait-for-host')
+        with Metrics.span('router_start', self.hostname):
+            self.container.start()
+            self.container.reload()
+            self._states.update(self.container_name, self.container.status)
+            pid = self.container.attrs['State']['Pid']
+            log.info(f"Router {self.hostname} started with PID {pid}")
+
+            # wait for container waitlock
+            if not self._wait_for_host(pid):
+                log.warning(f"Timed out waiting for container to be ready for host. Continuing with initialization.")
+                Metrics.count('router_waitlock_timeouts')
+
+            self._attach(pid)
+
+    def _attach(self, pid: int):
+        with self._attach_lock:
+            self._died_attaching = False
+        self._pid = pid
+        try:
+            # kept for the router's lifetime, everything below and run() reuse its handles
+            self._running_ns = Namespace(pid=pid, mnt=pid, net=pid, uts=pid, ipc=pid)
+
+            # create lan port
+            self._create_veth(self._running_ns)
+
+            # bind radio to container
+            self._radio.bind(self._running_ns.only('net'))
+
+            # bind mount leds to read-write
+            self._bind_leds(self._running_ns)
+        except Exception:
+            self._attach_failed()
+            raise
+
+        if self._mark_attached():
+            # done. release waitlock in container
+            self._release_host(pid)
+
+    def _mark_attached(self) -> bool:
+        # only now can a die event tear the router down, one seen while attaching is handled here
+        with self._attach_lock:
+            self._attached = True
+            died, self._died_attaching = self._died_attaching, False
+        if died:
+            log.info(f"Router {self.hostname} died while attaching")
+            self._on_stop()
+        return not died
+
+    def _attach_failed(self):
+        # undo whatever was set up before it failed
+        self._mark_attached()
+        self._on_stop()
+
+    def run(self, cmd: str | list[str], input: bytes | None = None, timeout: float | None = None, check: bool = False, env: dict[str, str] | None = None) -> subprocess.CompletedProcess:
+        '''
+        Runs a command inside the router, entering its namespaces directly instead of going through docker exec.
+        A string is run with /bin/sh -c. Output is captured as bytes.
+
+        Usage example:
+        >>> router.run(['uci', 'get', 'system.@system[0].hostname']).stdout
+        b'test1\\n'
+        '''
+        running_ns = self._running_ns
+        if running_ns is None:
+            raise RuntimeError(f"Router {self.hostname} is not running")
+
+        argv = ['/bin/sh', '-c', cmd] if isinstance(cmd, str) else list(cmd)
+        return run_in_namespace(running_ns, argv, input, timeout, check, env or self.run_env)
+
+    def _worker(self, kind: str) -> NamespaceWorker:
+        running_ns = self._running_ns
+        if running_ns is None:
+            raise RuntimeError(f"Router {self.hostname} is not running")
+
+        with self._workers_lock:
+            worker = self._workers.get(kind)
+            if worker is None:
+                if kind == 'sysfs':
+                    worker = NamespaceWorker.with_sysfs(running_ns, name=f'jk-{self.hostname[:8]}-sysfs')
+                else:
+                    worker = NamespaceWorker(running_ns, name=f'jk-{self.hostname[:8]}')
+                self._workers[kind] = worker
+            return worker
+
+    def _close_workers(self):
+        with self._workers_lock:
+            workers, self._workers = self._workers, {}
+        for worker in workers.values():
+            # may be called from a worker itself, don't wait for it
+            worker.close(wait=False)
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        '''
+        Calls `fn` on a thread that lives inside the router's namespaces (mnt, net, pid, uts, ipc) while it runs,
+        so nothing is entered per call and routers are worked on in parallel. See `NamespaceWorker`.
+
+        Usage example:
+        >>> router.submit(os.listdir, '/sys/class/ieee80211').result()
+        ['phy3']
+        '''
+        return self._worker('run').submit(fn, *args, **kwargs)
+
+    def submit_sysfs(self, fn: Callable, *args, **kwargs) -> Future:
+        '''
+        Like `submit`, but from the host's filesystem with a /sys of the router's netns, see `NamespaceWorker.with_sysfs`.
+        '''
+        return self._worker('sysfs').submit(fn, *args, **kwargs)
+
+    def _reattach(self, pid: int):
+        # like _attach, but the container is already up and may still have some of its resources
+        with self._attach_lock:
+            self._died_attaching = False
+        self._pid = pid
+        try:
+            self._running_ns = Namespace(pid=pid, mnt=pid, net=pid, uts=pid, ipc=pid)
+
+            if not RtNetlink.host().links_exist([self.veth_name])[self.veth_name]:
+                self._create_veth(self._running_ns)
+            if not self._radio.isbound():
+                self._radio.bind(self._running_ns.only('net'))
+
+            # the LEDs died with the previous controller, and their bind mounts went with them
+            self._bind_leds(self._running_ns)
+        except Exception:
+            self._attach_failed()
+            raise
+
+        self._mark_attached()
 
     def pause(self):
         self.container.pause()
@@ -232,8 +748,10 @@ class Router:
             return
         
         log.info(f"Stopping router {self.hostname}...")
-        self.container.stop(timeout=10)
-        self.container.reload()
-        if self.container.attrs['State']['ExitCode'] != 0:
-            log.warning(f"Container stopped with non-zero code {self.container.attrs['State']['ExitCode']}")
-        self._on_stop()
+        with Metrics.span('router_stop', self.hostname):
+            self.container.stop(timeout=10)
+            self.container.reload()
+            self._states.update(self.container_name, self.container.status)
+            if self.container.attrs['State']['ExitCode'] != 0:
+                log.warning(f"Container stopped with non-zero code {self.container.attrs['State']['ExitCode']}")
+            self._on_stop()
@@ -0,0 +1,358 @@
+import json
+import re
+from typing import IO, Iterable, Iterator
+
+import logging
+log = logging.getLogger(__name__)
+
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from .fleet import Fleet
+    from .mapping import WirelessMedium
+
+
+# path loss parameters a topology may set, see WirelessMedium.configure
+MEDIUM_PARAMS = ('path_loss_exp', 'xg', 'default_tx_power', 'min_snr', 'noise_level')
+
+_whitespace = re.compile(r'\s*')
+
+
+class _JsonStream:
+    '''
+    Pulls values out of a JSON document one at a time, `chunk_size` characters are read at a time,
+    so a list of nodes never has to be in memory at once.
+    '''
+
+    def __init__(self, f: IO[str], chunk_size: int = 1 << 16):
+        self._f = f
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self) -> bool:
+        if self._eof:
+            return False
+        chunk = self._f.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def peek(self) -> str:
+        '''Next character that is not whitespace, '' at the end of the document.'''
+        while True:
+            self._pos = _whitespace.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char: str):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected {char!r} in JSON document, found {found or 'end of document'!r}")
+        self._pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            else:
+                # a number cut by the end of the buffer decodes too, only trust it with something after it
+                if end < len(self._buf) or self._eof:
+                    self._pos = end
+                    return value
+            self._fill()
+
+
+def _read_json(f: IO[str]) -> Iterator[tuple[str, dict]]:
+    # {"medium": {...}, "nodes": [{...}, ...]}, nodes are yielded as they are parsed
+    stream = _JsonStream(f)
+    stream.expect('{')
+    if stream.peek() == '}':
+        return
+    while True:
+        key = stream.value()
+        stream.expect(':')
+        if key == 'nodes':
+            stream.expect('[')
+            if stream.peek() != ']':
+                while True:
+                    yield ('node', stream.value())
+                    if stream.peek() != ',':
+                        break
+                    stream.expect(',')
+            stream.expect(']')
+        elif key == 'medium':
+            yield ('medium', stream.value())
+        else:
+            stream.value()
+        if stream.peek() != ',':
+            break
+        stream.expect(',')
+    stream.expect('}')
+
+def _read_jsonl(f: IO[str]) -> Iterator[tuple[str, dict]]:
+    # one node per line, a line with only a "medium" key holds the medium parameters
+    for lineno, line in enumerate(f, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            obj = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Line {lineno}: {e}") from None
+        if isinstance(obj, dict) and obj.keys() == {'medium'}:
+            yield ('medium', obj['medium'])
+        else:
+            yield ('node', obj)
+
+def _read_toml(f: IO[bytes]) -> Iterator[tuple[str, dict]]:
+    # [medium] table and [[nodes]] array of tables. TOML has no streaming parser, it is for hand-written files
+    try:
+        import tomllib
+    except ImportError:     # before python 3.11
+        import tomli as tomllib
+    document = tomllib.load(f)
+    if 'medium' in document:
+        yield ('medium', document['medium'])
+    for node in document.get('nodes', []):
+        yield ('node', node)
+
+
+class Topology:
+    '''
+    Routers, their positions and TX powers, and the path loss parameters of the medium.
+
+    Loaded from JSON, JSON lines or TOML, and applied to a running fleet by changing only what differs.
+    JSON and JSON lines are parsed one node at a time, for topologies of tens of thousands of nodes.
+
+    Usage example:
+    >>> topology = Topology.load('farm.json')
+    >>> topology.apply(fleet, medium)         # creates everyone
+    >>> Topology.load('harvest.json').apply(fleet, medium)     # only moves, adds and removes the difference
+
+    In JSON:
+    {"medium": {"path_loss_exp": 3.0}, "nodes": [{"hostname": "test1", "x": 0, "y": 0, "tx_power": 15}, ...]}
+
+    In JSON lines (.jsonl), one node per line, optionally preceded by {"medium": {...}}.
+
+    In TOML:
+    [medium]
+    path_loss_exp = 3.0
+    [[nodes]]
+    hostname = "test1"
+    x = 0
+    y = 0
+
+    Medium parameters the topology leaves out are left as the medium has them, a node without
+    `tx_power` transmits with the medium's `default_tx_power`.
+    '''
+
+    medium: dict[str, float]
+    nodes: dict[str, tuple[float, float, float | None]]
+
+    def __init__(self, nodes: Iterable[tuple[str, float, float, float | None]] = (), medium: dict[str, float] | None = None):
+        self.medium = {}
+        self.nodes = {}
+        if medium:
+            self.set_medium(**medium)
+        for hostname, x, y, tx_power in nodes:
+            self.add(hostname, x, y, tx_power)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, hostname: str):
+        return hostname in self.nodes
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    def __eq__(self, other):
+        if not isinstance(other, Topology):
+            return NotImplemented
+        return self.medium == other.medium and self.nodes == other.nodes
+
+    def __repr__(self):
+        return f'<Topology {len(self.nodes)} nodes>'
+
+    def add(self, hostname: str, x: float, y: float, tx_power: float | None = None):
+        if not isinstance(hostname, str) or not hostname:
+            raise ValueError(f"Hostname must be a non-empty string, got {hostname!r}")
+        if hostname in self.nodes:
+            raise ValueError(f"Node {hostname} already exist")
+        self.nodes[hostname] = (float(x), float(y), None if tx_power is None else float(tx_power))
+
+    def set_medium(self, **params: float):
+        for name, value in params.items():
+            if name not in MEDIUM_PARAMS:
+                raise ValueError(f"Unknown medium parameter {name!r}, expected one of {', '.join(MEDIUM_PARAMS)}")
+            self.medium[name] = float(value)
+
+    @classmethod
+    def load(cls, path: str) -> 'Topology':
+        '''
+        Read a topology file, the format goes by the extension: .json, .jsonl (or .ndjson), .toml.
+        '''
+        topology = cls()
+        if path.endswith('.toml'):
+            f, reader = open(path, 'rb'), _read_toml
+        elif path.endswith(('.jsonl', '.ndjson')):
+            f, reader = open(path), _read_jsonl
+        elif path.endswith('.json'):
+            f, reader = open(path), _read_json
+        else:
+            raise ValueError(f"Unknown topology format of {path}, expected .json, .jsonl or .toml")
+
+        with f:
+            for index, (kind, obj) in enumerate(reader(f)):
+                try:
+                    if not isinstance(obj, dict):
+                        raise ValueError(f"expected an object, got {obj!r}")
+                    if kind == 'medium':
+                        topology.set_medium(**obj)
+                    else:
+                        topology.add(obj.get('hostname'), obj['x'], obj['y'], obj.get('tx_power'))
+                except (KeyError, TypeError, ValueError) as e:
+                    raise ValueError(f"{path}: entry {index}: {e}") from None
+        log.debug(f"Loaded {len(topology)} nodes from {path}")
+        return topology
+
+    def save(self, path: str):
+        '''
+        Write the topology as JSON, or JSON lines if `path` ends with .jsonl.
+        '''
+        nodes = (
+            {'hostname': hostname, 'x': x, 'y': y, **({'tx_power': tx_power} if tx_power is not None else {})}
+            for hostname, (x, y, tx_power) in self.nodes.items()
+        )
+        with open(path, 'w') as f:
+            if path.endswith(('.jsonl', '.ndjson')):
+                if self.medium:
+                    f.write(json.dumps({'medium': self.medium}) + '\n')
+                for node in nodes:
+                    f.write(json.dumps(node) + '\n')
+            else:
+                f.write('{"medium": ' + json.dumps(self.medium) + ',\n"nodes": [')
+                for i, node in enumerate(nodes):
+                    f.write((',\n' if i else '\n') + json.dumps(node))
+                f.write('\n]}\n')
+
+    @classmethod
+    def of(cls, medium: 'WirelessMedium') -> 'Topology':
+        '''What `medium` has right now, as a topology.'''
+        topology = cls(medium={name: getattr(medium, name) for name in MEDIUM_PARAMS})
+        for router, (x, y, tx_power) in medium.placements().items():
+            topology.add(router.hostname, x, y, tx_power)
+        return topology
+
+    def diff(self, fleet: 'Fleet', medium: 'WirelessMedium') -> 'TopologyDiff':
+        '''
+        What it takes to turn the routers of `fleet` placed on `medium` into this topology.
+        Routers on the medium that are not in the fleet count as live too, but are only taken off the medium.
+        '''
+        diff = TopologyDiff()
+        diff.medium = {name: value for name, value in self.medium.items() if getattr(medium, name) != value}
+
+        placements = {router.hostname: placement for router, placement in medium.placements().items()}
+        for hostname in fleet.routers.keys() | placements.keys():
+            if hostname not in self.nodes:
+                diff.remove.append(hostname)
+
+        for hostname, (x, y, tx_power) in self.nodes.items():
+            placement = placements.get(hostname)
+            if placement is None:
+                if hostname in fleet.routers:
+                    diff.place[hostname] = (x, y, tx_power)
+                else:
+                    diff.create[hostname] = (x, y, tx_power)
+                continue
+            if placement[:2] != (x, y):
+                diff.move[hostname] = (x, y)
+            if placement[2] != tx_power:
+                diff.tx_power[hostname] = tx_power
+        return diff
+
+    def apply(self, fleet: 'Fleet', medium: 'WirelessMedium') -> dict[str, Exception | None]:
+        '''
+        Bring `fleet` and `medium` to this topology with the fewest changes, see `diff`.
+
+        Routers are removed first, so their radios go back to the pool for the new ones, then created
+        and started, both concurrently on the fleet's workers. Medium changes are committed once at the end,
+        live if they are only moves, with one wmediumd restart otherwise.
+        Returns the errors per hostname of the routers removed and created, like `Fleet` does.
+        '''
+        diff = self.diff(fleet, medium)
+        if not diff:
+            log.info('Topology already applied')
+            return {}
+        log.info(f"Applying topology: {diff}")
+
+        routers = {router.hostname: router for router in medium.placements()}
+        for hostname in diff.remove:
+            if hostname in routers:
+                medium.remove(routers[hostname])
+        results = fleet.remove(hostname for hostname in diff.remove if hostname in fleet.routers)
+
+        if diff.medium:
+            medium.configure(**diff.medium)
+
+        created = fleet.up(diff.create)
+        results.update(created)
+        placements = dict(diff.place)
+        placements.update((hostname, placement) for hostname, placement in diff.create.items() if created.get(hostname) is None)
+        for hostname, (x, y, tx_power) in placements.items():
+            medium.add(fleet[hostname], x, y, tx_power)
+
+        for hostname, coord in diff.move.items():
+            medium.move(routers[hostname], coord)
+        for hostname, tx_power in diff.tx_power.items():
+            medium.set_tx_power(routers[hostname], tx_power)
+
+        medium.commit()
+        return results
+
+
+class TopologyDiff:
+    '''
+    Changes between the live routers and a `Topology`, by hostname.
+    '''
+
+    create: dict[str, tuple[float, float, float | None]]
+    remove: list[str]
+    place: dict[str, tuple[float, float, float | None]]     # in the fleet but not on the medium
+    move: dict[str, tuple[float, float]]
+    tx_power: dict[str, float | None]
+    medium: dict[str, float]
+
+    def __init__(self):
+        self.create = {}
+        self.remove = []
+        self.place = {}
+        self.move = {}
+        self.tx_power = {}
+        self.medium = {}
+
+    def __bool__(self):
+        return any((self.create, self.remove, self.place, self.move, self.tx_power, self.medium))
+
+    def __repr__(self):
+        return f'<TopologyDiff {self}>'
+
+    def __str__(self):
+        return (f'{len(self.create)} to create, {len(self.remove)} to remove, {len(self.place)} to place, '
+                f'{len(self.move)} to move, {len(self.tx_power)} TX power changes, {len(self.medium)} medium parameter changes')
+
+    @property
+    def needs_restart(self) -> bool:
+        '''Whether applying it restarts wmediumd, everything but moves does.'''
+        return any((self.create, self.remove, self.place, self.tx_power, self.medium))
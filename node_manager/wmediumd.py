@@ -1,12 +1,21 @@
 from io import TextIOBase
+from collections import deque
+from itertools import chain
+from typing import Sequence
 from struct import Struct
+import asyncio
 # from os import setns, CLONE_NEWNET, open as open_fd
-import os, sys
-from socket import socket, AF_UNIX, SOCK_STREAM
-from subprocess import Popen, run
+import os
+import signal
+from socket import socket, AF_UNIX, SOCK_STREAM, MSG_WAITALL
+from subprocess import Popen, TimeoutExpired, DEVNULL, STDOUT
+from select import select
 from enum import IntEnum
 from tempfile import mktemp
 import atexit
+import threading
+from .metrics import Metrics
+from .journal import StateJournal
 
 import logging
 import time
@@ -22,6 +31,16 @@ class WmediumdMsgType(IntEnum):
     NETLINK     = 4
     SET_CONTROL = 5
     TX_START    = 6
+    # extensions for live medium changes, as carried by the cuttlefish fork of wmediumd.
+    # upstream wmediumd answers these with INVALID.
+    GET_NODES   = 7
+    SET_SNR     = 8
+    RELOAD_CONFIG = 9
+    RELOAD_CURRENT_CONFIG = 10
+    START_PCAP  = 11
+    STOP_PCAP   = 12
+    STATIONS_LIST = 13
+    SET_POSITION = 14
 
 
 class WmediumdCtlType(IntEnum):
@@ -29,31 +48,103 @@ class WmediumdCtlType(IntEnum):
     RX_ALL_FRAMES   = 1
 
 
+class _AdoptedProcess:
+    '''
+    Stands in for the Popen of a wmediumd that an earlier controller started. It is not our child,
+    so its exit status is not ours to know: `poll()` and `wait()` give 0 once it is gone.
+    '''
+
+    pid: int
+    returncode: int | None
+
+    _pidfd: int
+
+    def __init__(self, pid: int, api_socket: str):
+        self._pidfd = os.pidfd_open(pid)
+        try:
+            # the PID may have been reused since it was recorded
+            with open(f'/proc/{pid}/cmdline', 'rb') as f:
+                if api_socket.encode() not in f.read().split(b'\0'):
+                    raise ProcessLookupError(f"PID {pid} is not the wmediumd serving {api_socket}")
+        except OSError:
+            os.close(self._pidfd)
+            raise
+        self.pid = pid
+        self.returncode = None
+
+    def _exited(self):
+        self.returncode = 0
+        os.close(self._pidfd)
+
+    def poll(self) -> int | None:
+        if self.returncode is None and select([self._pidfd], [], [], 0)[0]:
+            self._exited()
+        return self.returncode
+
+    def wait(self, timeout: float | None = None) -> int:
+        if self.returncode is None:
+            # a pidfd turns readable once its process exits
+            if not select([self._pidfd], [], [], timeout)[0]:
+                raise TimeoutExpired(f'wmediumd[{self.pid}]', timeout)
+            self._exited()
+        return self.returncode
+
+    def _signal(self, signum: int):
+        if self.returncode is None:
+            try:
+                signal.pidfd_send_signal(self._pidfd, signum)
+            except ProcessLookupError:
+                pass
+
+    def terminate(self):
+        self._signal(signal.SIGTERM)
+
+    def kill(self):
+        self._signal(signal.SIGKILL)
+
+
 class Wmediumd:
 
     tool_wmediumd = 'wmediumd/wmediumd/wmediumd'
     _struct_header = Struct('@II')
     _struct_control = Struct('@I')
     _struct_tx_start = Struct('@QIxxx')
+    _struct_set_snr = Struct('=6s6sB')
+    _struct_set_position = Struct('=6sdd')
+
+    startup_timeout = 2.0
+    log_level = 3           # wmediumd -l, 0 (silent) to 7 (debug). It logs every frame from 6 up
+    log_path: str | None = None     # wmediumd's own output, next to the state journal or in /tmp if not set
 
     _config_path: str = None
     _ns_fd: int | None = None
-    _process: Popen = None
+    _process: Popen | _AdoptedProcess = None
     _sock_api: socket = None
+    _sock_api_path: str = None
+    _api_lock = threading.Lock()     # one request/ACK round trip at a time, callers may be on other threads
+
+    # whether the running wmediumd takes SET_POSITION/SET_SNR, None until we tried
+    live_update: bool | None = None
 
     @classmethod
     def _process_exec(cls, sock_api_path: str):
-        run(['/bin/cat', cls._config_path], check=True)
-        # cls._process = Popen([cls.tool_wmediumd, '-l', '7', '-c', cls._config_path, '-a', sock_api_path], stdout=sys.stderr, stderr=sys.stderr)
-        cls._process = Popen([cls.tool_wmediumd, '-l', '7', '-c', cls._config_path], stdout=sys.stderr, stderr=sys.stderr)
-        log.debug(f"Started wmediumd, config {cls._config_path}, socket path {sock_api_path}")
+        log_path = cls.log_path
+        if log_path is None:
+            log_path = os.path.join(StateJournal.directory, 'wmediumd.log') if StateJournal.enabled() else mktemp(prefix='jk_wmd_', suffix='.log')
+
+        # a file rather than our stderr, it may outlive us (see `detach`).
+        # own session, so a Ctrl-C meant for the controller does not take it down before `stop` or `detach`
+        with open(log_path, 'ab') as log_file:
+            cls._process = Popen([cls.tool_wmediumd, '-l', str(cls.log_level), '-c', cls._config_path, '-a', sock_api_path],
+                                 stdin=DEVNULL, stdout=log_file, stderr=STDOUT, start_new_session=True)
+        log.debug(f"Started wmediumd, config {cls._config_path}, socket path {sock_api_path}, log {log_path}")
 
     @classmethod
     def _process_kill(cls, signal: int = None):
         cls._process.terminate()
         try:
             cls._process.wait(0.1)
-        except TimeoutError:
+        except TimeoutExpired:
             cls._process.kill()
             cls._process.wait()
         cls._process = None
@@ -64,13 +155,15 @@ class Wmediumd:
         if not cls._process:
             raise ValueError("wmediumd is not running")
         
-        cls._sock_api.send(cls._struct_header.pack(msg_type, len(msg_data)) + msg_data)
+        with cls._api_lock:
+            cls._sock_api.sendall(cls._struct_header.pack(msg_type, len(msg_data)) + msg_data)
 
-        # wait for ACK
-        response = cls._sock_api.recv(cls._struct_header.size)
-        response_type, response_length = cls._struct_header.unpack(response)
-        if response_length > 0:
-            log.warning(f"Ignoring wmediumd_api ACK with data of length {response_length}")
+            # wait for ACK
+            response = cls._sock_api.recv(cls._struct_header.size, MSG_WAITALL)
+            response_type, response_length = cls._struct_header.unpack(response)
+            if response_length > 0:
+                log.warning(f"Ignoring wmediumd_api ACK with data of length {response_length}")
+                cls._sock_api.recv(response_length, MSG_WAITALL)
 
         if response_type != WmediumdMsgType.ACK:
             raise ValueError(f"Expected wmediumd_api ACK, got {WmediumdMsgType(response_type).name if response_type in WmediumdMsgType else hex(response_type)}")
@@ -85,7 +178,24 @@ class Wmediumd:
     def api_unregister(cls):
         return cls._send(WmediumdMsgType.UNREGISTER, b'')
 
+    @staticmethod
+    def _mac_bytes(macaddr: str) -> bytes:
+        return bytes.fromhex(macaddr.replace(':', ''))
+
+    @classmethod
+    def api_set_position(cls, macaddr: str, pos_x: float, pos_y: float):
+        return cls._send(WmediumdMsgType.SET_POSITION, cls._struct_set_position.pack(cls._mac_bytes(macaddr), pos_x, pos_y))
+
+    @classmethod
+    def api_set_snr(cls, macaddr1: str, macaddr2: str, snr: int):
+        return cls._send(WmediumdMsgType.SET_SNR, cls._struct_set_snr.pack(cls._mac_bytes(macaddr1), cls._mac_bytes(macaddr2), max(0, min(255, round(snr)))))
+
+    @classmethod
+    def running(cls) -> bool:
+        return cls._process is not None and cls._process.poll() is None and cls._sock_api is not None
+
     @classmethod
+    @Metrics.timed('wmediumd_start')
     def start(cls, config_path: str, ns_fd: int = None):
         cls._config_path = config_path
         cls._ns_fd = ns_fd
@@ -111,21 +221,74 @@ class Wmediumd:
                 os.setns(orig_ns, os.CLONE_NEWNET)
                 os.close(orig_ns)
 
-        # wait for wmediumd to complete startup
-        time.sleep(0.1)
+        # wait for wmediumd to complete startup, i.e. until its API socket takes connections
+        cls._sock_api_path = tmp_path
+        cls.live_update = None
+        deadline = time.monotonic() + cls.startup_timeout
+        while True:
+            cls._sock_api = socket(AF_UNIX, SOCK_STREAM)
+            try:
+                cls._sock_api.connect(tmp_path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                cls._sock_api.close()
+                cls._sock_api = None
+                if cls._process.poll() is not None or time.monotonic() > deadline:
+                    cls._process_kill()
+                    raise RuntimeError(f"wmediumd did not come up, API socket {tmp_path} not available")
+                Metrics.count('wmediumd_connect_retries')
+                time.sleep(0.01)
+
+        StateJournal.record_wmediumd(pid=cls._process.pid, api_socket=tmp_path, config=config_path)
+        atexit.register(cls.stop)
 
-        # try:
-        #     cls._sock_api = socket(AF_UNIX, SOCK_STREAM)
-        #     cls._sock_api.connect(tmp_path)
-        # except:
-        #     cls._sock_api.close()
-        #     cls._sock_api = None
-            
-        #     cls._process_kill()
-        #     raise
+    @classmethod
+    def reattach(cls, ns_fd: int = None) -> bool:
+        '''
+        Take over the wmediumd that a previous controller left running (see `detach`), as recorded in the
+        state journal. Returns False, and forgets the record, if there is none or its process is gone.
+        '''
+        record = StateJournal.wmediumd()
+        if not record:
+            return False
+        if cls._process and cls._process.poll() is None:
+            raise ValueError("wmediumd is already running")
 
+        try:
+            process = _AdoptedProcess(record['pid'], record['api_socket'])
+            sock_api = socket(AF_UNIX, SOCK_STREAM)
+            try:
+                sock_api.connect(record['api_socket'])
+            except OSError:
+                sock_api.close()
+                raise
+        except (OSError, KeyError) as e:
+            log.info(f"Recorded wmediumd is gone ({type(e).__name__}: {e}), it will be started anew")
+            StateJournal.record_wmediumd()
+            return False
+
+        cls._process = process
+        cls._sock_api = sock_api
+        cls._sock_api_path = record['api_socket']
+        cls._config_path = record['config']
+        cls._ns_fd = ns_fd
+        cls.live_update = None
         atexit.register(cls.stop)
-        # cls.api_register()
+        log.info(f"Reattached to wmediumd PID {process.pid}, socket path {cls._sock_api_path}")
+        return True
+
+    @classmethod
+    def detach(cls):
+        '''
+        Leave wmediumd running as it is and let go of it, for the next controller to `reattach`.
+        '''
+        atexit.unregister(cls.stop)
+        if cls._sock_api:
+            cls._sock_api.close()
+            cls._sock_api = None
+        # keeps its journal record, and its socket file for the next one to connect to
+        cls._process = None
+        cls._sock_api_path = None
 
     @classmethod
     def stop(cls):
@@ -140,6 +303,14 @@ class Wmediumd:
 
         if cls._process:
             cls._process_kill()
+            StateJournal.record_wmediumd()
+
+        if cls._sock_api_path:
+            try:
+                os.unlink(cls._sock_api_path)
+            except FileNotFoundError:
+                pass
+            cls._sock_api_path = None
 
         atexit.unregister(cls.stop)
 
@@ -149,25 +320,345 @@ class Wmediumd:
         cls.start(config_path or cls._config_path, cls._ns_fd)
 
 
+class HwsimAttr(IntEnum):
+    # attributes of the hwsim netlink frames carried in NETLINK messages
+    ADDR_RECEIVER    = 1
+    ADDR_TRANSMITTER = 2
+    FRAME            = 3
+    FLAGS            = 4
+    RX_RATE          = 5
+    SIGNAL           = 6
+    TX_INFO          = 7
+    COOKIE           = 8
+    FREQ             = 19
+
+
+class WmediumdEvent:
+    '''
+    A message pushed by wmediumd. `data` points into the client's receive slots and
+    is only valid until the subscriber asks for its next event.
+    '''
+
+    __slots__ = ('msg_type', 'data', '_slot', '_refs')
+
+    _struct_nlmsghdr = Struct('=IHHII')
+    _struct_genlmsghdr = Struct('=BBH')
+
+    msg_type: WmediumdMsgType
+    data: memoryview
+
+    def __init__(self, slot: int):
+        self._slot = slot
+        self._refs = 0
+        self.msg_type = WmediumdMsgType.INVALID
+        self.data = memoryview(b'')
+
+    def __repr__(self):
+        return f'<WmediumdEvent {WmediumdMsgType(self.msg_type).name} {len(self.data)} bytes>'
+
+    def tx_start(self) -> tuple[int, int]:
+        '''(cookie, freq) of a TX_START event.'''
+        cookie, freq = Wmediumd._struct_tx_start.unpack_from(self.data)
+        return cookie, freq
+
+    def netlink(self) -> tuple[int, dict[int, memoryview]]:
+        '''(hwsim command, attributes) of a NETLINK event, attributes are views into `data`.'''
+        from .linuxutils import nla_parse
+        offset = self._struct_nlmsghdr.size
+        cmd, _, _ = self._struct_genlmsghdr.unpack_from(self.data, offset)
+        return cmd, nla_parse(self.data, offset + self._struct_genlmsghdr.size)
+
+
+class WmediumdSubscription:
+    '''
+    Bounded stream of events from an `AsyncWmediumdClient`, used as an async iterator.
+    When the subscriber falls behind, new events are dropped and counted in `dropped`.
+    '''
+
+    types: frozenset[int]
+    maxsize: int
+    received: int
+    dropped: int
+
+    _client: 'AsyncWmediumdClient'
+    _queue: deque[WmediumdEvent]
+    _wakeup: asyncio.Event
+    _current: WmediumdEvent | None
+    _closed: bool
+
+    def __init__(self, client: 'AsyncWmediumdClient', types: frozenset[int], maxsize: int):
+        self.types = types
+        self.maxsize = maxsize
+        self.received = 0
+        self.dropped = 0
+        self._client = client
+        self._queue = deque()
+        self._wakeup = asyncio.Event()
+        self._current = None
+        self._closed = False
+
+    def __repr__(self):
+        return f'<WmediumdSubscription {len(self._queue)} queued, {self.received} received, {self.dropped} dropped>'
+
+    def _offer(self, event: WmediumdEvent) -> bool:
+        if len(self._queue) >= self.maxsize:
+            self.dropped += 1
+            return False
+        self._queue.append(event)
+        self.received += 1
+        self._wakeup.set()
+        return True
+
+    def _release_current(self):
+        if self._current is not None:
+            self._client._release(self._current)
+            self._current = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> WmediumdEvent:
+        self._release_current()
+        while not self._queue:
+            if self._closed:
+                raise StopAsyncIteration
+            self._wakeup.clear()
+            await self._wakeup.wait()
+
+        self._current = self._queue.popleft()
+        return self._current
+
+    def close(self):
+        self._closed = True
+        self._release_current()
+        while self._queue:
+            self._client._release(self._queue.popleft())
+        self._client._subscriptions.discard(self)
+        self._wakeup.set()
+
+
+class AsyncWmediumdClient:
+    '''
+    asyncio client for the wmediumd API socket. wmediumd accepts several clients,
+    so this can run next to the one `Wmediumd` keeps for itself.
+
+    Incoming messages are read with recv_into into one reusable buffer and copied once into a
+    fixed pool of slots, which subscribers read through memoryviews. Nothing is allocated per byte
+    received; when the pool runs dry, events are dropped and counted in `dropped`.
+
+    Usage example:
+    >>> client = await AsyncWmediumdClient.connect()
+    >>> await client.set_position('02:00:00:00:00:00', 10.0, 20.0)
+    >>> frames = client.subscribe({WmediumdMsgType.NETLINK})
+    >>> await client.enable_frames()
+    >>> async for event in frames:
+    >>>     cmd, attrs = event.netlink()
+    '''
+
+    rx_buffer_size = 256 * 1024
+    slot_size = 8192
+    slot_count = 1024
+
+    dropped: int
+
+    _sock: socket
+    _acks: deque[asyncio.Future]
+    _send_lock: asyncio.Lock
+    _rx_task: asyncio.Task | None
+    _rx_buf: bytearray
+    _slot_buf: memoryview
+    _events: list[WmediumdEvent]
+    _free_slots: deque[int]
+    _subscriptions: set[WmediumdSubscription]
+
+    def __init__(self, sock: socket):
+        self._sock = sock
+        self._acks = deque()
+        self._send_lock = asyncio.Lock()
+        self.dropped = 0
+
+        self._rx_buf = bytearray(self.rx_buffer_size)
+        self._slot_buf = memoryview(bytearray(self.slot_size * self.slot_count))
+        self._events = [WmediumdEvent(slot) for slot in range(self.slot_count)]
+        self._free_slots = deque(range(self.slot_count))
+        self._subscriptions = set()
+
+        self._rx_task = asyncio.get_running_loop().create_task(self._rx_loop())
+
+    def __repr__(self):
+        return f'<AsyncWmediumdClient {"connected" if self._rx_task else "closed"}, {len(self._subscriptions)} subscribers, {self.dropped} dropped>'
+
+    @classmethod
+    async def connect(cls, sock_api_path: str | None = None) -> 'AsyncWmediumdClient':
+        sock_api_path = sock_api_path or Wmediumd._sock_api_path
+        if not sock_api_path:
+            raise ValueError("wmediumd is not running")
+
+        sock = socket(AF_UNIX, SOCK_STREAM)
+        sock.setblocking(False)
+        try:
+            await asyncio.get_running_loop().sock_connect(sock, sock_api_path)
+        except:
+            sock.close()
+            raise
+        return cls(sock)
+
+    def subscribe(self, types: set[int] | None = None, maxsize: int = 256) -> WmediumdSubscription:
+        subscription = WmediumdSubscription(self, frozenset(types or (WmediumdMsgType.NETLINK, WmediumdMsgType.TX_START)), maxsize)
+        self._subscriptions.add(subscription)
+        return subscription
+
+    def _release(self, event: WmediumdEvent):
+        event._refs -= 1
+        if event._refs == 0:
+            self._free_slots.append(event._slot)
+
+    def _dispatch(self, msg_type: int, payload: memoryview):
+        subscribers = [subscription for subscription in self._subscriptions if msg_type in subscription.types]
+        if not subscribers:
+            return
+
+        if not self._free_slots or len(payload) > self.slot_size:
+            self.dropped += 1
+            return
+
+        slot = self._free_slots.popleft()
+        offset = slot * self.slot_size
+        self._slot_buf[offset:offset+len(payload)] = payload
+
+        event = self._events[slot]
+        event.msg_type = msg_type
+        event.data = self._slot_buf[offset:offset+len(payload)]
+        event._refs = 1     # held by us while offering
+        for subscription in subscribers:
+            if subscription._offer(event):
+                event._refs += 1
+        self._release(event)
+
+    async def _rx_loop(self):
+        loop = asyncio.get_running_loop()
+        header_size = Wmediumd._struct_header.size
+        view = memoryview(self._rx_buf)
+        start = end = 0
+
+        try:
+            while True:
+                if end == len(self._rx_buf):
+                    # move the partial message to the front
+                    view[:end-start] = view[start:end]
+                    start, end = 0, end - start
+
+                received = await loop.sock_recv_into(self._sock, view[end:])
+                if received == 0:
+                    raise ConnectionError("closed by wmediumd")
+                end += received
+
+                while end - start >= header_size:
+                    msg_type, msg_length = Wmediumd._struct_header.unpack_from(view, start)
+                    if header_size + msg_length > len(self._rx_buf):
+                        raise ConnectionError(f"message of {msg_length} bytes does not fit receive buffer")
+                    if end - start < header_size + msg_length:
+                        break
+
+                    payload = view[start+header_size:start+header_size+msg_length]
+                    start += header_size + msg_length
+
+                    if msg_type in (WmediumdMsgType.ACK, WmediumdMsgType.INVALID):
+                        # answers come back in the order requests were sent
+                        if self._acks:
+                            ack = self._acks.popleft()
+                            if not ack.done():
+                                ack.set_result(msg_type)
+                        continue
+                    self._dispatch(msg_type, payload)
+
+                if start == end:
+                    start = end = 0
+        except (ConnectionError, OSError) as e:
+            error = ConnectionError(f"wmediumd API connection lost: {e}")
+        except asyncio.CancelledError:
+            error = ConnectionError("wmediumd API client closed")
+
+        while self._acks:
+            ack = self._acks.popleft()
+            if not ack.done():
+                ack.set_exception(error)
+        for subscription in list(self._subscriptions):
+            subscription.close()
+
+    async def send(self, msg_type: WmediumdMsgType, msg_data: bytes = b''):
+        loop = asyncio.get_running_loop()
+        async with self._send_lock:
+            ack = loop.create_future()
+            self._acks.append(ack)
+            await loop.sock_sendall(self._sock, Wmediumd._struct_header.pack(msg_type, len(msg_data)) + msg_data)
+
+        response_type = await ack
+        if response_type != WmediumdMsgType.ACK:
+            raise ValueError(f"Expected wmediumd_api ACK, got {WmediumdMsgType(response_type).name}")
+
+    async def register(self):
+        await self.send(WmediumdMsgType.REGISTER)
+
+    async def unregister(self):
+        await self.send(WmediumdMsgType.UNREGISTER)
+
+    async def set_control(self, *ctl_types: WmediumdCtlType):
+        flags = 0
+        for ctl_type in ctl_types:
+            flags |= 1 << ctl_type
+        await self.send(WmediumdMsgType.SET_CONTROL, Wmediumd._struct_control.pack(flags))
+
+    async def enable_frames(self, tx_start: bool = True):
+        '''Register and ask wmediumd for every frame on the medium (and TX start notifications).'''
+        await self.register()
+        if tx_start:
+            await self.set_control(WmediumdCtlType.RX_ALL_FRAMES, WmediumdCtlType.NOTIFY_TX_START)
+        else:
+            await self.set_control(WmediumdCtlType.RX_ALL_FRAMES)
+
+    async def set_position(self, macaddr: str, pos_x: float, pos_y: float):
+        await self.send(WmediumdMsgType.SET_POSITION, Wmediumd._struct_set_position.pack(Wmediumd._mac_bytes(macaddr), pos_x, pos_y))
+
+    async def set_snr(self, macaddr1: str, macaddr2: str, snr: int):
+        await self.send(WmediumdMsgType.SET_SNR, Wmediumd._struct_set_snr.pack(Wmediumd._mac_bytes(macaddr1), Wmediumd._mac_bytes(macaddr2), max(0, min(255, round(snr)))))
+
+    async def close(self):
+        if self._rx_task:
+            self._rx_task.cancel()
+            try:
+                await self._rx_task
+            except asyncio.CancelledError:
+                pass
+            self._rx_task = None
+        self._sock.close()
+
+
 class WmediumdConfig:
 
     ifaces: list[str]
+    _iface_index: dict[str, int]
 
     def __init__(self):
         self.ifaces = []
+        self._iface_index = {}
 
     def _export_model(self, out_file: TextIOBase):
         pass
 
     def add(self, macaddr: str):
-        if macaddr in self.ifaces:
+        if macaddr in self._iface_index:
             raise ValueError(f"{macaddr!r} already exist")
         
         addr_parts = macaddr.split(':')
         if len(addr_parts) != 6 or any(len(part) != 2 for part in addr_parts) or any(char.lower() not in '0123456789abcdef' for part in addr_parts for char in part):
             raise ValueError(f"Invalid MAC address {macaddr}")
+        self._iface_index[macaddr] = len(self.ifaces)
         self.ifaces.append(macaddr)
 
+    def index(self, macaddr: str) -> int:
+        return self._iface_index[macaddr]
+
     def export(self, out_file: TextIOBase):
         out_file.write(f'ifaces :\n{{\n\tids = [\n')
         out_file.write(',\n'.join(f'\t\t"{iface}"' for iface in self.ifaces))
@@ -199,3 +690,51 @@ class WmediumdConfigPathLoss(WmediumdConfig):
         super().add(macaddr)
         self.positions.append((pos_x, pos_y))
         self.tx_powers.append(tx_power)
+
+
+class WmediumdConfigSNR(WmediumdConfig):
+
+    links: list[tuple[int, int, int]]
+    _link_columns: list[tuple[Sequence[int], Sequence[int], Sequence[int]]]
+
+    def __init__(self):
+        self.links = []
+        self._link_columns = []
+
+        super().__init__()
+
+    def _export_model(self, out_file: TextIOBase):
+        links = chain(self.links, *(zip(*columns) for columns in self._link_columns))
+        lines = (f'\t\t({i}, {j}, {snr})' for i, j, snr in links)
+        out_file.write(f'model :\n{{\n\ttype = "snr";\n\tlinks = (\n')
+        out_file.write(',\n'.join(lines))
+        out_file.write('\n\t);\n};\n')
+
+    def add_link(self, iface1: int, iface2: int, snr: int):
+        self.links.append((iface1, iface2, int(snr)))
+
+    def add_links(self, iface1s: Sequence[int], iface2s: Sequence[int], snrs: Sequence[int]):
+        '''
+        Many links at once as columns, the SNRs already ints. Kept as they are until export,
+        dense configs of thousands of nodes have millions of links.
+        '''
+        self._link_columns.append((iface1s, iface2s, snrs))
+
+
+class WmediumdConfigErrorProb(WmediumdConfig):
+
+    links: list[tuple[int, int, float]]
+
+    def __init__(self, default_prob: float = 1.0):
+        self.default_prob = default_prob
+        self.links = []
+
+        super().__init__()
+
+    def _export_model(self, out_file: TextIOBase):
+        out_file.write(f'model :\n{{\n\ttype = "prob";\n\tdefault_prob = {self.default_prob:.6f};\n\tlinks = (\n')
+        out_file.write(',\n'.join(f'\t\t({i}, {j}, {prob:.6f})' for i, j, prob in self.links))
+        out_file.write('\n\t);\n};\n')
+
+    def add_link(self, iface1: int, iface2: int, error_prob: float):
+        self.links.append((iface1, iface2, float(error_prob)))
@@ -3,14 +3,6 @@
 import logging
 logging.basicConfig(level=logging.INFO)
 
-import subprocess
-
-# load kernel modules
-subprocess.run(['modprobe', 'mac80211_hwsim', 'radios=32'], check=True)
-subprocess.run(['modprobe', 'uleds'], check=True)
-subprocess.run(['modprobe', 'ledtrig-netdev'], check=True)
-
-
 import os; print(os.getcwd())
 import node_manager
 from os import geteuid
@@ -20,6 +12,9 @@ if geteuid() != 0:
     raise PermissionError('This script must be run as root')
 print(os.getpid())
 
+# load kernel modules, set up the radio stub namespace
+node_manager.init()
+
 # create environment
 medium = node_manager.WirelessMedium()
 
@@ -0,0 +1,148 @@
+import unittest
+import asyncio
+import json
+import os
+import threading
+from types import SimpleNamespace
+from unittest import mock
+from ..node_manager.aio import AsyncDockerClient, AsyncRouter, AsyncWirelessMedium, DockerError
+from ..node_manager.wmediumd import Wmediumd
+from tempfile import TemporaryDirectory
+
+
+class FakeDockerDaemon:
+    '''
+    Answers docker API requests on a unix socket from a table of (method, path) -> (status, body).
+    '''
+
+    def __init__(self, socket_path: str, responses: dict):
+        self.socket_path = socket_path
+        self.responses = responses
+        self.requests = []
+        self.connections = 0
+
+    async def start(self):
+        self.server = await asyncio.start_unix_server(self.handle, self.socket_path)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        while request_line := await reader.readline():
+            method, target, _ = request_line.decode().split()
+            headers = {}
+            while (line := await reader.readline()) != b'\r\n':
+                name, _, value = line.decode().partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+            path = target.split('?')[0].split('/', 2)[2]
+            self.requests.append((method, '/' + path, json.loads(body) if body else None))
+
+            status, response = self.responses.get((method, '/' + path), (404, {'message': 'no such thing'}))
+            data = json.dumps(response).encode() if response is not None else b''
+            if status == 200 and path.endswith('/json'):
+                # answer the inspects chunked, like the daemon may
+                writer.write(f'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n{len(data):x}\r\n'.encode() + data + b'\r\n0\r\n\r\n')
+            else:
+                writer.write(f'HTTP/1.1 {status} X\r\nContent-Length: {len(data)}\r\n\r\n'.encode() + data)
+            await writer.drain()
+        writer.close()
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+
+class TestAsyncDockerClient(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.daemon = FakeDockerDaemon(os.path.join(self.tmpdir.name, 'docker.sock'), {
+            ('POST', '/containers/create'): (201, {'Id': 'abc123'}),
+            ('POST', '/containers/abc123/start'): (204, None),
+            ('GET', '/containers/abc123/json'): (200, {'State': {'Status': 'running', 'Pid': 42}}),
+        })
+        await self.daemon.start()
+        self.client = AsyncDockerClient(self.daemon.socket_path, max_connections=2)
+        return
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        await self.daemon.close()
+        self.tmpdir.cleanup()
+        return
+
+    async def test_create_start_inspect(self):
+        container_id = await self.client.create_container('jk-test1', {'Image': 'jaringkan-openwrt:latest'})
+        await self.client.start_container(container_id)
+        state = (await self.client.inspect_container(container_id))['State']
+
+        self.assertEqual(container_id, 'abc123')
+        self.assertEqual(state, {'Status': 'running', 'Pid': 42})
+        self.assertEqual(self.daemon.requests[0], ('POST', '/containers/create', {'Image': 'jaringkan-openwrt:latest'}))
+        self.assertEqual(self.daemon.connections, 1, 'Connection should be kept alive!')
+        return
+
+    async def test_error(self):
+        with self.assertRaises(DockerError) as cm:
+            await self.client.inspect_container('missing')
+        self.assertEqual(cm.exception.status, 404)
+        self.assertIn('no such thing', str(cm.exception))
+        return
+
+    async def test_concurrent_requests_bounded(self):
+        await asyncio.gather(*(self.client.inspect_container('abc123') for _ in range(10)))
+        self.assertLessEqual(self.daemon.connections, 2)
+        return
+
+
+class TestAsyncRouter(unittest.IsolatedAsyncioTestCase):
+
+    async def test_status_before_create(self):
+        # nothing is created or popped before create(), and status needs no docker
+        router = AsyncRouter('test1', AsyncDockerClient('/nonexistent.sock'))
+        self.assertEqual(router.status, 'absent')
+        self.assertFalse(hasattr(router, '_radio'))
+        return
+
+
+class FakeMediumRouter:
+    def __init__(self, hostname: str, macaddr: str):
+        self.hostname = hostname
+        self._radio = SimpleNamespace(macaddr=macaddr)
+
+
+class SlowWmediumdClient:
+    # holds every set_position until released
+    def __init__(self):
+        self.positions = {}
+        self.release = asyncio.Event()
+
+    async def set_position(self, macaddr: str, x: float, y: float):
+        await self.release.wait()
+        self.positions[macaddr] = (x, y)
+
+
+class TestAsyncWirelessMedium(unittest.IsolatedAsyncioTestCase):
+
+    async def test_moves_during_commit_are_kept(self):
+        medium = AsyncWirelessMedium()
+        a, b = FakeMediumRouter('a', '02:00:00:00:00:00'), FakeMediumRouter('b', '02:00:00:00:01:00')
+        medium.add(a, 0.0, 0.0)
+        medium.add(b, 10.0, 0.0)
+        medium._dirty = medium._restart_needed = False      # as if wmediumd was started with them
+        medium._client = client = SlowWmediumdClient()
+
+        medium.move(a, (5.0, 0.0))
+        with mock.patch.object(Wmediumd, 'running', return_value=True), mock.patch.object(Wmediumd, 'live_update', True):
+            commit = asyncio.create_task(medium.commit())
+            await asyncio.sleep(0.01)
+            # another thread moves b while the commit waits on wmediumd
+            mover = threading.Thread(target=medium.move, args=(b, (20.0, 0.0)))
+            mover.start()
+            mover.join()
+            client.release.set()
+            await commit
+
+        self.assertEqual(client.positions, {'02:00:00:00:00:00': (5.0, 0.0)})
+        self.assertEqual(medium._moved, {b}, 'Move made during the commit was dropped!')
+        self.assertTrue(medium._dirty)
+        return
@@ -0,0 +1,46 @@
+import unittest
+from ..benchmarks.harness import StageTimer, percentile, summarize, compare
+
+
+class Sample:
+
+    def work(self, value):
+        return value * 2
+
+    @classmethod
+    def cls_work(cls, value):
+        return (cls, value)
+
+
+class TestHarness(unittest.TestCase):
+
+    def test_percentile(self):
+        samples = [float(i) for i in range(1, 101)]
+        self.assertAlmostEqual(percentile(samples, 50), 50.5)
+        self.assertAlmostEqual(percentile(samples, 99), 99.01)
+        self.assertEqual(percentile([3.0], 90), 3.0)
+        self.assertEqual(summarize([2.0, 1.0, 3.0])['p50'], 2.0)
+        return
+
+    def test_patch_restores(self):
+        timer = StageTimer()
+        original = Sample.__dict__['cls_work']
+        with timer.patch(Sample, 'work', 'work'), timer.patch(Sample, 'cls_work', 'cls_work'):
+            self.assertEqual(Sample().work(2), 4)
+            self.assertEqual(Sample.cls_work(1), (Sample, 1))
+            self.assertEqual(Sample().cls_work(1), (Sample, 1))
+
+        self.assertEqual(len(timer.samples['work']), 1)
+        self.assertEqual(len(timer.samples['cls_work']), 2)
+        self.assertIs(Sample.__dict__['cls_work'], original)
+        return
+
+    def test_compare(self):
+        baseline = {'sizes': {'4': {'veth': {'p50': 0.010}, 'bind': {'p50': 0.020}}}}
+        current = {'sizes': {'4': {'veth': {'p50': 0.012}, 'bind': {'p50': 0.019}, 'new': {'p50': 1.0}}}}
+        rows = {row['stage']: row for row in compare(baseline, current, threshold=0.10)}
+
+        self.assertEqual(set(rows), {'veth', 'bind'})
+        self.assertTrue(rows['veth']['regression'])
+        self.assertFalse(rows['bind']['regression'])
+        return
@@ -0,0 +1,142 @@
+import unittest
+import glob
+import os
+import time
+from struct import unpack_from
+from ..node_manager.capture import PcapngRing, FrameFilter, LINKTYPE_IEEE802_11_RADIOTAP
+from tempfile import TemporaryDirectory
+
+
+def read_blocks(path: str) -> list[tuple[int, bytes]]:
+    '''
+    Splits a pcapng file into (block type, body) and checks the framing on the way.
+    '''
+    with open(path, 'rb') as f:
+        data = f.read()
+    blocks = []
+    offset = 0
+    while offset < len(data):
+        block_type, length = unpack_from('=II', data, offset)
+        assert length % 4 == 0, f'Block at {offset} is not padded to 32 bits'
+        assert unpack_from('=I', data, offset + length - 4)[0] == length, f'Block at {offset} has a wrong trailing length'
+        blocks.append((block_type, data[offset+8:offset+length-4]))
+        offset += length
+    assert offset == len(data)
+    return blocks
+
+
+def interface_names(blocks: list[tuple[int, bytes]]) -> list[str]:
+    # if_name is the only option written, right after the fixed IDB fields
+    names = []
+    for block_type, body in blocks:
+        if block_type == 1:
+            code, length = unpack_from('=HH', body, 8)
+            assert code == 2
+            names.append(body[12:12+length].decode())
+    return names
+
+
+class TestPcapngRing(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'air.pcapng')
+        return
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        return
+
+    def files(self) -> list[str]:
+        return sorted(glob.glob(os.path.join(self.tmpdir.name, 'air-*.pcapng')))
+
+    def test_roundtrip(self):
+        ring = PcapngRing(self.path)
+        interface_id = ring.add_interface('02:00:00:00:01:00')
+        self.assertTrue(ring.add_packet(interface_id, 1_700_000_000_123_456_789, b'\x01\x02', memoryview(b'abc')))
+        self.assertTrue(ring.add_packet(interface_id, 1_700_000_000_223_456_789, b'abcd'))
+        ring.close()
+
+        blocks = read_blocks(self.files()[0])
+        self.assertEqual([block_type for block_type, _ in blocks], [0x0A0D0D0A, 1, 6, 6])
+
+        magic, major, minor, section_length = unpack_from('=IHHq', blocks[0][1])
+        self.assertEqual((magic, major, minor, section_length), (0x1A2B3C4D, 1, 0, -1))
+
+        linktype, _, snaplen = unpack_from('=HHI', blocks[1][1])
+        self.assertEqual((linktype, snaplen), (LINKTYPE_IEEE802_11_RADIOTAP, 0))
+        self.assertEqual(interface_names(blocks), ['02:00:00:00:01:00'])
+
+        # 5 captured bytes get 3 bytes of zero padding, 4 get none
+        for (_, body), data, timestamp_us in ((blocks[2], b'\x01\x02abc', 1_700_000_000_123_456), (blocks[3], b'abcd', 1_700_000_000_223_456)):
+            interface, ts_high, ts_low, captured, original = unpack_from('=IIIII', body)
+            self.assertEqual((interface, (ts_high << 32) | ts_low, captured, original), (0, timestamp_us, len(data), len(data)))
+            self.assertEqual(body[20:20+captured], data)
+            self.assertEqual(body[20+captured:], b'\0' * (-len(data) % 4))
+        return
+
+    def test_rotation_reemits_interfaces(self):
+        ring = PcapngRing(self.path, chunk_size=256, chunk_count=32, rotate_bytes=300)
+        first = ring.add_interface('a')
+        for i in range(20):
+            if i == 10:
+                second = ring.add_interface('b')
+            ring.add_packet(second if i >= 10 else first, i * 1000, bytes(60))
+        ring.close()
+
+        files = self.files()
+        self.assertGreater(len(files), 2)
+        packets = 0
+        for path in files:
+            blocks = read_blocks(path)
+            self.assertEqual(blocks[0][0], 0x0A0D0D0A)
+            names = interface_names(blocks)
+            # every packet refers to an interface declared earlier in its own file
+            for block_type, body in blocks:
+                if block_type == 6:
+                    self.assertLess(unpack_from('=I', body)[0], len(names))
+                    packets += 1
+            self.assertEqual(names, ['a', 'b'][:len(names)])
+        self.assertEqual(packets, 20)
+        self.assertEqual(ring.dropped, 0)
+        return
+
+    def test_tick_flushes_and_rotates_when_idle(self):
+        ring = PcapngRing(self.path, flush_interval=0.0, rotate_seconds=0.05)
+        ring.add_interface('a')
+        ring.add_packet(0, 0, b'abcd')
+        ring.tick()
+        for _ in range(100):
+            if ring.written:
+                break
+            time.sleep(0.01)
+        self.assertEqual([block_type for block_type, _ in read_blocks(self.files()[0])], [0x0A0D0D0A, 1, 6])
+
+        # nothing more arrives, the file still rotates
+        time.sleep(0.1)
+        ring.tick()
+        ring.close()
+        self.assertEqual(len(self.files()), 2)
+        self.assertEqual(interface_names(read_blocks(self.files()[1])), ['a'])
+        return
+
+    def test_oversized_packet_dropped(self):
+        ring = PcapngRing(self.path, chunk_size=64, chunk_count=2)
+        self.assertFalse(ring.add_packet(0, 0, bytes(100)))
+        self.assertEqual(ring.dropped, 1)
+        ring.close()
+        return
+
+
+class TestFrameFilter(unittest.TestCase):
+
+    def test_filter(self):
+        # data frame from 02:00:00:00:01:00 to 02:00:00:00:00:00
+        frame = memoryview(bytes([0x08, 0x00, 0, 0]) + bytes.fromhex('020000000000') + bytes.fromhex('020000000100') + bytes(8))
+        self.assertTrue(FrameFilter(macaddrs={'02:00:00:00:01:00'})(frame))
+        self.assertFalse(FrameFilter(macaddrs={'02:00:00:00:02:00'})(frame))
+        self.assertTrue(FrameFilter(frame_types={'data'})(frame))
+        self.assertFalse(FrameFilter(frame_types={'mgmt'})(frame))
+        with self.assertRaises(ValueError):
+            FrameFilter(frame_types={'beacon'})
+        return
@@ -0,0 +1,137 @@
+import unittest
+import threading
+from queue import Queue
+from docker.errors import DockerException
+from ..node_manager.dockerevents import ContainerStateCache
+
+
+class FakeContainer:
+    def __init__(self, name: str, status: str):
+        self.name = name
+        self.status = status
+
+
+class FakeEventStream:
+    '''
+    Stands in for the decoded `/events` generator: yields what the test puts, ends on close().
+    '''
+
+    def __init__(self):
+        self.queue = Queue()
+
+    def put(self, action: str, name: str, **attributes):
+        self.queue.put({'Type': 'container', 'Action': action, 'Actor': {'Attributes': {'name': name, **attributes}}})
+
+    def __iter__(self):
+        while (event := self.queue.get()) is not None:
+            if isinstance(event, Exception):
+                raise event
+            yield event
+
+    def close(self):
+        self.queue.put(None)
+
+
+class FakeDockerClient:
+    def __init__(self, containers: list[FakeContainer]):
+        self.listed = containers
+        self.streams = []
+        self.containers = self
+        self.connected = threading.Semaphore(0)
+
+    def list(self, all: bool = False, filters: dict | None = None):
+        return [container for container in self.listed if filters['name'] in container.name]
+
+    def events(self, decode: bool = False, filters: dict | None = None):
+        stream = FakeEventStream()
+        self.streams.append(stream)
+        self.connected.release()
+        return stream
+
+
+class TestContainerStateCache(unittest.TestCase):
+
+    def setUp(self):
+        self.docker = FakeDockerClient([FakeContainer('jk-a', 'running'), FakeContainer('jk-b', 'exited'), FakeContainer('other-jk-c', 'running')])
+        self.cache = ContainerStateCache(self.docker)
+        self.cache.reconnect_delay = 0.0
+        return
+
+    def tearDown(self):
+        self.cache.stop()
+        return
+
+    def start(self):
+        self.cache.start()
+        self.assertTrue(self.cache.wait_synced(1.0))
+        return self.docker.streams[-1]
+
+    def sync(self, stream: FakeEventStream):
+        # everything put before this has been handled once the sync event comes through
+        done = threading.Event()
+        watcher = lambda name, action, attributes: done.set()
+        self.cache.watch('jk-sync', watcher)
+        stream.put('create', 'jk-sync')
+        self.assertTrue(done.wait(1.0))
+        self.cache.unwatch('jk-sync', watcher)
+
+    def test_seeding(self):
+        self.assertIsNone(self.cache.status('jk-a'), 'Status should be unknown before syncing!')
+        self.start()
+        self.assertEqual(self.cache.status('jk-a'), 'running')
+        self.assertEqual(self.cache.status('jk-b'), 'exited')
+        self.assertEqual(self.cache.status('other-jk-c'), 'removed')
+        self.assertEqual(self.cache.status('jk-nope'), 'removed')
+        return
+
+    def test_events(self):
+        stream = self.start()
+        stream.put('create', 'jk-d')
+        stream.put('start', 'jk-d')
+        stream.put('exec_start: /bin/sh -c true', 'jk-d')
+        stream.put('die', 'jk-a', exitCode='137')
+        stream.put('destroy', 'jk-b')
+        stream.put('die', 'other-jk-c', exitCode='1')
+        self.sync(stream)
+
+        self.assertEqual(self.cache.status('jk-d'), 'running')
+        self.assertEqual(self.cache.status('jk-a'), 'exited')
+        self.assertEqual(self.cache.exit_code('jk-a'), 137)
+        self.assertEqual(self.cache.status('jk-b'), 'removed')
+        self.assertIsNone(self.cache.exit_code('other-jk-c'))
+        return
+
+    def test_watchers(self):
+        stream = self.start()
+        seen = []
+        def broken(name, action, attributes):
+            raise RuntimeError('broken watcher')
+        watcher = lambda name, action, attributes: seen.append((name, action, attributes.get('exitCode')))
+        self.cache.watch('jk-a', broken)
+        self.cache.watch('jk-a', watcher)
+        self.cache.watch('jk-b', watcher)
+
+        with self.assertLogs(ContainerStateCache.__module__, 'WARNING'):
+            stream.put('die', 'jk-a', exitCode='0')
+            stream.put('exec_die', 'jk-b')
+            self.sync(stream)
+        self.cache.unwatch('jk-a', watcher)
+        self.cache.unwatch('jk-a', broken)
+        stream.put('start', 'jk-a')
+        self.sync(stream)
+
+        self.assertEqual(seen, [('jk-a', 'die', '0'), ('jk-b', 'exec_die', None)])
+        return
+
+    def test_reconnect_reseeds(self):
+        stream = self.start()
+        self.docker.listed = [FakeContainer('jk-e', 'created')]
+        with self.assertLogs(ContainerStateCache.__module__, 'WARNING'):
+            stream.queue.put(DockerException('stream broke'))
+            # the first events() was released in start()
+            self.docker.connected.acquire(timeout=1.0)
+            self.assertTrue(self.docker.connected.acquire(timeout=1.0))
+        self.assertTrue(self.cache.wait_synced(1.0))
+        self.assertEqual(self.cache.status('jk-e'), 'created')
+        self.assertEqual(self.cache.status('jk-a'), 'removed')
+        return
@@ -0,0 +1,41 @@
+import unittest
+import subprocess
+import sys
+from os import path
+
+
+REPO_ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+IMPORT_BUDGET = 0.05    # seconds, on top of a bare interpreter start
+
+PROBE = '''
+import sys, time
+start = time.perf_counter()
+import node_manager
+elapsed = time.perf_counter() - start
+print(elapsed)
+print(' '.join(sorted(name for name in ('docker', 'requests', 'numpy', 'node_manager.radio', 'node_manager.router') if name in sys.modules)))
+'''
+
+
+class TestLazyImport(unittest.TestCase):
+
+    def probe(self) -> tuple[float, list[str]]:
+        # a fresh interpreter, modules imported by the test runner would hide the cost
+        result = subprocess.run([sys.executable, '-c', PROBE], cwd=REPO_ROOT, capture_output=True, text=True, check=True)
+        elapsed, loaded = result.stdout.split('\n')[:2]
+        return float(elapsed), loaded.split()
+
+    def test_no_side_effects(self):
+        _, loaded = self.probe()
+        self.assertEqual(loaded, [], 'Importing node_manager loaded heavy modules!')
+        return
+
+    def test_import_time(self):
+        elapsed = min(self.probe()[0] for _ in range(3))
+        self.assertLess(elapsed, IMPORT_BUDGET, f'Importing node_manager took {elapsed * 1000:.1f}ms!')
+        return
+
+    def test_unknown_name(self):
+        result = subprocess.run([sys.executable, '-c', 'import node_manager; node_manager.Nope'], cwd=REPO_ROOT, capture_output=True, text=True)
+        self.assertIn('AttributeError', result.stderr)
+        return
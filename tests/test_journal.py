@@ -0,0 +1,67 @@
+import unittest
+from ..node_manager.journal import StateJournal
+from tempfile import TemporaryDirectory
+
+
+class TestStateJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        StateJournal.enable(self.tmpdir.name)
+        return
+
+    def tearDown(self):
+        StateJournal.enable(None)
+        self.tmpdir.cleanup()
+        return
+
+    def reload(self):
+        # drop the cached state, as a restarted controller would
+        StateJournal.enable(self.tmpdir.name)
+
+    def test_router_survives_reload(self):
+        StateJournal.record_router('test1', container_id='abc', phy='phy3', macaddr='02:00:00:00:03:00')
+        StateJournal.record_router('test1', veth='vjk-test1')
+        self.reload()
+
+        self.assertEqual(StateJournal.router('test1'), {'container_id': 'abc', 'phy': 'phy3', 'macaddr': '02:00:00:00:03:00', 'veth': 'vjk-test1'})
+        self.assertIsNone(StateJournal.router('test2'))
+        return
+
+    def test_forget_router(self):
+        StateJournal.record_router('test1', container_id='abc')
+        StateJournal.record_medium({'test1': {'x': 0.0, 'y': 10.0, 'tx_power': None}})
+        StateJournal.forget_router('test1')
+        self.reload()
+
+        self.assertEqual(StateJournal.routers(), {})
+        self.assertEqual(StateJournal.medium(), {})
+        return
+
+    def test_fleet_id_and_wmediumd(self):
+        StateJournal.record_fleet_id('a1b2c3')
+        StateJournal.record_wmediumd(pid=42, api_socket='/tmp/jk_wmd_x.sock', config='/tmp/jk_wmd_x.conf')
+        self.reload()
+
+        self.assertEqual(StateJournal.fleet_id(), 'a1b2c3')
+        self.assertEqual(StateJournal.wmediumd(), {'pid': 42, 'api_socket': '/tmp/jk_wmd_x.sock', 'config': '/tmp/jk_wmd_x.conf'})
+        StateJournal.record_wmediumd()
+        self.reload()
+        self.assertEqual(StateJournal.wmediumd(), {})
+        return
+
+    def test_corrupt_file_is_ignored(self):
+        with open(StateJournal.path(), 'w') as f:
+            f.write('{not json')
+        self.reload()
+
+        self.assertEqual(StateJournal.routers(), {})
+        return
+
+    def test_disabled(self):
+        StateJournal.enable(None)
+        StateJournal.record_router('test1', container_id='abc')
+
+        self.assertFalse(StateJournal.enabled())
+        self.assertEqual(StateJournal.routers(), {})
+        return
@@ -0,0 +1,46 @@
+import unittest
+from ..node_manager import ULed, LedMonitor
+from subprocess import run
+from time import sleep
+
+
+class TestLedMonitor(unittest.TestCase):
+
+    def setUp(self):
+        self.uled = ULed('test:green:monitor')
+        self.monitor = LedMonitor()
+        self.monitor.register(self.uled)
+        return
+
+    def tearDown(self):
+        self.monitor.close()
+        return
+
+    def test_transitions(self):
+        with open('/sys/class/leds/test:green:monitor/brightness', 'w') as f:
+            f.write('1')
+        self.assertEqual(self.monitor.poll(1.0), 1, 'Transition not seen!')
+        self.assertEqual(self.uled.brightness, 1, 'Wrong brightness value!')
+
+        with open('/sys/class/leds/test:green:monitor/brightness', 'w') as f:
+            f.write('0')
+        self.monitor.poll(1.0)
+        self.assertEqual([brightness for _, brightness in self.monitor.history(self.uled)], [0, 1, 0])
+
+        return
+
+    def test_activity(self):
+        run(['/sbin/modprobe', 'ledtrig-timer'], check=True)
+
+        self.monitor.start()
+        with open('/sys/class/leds/test:green:monitor/trigger', 'w') as f:
+            f.write('timer')
+        with open('/sys/class/leds/test:green:monitor/delay_on', 'w') as f:
+            f.write('50')
+        with open('/sys/class/leds/test:green:monitor/delay_off', 'w') as f:
+            f.write('50')
+
+        sleep(1.0)
+        self.assertGreater(self.monitor.activity(self.uled, 1.0), 5, 'LED blinks not recorded!')
+
+        return
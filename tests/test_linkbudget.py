@@ -0,0 +1,50 @@
+import unittest
+from ..node_manager.linkbudget import LinkBudget
+from io import StringIO
+import numpy as np
+
+
+class TestLinkBudget(unittest.TestCase):
+
+    def setUp(self):
+        self.macaddrs = [f'02:00:00:00:00:{i:02x}' for i in range(4)]
+        self.budget = LinkBudget(self.macaddrs, [(0, 0), (10, 0), (100, 0), (1000, 0)], 10.0, path_loss_exp=3.5, min_snr=0.0)
+        return
+
+    def test_matches_dense_matrix(self):
+        snr = self.budget.snr_matrix()
+        src, dst, link_snr = self.budget.links
+        np.testing.assert_allclose(link_snr, snr[src, dst])
+        self.assertEqual(len(src), np.count_nonzero(snr >= 0.0), 'Wrong number of links kept!')
+        self.assertTrue(np.all(src != dst), 'Node links to itself!')
+        return
+
+    def test_snr_drops_with_distance(self):
+        snr = self.budget.snr_matrix()
+        self.assertGreater(snr[0, 1], snr[0, 2])
+        self.assertGreater(snr[0, 2], snr[0, 3])
+        return
+
+    def test_diff(self):
+        moved = LinkBudget(self.macaddrs, [(0, 0), (10, 0), (20, 0), (1000, 0)], 10.0, path_loss_exp=3.5, min_snr=0.0)
+        src, dst, old, new = moved.diff(self.budget)
+        self.assertEqual(set(zip(src.tolist(), dst.tolist())), {(0, 2), (2, 0), (1, 2), (2, 1)})
+        self.assertTrue(np.all(np.isinf(old)), 'Links should be new!')
+        return
+
+    def test_export_error_prob(self):
+        out_file = StringIO()
+        self.budget.to_error_prob_config().export(out_file)
+        self.assertIn('type = "prob";', out_file.getvalue())
+        self.assertIn('(0, 1, 0.000000)', out_file.getvalue())
+        self.assertNotIn('(0, 3,', out_file.getvalue())
+        return
+
+    def test_export_snr(self):
+        out_file = StringIO()
+        self.budget.to_snr_config(floor_snr=-10).export(out_file)
+        self.assertIn('type = "snr";', out_file.getvalue())
+        self.assertIn(f'(0, 1, {round(self.budget.snr_matrix()[0, 1])})', out_file.getvalue())
+        self.assertIn('(0, 3, -10)', out_file.getvalue())
+        self.assertEqual(out_file.getvalue().count('\t\t('), 6, 'Every pair should be listed once!')
+        return
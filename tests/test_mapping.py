@@ -0,0 +1,43 @@
+import unittest
+from ..node_manager.mapping import SpatialGrid
+from math import dist
+from random import Random
+
+
+class TestSpatialGrid(unittest.TestCase):
+
+    def setUp(self):
+        rng = Random(0)
+        self.grid = SpatialGrid(100.0)
+        self.coords = {}
+        for i in range(500):
+            self.coords[i] = (rng.uniform(0, 2000), rng.uniform(0, 2000))
+            self.grid.add(i, *self.coords[i])
+        return
+
+    def assertMatchesBruteForce(self, radius: float):
+        for key, coord in self.coords.items():
+            expected = {other for other, other_coord in self.coords.items() if other != key and dist(coord, other_coord) <= radius}
+            self.assertEqual(self.grid.neighbors(key, radius), expected, f'Wrong neighbors of {key} within {radius}!')
+
+    def test_neighbors(self):
+        self.assertMatchesBruteForce(100.0)
+        self.assertMatchesBruteForce(250.0)
+        return
+
+    def test_move_and_remove(self):
+        for key in range(0, 500, 3):
+            self.coords[key] = (self.coords[key][0] + 150.0, self.coords[key][1] - 40.0)
+            self.grid.move(key, *self.coords[key])
+        for key in range(0, 500, 5):
+            del self.coords[key]
+            self.grid.remove(key)
+
+        self.assertEqual(len(self.grid), len(self.coords))
+        self.assertMatchesBruteForce(100.0)
+        return
+
+    def test_add_twice(self):
+        with self.assertRaises(ValueError):
+            self.grid.add(0, 0.0, 0.0)
+        return
@@ -0,0 +1,73 @@
+import unittest
+from ..node_manager.metrics import Metrics, Histogram
+from urllib.request import urlopen
+import json
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        Metrics.reset()
+        Metrics.enable()
+        return
+
+    def tearDown(self):
+        Metrics.stop()
+        Metrics.disable()
+        Metrics.reset()
+        return
+
+    def test_histogram(self):
+        histogram = Histogram((0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value)
+        self.assertEqual(histogram.cumulative(), [(0.1, 2), (1.0, 3), (float('inf'), 4)])
+        self.assertAlmostEqual(histogram.sum, 2.65)
+        return
+
+    def test_span_and_failures(self):
+        @Metrics.timed('work')
+        def work(fail: bool):
+            if fail:
+                raise ValueError('fail')
+
+        work(False)
+        with self.assertRaises(ValueError):
+            work(True)
+        Metrics.count('retries', 3)
+
+        snapshot = Metrics.snapshot()
+        self.assertEqual(snapshot['spans']['work']['count'], 2)
+        self.assertEqual(snapshot['spans']['work']['failures'], 1)
+        self.assertEqual(snapshot['counters'], {'retries': 3})
+        self.assertEqual(snapshot['inflight'], [])
+        return
+
+    def test_inflight(self):
+        with Metrics.span('outer', 'test1'), Metrics.span('inner'):
+            self.assertEqual([span['span'] for span in Metrics.inflight()], ['outer', 'inner'])
+            self.assertEqual(Metrics.inflight()[0]['detail'], 'test1')
+        self.assertEqual(Metrics.inflight(), [])
+        return
+
+    def test_disabled(self):
+        Metrics.disable()
+        with Metrics.span('work'):
+            pass
+        Metrics.count('retries')
+        self.assertEqual(Metrics.snapshot(), {'spans': {}, 'counters': {}, 'inflight': []})
+        return
+
+    def test_serve(self):
+        with Metrics.span('work'):
+            pass
+        server = Metrics.serve(0)
+        port = server.server_port
+
+        text = urlopen(f'http://127.0.0.1:{port}/metrics').read().decode()
+        self.assertIn('jaringkan_span_seconds_count{span="work"} 1', text)
+        self.assertIn('jaringkan_span_seconds_bucket{span="work",le="+Inf"} 1', text)
+
+        snapshot = json.load(urlopen(f'http://127.0.0.1:{port}/metrics.json'))
+        self.assertEqual(snapshot['spans']['work']['count'], 1)
+        return
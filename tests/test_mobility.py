@@ -0,0 +1,151 @@
+import unittest
+import os
+from ..node_manager.mobility import MobilityEngine, RandomWaypoint, Trace, GroupMobility
+from tempfile import TemporaryDirectory
+import numpy as np
+
+
+class FakeRouter:
+    def __init__(self, hostname: str):
+        self.hostname = hostname
+
+    def __repr__(self):
+        return self.hostname
+
+
+class FakeMedium:
+    path_loss_exp = 3.5
+    xg = 0.0
+    default_tx_power = 10.0
+    noise_level = -91.0
+
+    def __init__(self, placements: dict):
+        self._placements = placements
+        self.positions = {}
+
+    def placements(self):
+        return self._placements
+
+    def set_positions(self, positions: dict):
+        self.positions.update(positions)
+
+
+class TestModels(unittest.TestCase):
+
+    def test_random_waypoint_in_bounds(self):
+        model = RandomWaypoint((0, 0, 100, 50), speed=(1.0, 5.0), pause=(0.0, 1.0), seed=1)
+        positions = np.zeros((200, 2))
+        model.reset(positions)
+        for tick in range(100):
+            moved = model.step(positions, tick * 0.1, 0.1)
+            step = np.hypot(*(moved - positions).T)
+            self.assertTrue(np.all(step <= 5.0 * 0.1 + 1e-9), 'Node moved faster than its speed!')
+            positions = moved
+
+        self.assertTrue(np.all(positions >= 0) and np.all(positions[:, 0] <= 100) and np.all(positions[:, 1] <= 50))
+        self.assertGreater(np.count_nonzero(positions), 0)
+        return
+
+    def test_trace_interpolates(self):
+        model = Trace([[(0, 0, 0), (10, 100, 0)], [(5, 0, 0)], [(0, 0, 0), (2, 0, 20)]], loop=False)
+        np.testing.assert_allclose(model.step(np.zeros((3, 2)), 5.0, 0.1), [(50, 0), (0, 0), (0, 20)])
+        np.testing.assert_allclose(model.step(np.zeros((3, 2)), 20.0, 0.1), [(100, 0), (0, 0), (0, 20)])
+        return
+
+    def test_trace_loops(self):
+        model = Trace([[(0, 0, 0), (10, 100, 0)]], loop=True)
+        np.testing.assert_allclose(model.step(np.zeros((1, 2)), 12.5, 0.1), [(25, 0)])
+        return
+
+    def test_trace_read_csv(self):
+        with TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'trace.csv')
+            with open(path, 'w') as f:
+                f.write('hostname,time,x,y\na,0,0,0\nb,0,5,5\na,10,100,0\n')
+            traces = Trace.read_csv(path)
+
+        self.assertEqual(list(traces), ['a', 'b'])
+        np.testing.assert_allclose(traces['a'], [(0, 0, 0), (10, 100, 0)])
+        return
+
+    def test_group_stays_together(self):
+        model = GroupMobility([0, 0, 0, 1, 1], (0, 0, 1000, 1000), speed=(5.0, 10.0), radius=20.0, drift=5.0, seed=2)
+        positions = np.array([(0, 0), (10, 0), (0, 10), (500, 500), (510, 500)], dtype=np.float64)
+        model.reset(positions)
+        for tick in range(200):
+            positions = model.step(positions, tick * 0.1, 0.1)
+
+        for members in ([0, 1, 2], [3, 4]):
+            spread = positions[members] - positions[members].mean(axis=0)
+            self.assertTrue(np.all(np.hypot(*spread.T) <= 2 * 20.0), 'Group fell apart!')
+        return
+
+
+class TestMobilityEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.routers = [FakeRouter(f'n{i}') for i in range(3)]
+        self.medium = FakeMedium({
+            self.routers[0]: (0.0, 0.0, None),
+            self.routers[1]: (10.0, 0.0, None),
+            self.routers[2]: (1000.0, 0.0, None),
+        })
+        self.pushed = []
+        self.engine = MobilityEngine(self.medium, rate=10.0, thresholds=[1.0, 20.0], push=self.pushed.extend)
+        return
+
+    def test_pushes_only_crossings(self):
+        # n0 drives away from n1 at 10 m/s
+        self.engine.add(Trace([[(0, 0, 0), (100, 1000, 0)]]), ['n0'])
+        crossings = []
+        for tick in range(1000):
+            updates = self.engine.tick()
+            if updates:
+                crossings.append((tick, updates))
+
+        # 1 dB reach is ~50m, 20 dB reach ~15m: n0-n1 drops below 20 dB then 1 dB, n0-n2 rises above both
+        pairs = [{a.hostname, b.hostname} for _, updates in crossings for a, b, _ in updates]
+        self.assertEqual(pairs.count({'n0', 'n1'}), 2)
+        self.assertEqual(pairs.count({'n0', 'n2'}), 2)
+        self.assertNotIn({'n1', 'n2'}, pairs)
+        self.assertEqual(self.pushed, [update for _, updates in crossings for update in updates])
+        np.testing.assert_allclose(self.medium.positions[self.routers[0]], (1000.0, 0.0))
+        return
+
+    def test_cut_links_pushed_below_thresholds(self):
+        self.engine.add(Trace([[(0, 0, 0), (1, 5000, 0)]]), ['n0'])
+        self.engine.tick(2.0)
+
+        self.assertEqual(len(self.pushed), 1)
+        router1, router2, snr = self.pushed[0]
+        self.assertEqual({router1.hostname, router2.hostname}, {'n0', 'n1'})
+        self.assertEqual(snr, 0.0)
+        # what was pushed is unlinked for the engine too
+        self.assertEqual(np.searchsorted(self.engine.thresholds, snr, side='right'), 0)
+
+        with self.assertRaises(ValueError):
+            MobilityEngine(self.medium, thresholds=[0.0, 20.0], push=None)
+        return
+
+    def test_one_model_per_router(self):
+        self.engine.add(RandomWaypoint((0, 0, 10, 10)), ['n0', 'n1'])
+        with self.assertRaises(ValueError):
+            self.engine.add(RandomWaypoint((0, 0, 10, 10)), [self.routers[1]])
+        return
+
+    def test_thousand_nodes(self):
+        rng = np.random.default_rng(3)
+        routers = [FakeRouter(f'n{i}') for i in range(1200)]
+        medium = FakeMedium({router: (*rng.uniform(0, 5000, 2), None) for router in routers})
+        engine = MobilityEngine(medium, push=lambda updates: None)
+        engine.add(RandomWaypoint((0, 0, 5000, 5000), speed=(5.0, 15.0), seed=4), routers)
+
+        for _ in range(5):
+            updates = engine.tick()
+        # no node gets anywhere near all others in one tick
+        self.assertLess(len(updates), 1200 * 10)
+        self.assertEqual(len(medium.positions), 1200)
+
+        # what it keeps incrementally is what it would compute from scratch
+        self.assertEqual(engine.links(), MobilityEngine(FakeMedium({router: (*engine.positions[i], None) for i, router in enumerate(routers)}), push=None).links())
+        return
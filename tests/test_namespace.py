@@ -0,0 +1,190 @@
+import unittest
+from ..node_manager.linuxutils import Namespace, NamespaceWorker, SysfsMount, run_in_namespace
+from os import readlink, getcwd
+from subprocess import Popen, TimeoutExpired
+from threading import Thread
+from time import sleep
+from unittest import mock
+import os
+
+
+def current(t: str) -> str:
+    return readlink(f'/proc/thread-self/ns/{t}')
+
+
+class TestNamespace(unittest.TestCase):
+
+    def setUp(self):
+        # create new dummy namespaces, using sleep as placeholder program
+        self.dummyprog = Popen(['/usr/bin/unshare', '--mount', '--net', '--uts', '/usr/bin/sleep', '10'])
+        sleep(0.1)  # hope for unshare to finish
+        self.pid = self.dummyprog.pid
+        self.target = {t: readlink(f'/proc/{self.pid}/ns/{t}') for t in ('mnt', 'net', 'uts')}
+        self.host = {t: current(t) for t in ('mnt', 'net', 'uts')}
+        return
+
+    def tearDown(self):
+        self.dummyprog.kill()
+        return
+
+    def test_enter_all_at_once(self):
+        ns = Namespace(mnt=self.pid, net=self.pid, uts=self.pid)
+        self.assertIsNotNone(ns._pidfd, 'Namespaces of one PID not entered through a pidfd!')
+
+        cwd = getcwd()
+        with ns:
+            self.assertEqual({t: current(t) for t in self.target}, self.target)
+        self.assertEqual({t: current(t) for t in self.host}, self.host, 'Not back in host namespaces!')
+        self.assertEqual(getcwd(), cwd)
+        return
+
+    def test_only(self):
+        ns = Namespace(mnt=self.pid, net=self.pid, uts=self.pid)
+        view = ns.only('net')
+        self.assertEqual(view.net, ns.net, 'View reopened the netns!')
+        self.assertIsNone(view.mnt)
+
+        with view:
+            self.assertEqual(current('net'), self.target['net'])
+            self.assertEqual(current('mnt'), self.host['mnt'])
+        self.assertEqual(current('net'), self.host['net'])
+        return
+
+    def test_enter_after_exit(self):
+        # what unbinding a radio does once the container has died
+        ns = Namespace(mnt=self.pid, net=self.pid, uts=self.pid)
+        view = ns.only('net')
+        self.dummyprog.kill()
+        self.dummyprog.wait()
+
+        with view:
+            self.assertEqual(current('net'), self.target['net'])
+        self.assertEqual(current('net'), self.host['net'])
+        return
+
+    def test_nested_and_threads(self):
+        outer = Namespace(uts=self.pid)
+        inner = Namespace(mnt=self.pid, net=self.pid)
+        results = []
+
+        def worker():
+            with outer:
+                with inner:
+                    results.append(current('net') == self.target['net'])
+                # back to outer, not to the host
+                results.append(current('uts') == self.target['uts'] and current('net') == self.host['net'])
+            results.append(current('uts') == self.host['uts'])
+
+        threads = [Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [True] * 12)
+        return
+
+
+class TestNamespaceWorker(unittest.TestCase):
+
+    def setUp(self):
+        self.dummyprog = Popen(['/usr/bin/unshare', '--net', '/usr/bin/sleep', '10'])
+        sleep(0.1)  # hope for unshare to finish
+        self.target = readlink(f'/proc/{self.dummyprog.pid}/ns/net')
+        self.worker = NamespaceWorker(Namespace(net=self.dummyprog.pid))
+        return
+
+    def tearDown(self):
+        self.worker.close()
+        self.dummyprog.kill()
+        return
+
+    def test_call_stays_inside(self):
+        self.assertEqual(self.worker.call(current, 'net'), self.target)
+        self.assertNotEqual(current('net'), self.target, 'Caller moved into the namespace!')
+        with self.assertRaises(ZeroDivisionError):
+            self.worker.call(lambda: 1 / 0)
+        return
+
+    def test_run(self):
+        result = self.worker.run(['/usr/bin/readlink', '/proc/self/ns/net']).result()
+        self.assertEqual(result.stdout.decode().strip(), self.target)
+        return
+
+    def test_close(self):
+        self.worker.close()
+        with self.assertRaises(RuntimeError):
+            self.worker.submit(current, 'net')
+        return
+
+
+class TestRunInNamespace(unittest.TestCase):
+
+    def setUp(self):
+        # sleep is pid 1 of a new pid namespace, with a /proc of its own
+        self.dummyprog = Popen(['/usr/bin/unshare', '--fork', '--kill-child', '--pid', '--mount-proc', '--net', '--uts', '/usr/bin/sleep', '10'])
+        sleep(0.1)  # hope for unshare to finish
+        with open(f'/proc/{self.dummyprog.pid}/task/{self.dummyprog.pid}/children') as f:
+            self.pid = int(f.read().split()[0])
+        self.target = {t: readlink(f'/proc/{self.pid}/ns/{t}') for t in ('net', 'pid')}
+        self.ns = Namespace(mnt=self.pid, net=self.pid, pid=self.pid, uts=self.pid)
+        return
+
+    def tearDown(self):
+        self.dummyprog.kill()
+        return
+
+    def test_run(self):
+        # fork() from a threaded process is what this must not do
+        with mock.patch.object(os, 'fork', side_effect=AssertionError('forked')):
+            result = run_in_namespace(self.ns, ['/bin/sh', '-c', 'readlink /proc/self/ns/net /proc/self/ns/pid; cat; pwd'], input=b'hello\n', cwd='/tmp')
+
+        net, pid, echoed, cwd = result.stdout.decode().split()
+        self.assertEqual((net, pid), (self.target['net'], self.target['pid']))
+        self.assertEqual((echoed, cwd), ('hello', '/tmp'))
+        self.assertEqual(current('net'), readlink('/proc/self/ns/net'), 'Caller stayed in the namespace!')
+        return
+
+    def test_errors(self):
+        self.assertEqual(run_in_namespace(self.ns, ['/bin/sh', '-c', 'echo no >&2; exit 3']).returncode, 3)
+        with self.assertRaises(TimeoutExpired):
+            run_in_namespace(self.ns, ['/usr/bin/sleep', '10'], timeout=0.1)
+        with self.assertRaises(FileNotFoundError):
+            run_in_namespace(self.ns, ['/nonexistent'])
+        return
+
+    def test_from_threads(self):
+        results = []
+        def worker():
+            results.append(run_in_namespace(self.ns, ['/usr/bin/readlink', '/proc/self/ns/net']).stdout.decode().strip())
+
+        threads = [Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [self.target['net']] * 8)
+        return
+
+
+class TestSysfsMount(unittest.TestCase):
+
+    def setUp(self):
+        self.dummyprog = Popen(['/usr/bin/unshare', '--net', '/usr/bin/sleep', '10'])
+        sleep(0.1)  # hope for unshare to finish
+        return
+
+    def tearDown(self):
+        self.dummyprog.kill()
+        return
+
+    def test_sysfs_of_netns(self):
+        with open('/proc/self/mountinfo') as f:
+            mounts = f.read()
+
+        sysfs = SysfsMount(Namespace(net=self.dummyprog.pid))
+        self.assertEqual(sysfs.listdir('class/net'), ['lo'], 'Not the sysfs of the dummy netns!')
+        self.assertEqual(sysfs.read('class/net/lo/address'), '00:00:00:00:00:00')
+        with open('/proc/self/mountinfo') as f:
+            self.assertEqual(f.read(), mounts, 'Detached sysfs showed up in the mount table!')
+        sysfs.close()
+        return
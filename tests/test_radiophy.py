@@ -8,12 +8,12 @@ from time import sleep
 class TestRadioPhy(unittest.TestCase):
     
     def test_create_from_any(self):
-        phy = RadioPhy.from_any()
+        phy = RadioPhy()
         self.assertTrue(exists(f'/sys/class/ieee80211/{phy.phy}'), 'PHY does not actually exist!')
         return
     
     def test_bind_unbind(self):
-        phy = RadioPhy.from_any()
+        phy = RadioPhy()
 
         # create new dummy network namespace, using cat as placeholder program
         dummyprog = Popen(['/usr/bin/unshare', '--mount', '--net', '/usr/bin/sleep', '10'])
@@ -22,9 +22,7 @@ class TestRadioPhy(unittest.TestCase):
 
         phy.bind(dummypid)
         self.assertTrue(phy.isbound(), 'PHY is not bound when it supposed to be bound!')
-        self.assertEqual(phy.netns_pid, dummypid, 'PHY is bound to wrong network namespace!')
-
-        # physical check
+        # physical check, the PHY must be in the dummy netns
         run(['/usr/bin/nsenter', '-t', str(dummypid), '-m', '-n', '/usr/bin/mount', '-t', 'sysfs', 'sysfs', '/sys'], check=True)
         run(['/usr/bin/nsenter', '-t', str(dummypid), '-m', '-n', '/usr/bin/iw', 'phy', phy.phy, 'info'], check=True)
 
@@ -0,0 +1,43 @@
+import unittest
+from ..node_manager.linuxutils import Namespace, RtNetlink
+from os.path import exists
+from subprocess import run, Popen
+from time import sleep
+
+
+class TestRtNetlink(unittest.TestCase):
+
+    def setUp(self):
+        self.rtnl = RtNetlink.host()
+
+        # create new dummy network namespace, using sleep as placeholder program
+        self.dummyprog = Popen(['/usr/bin/unshare', '--net', '/usr/bin/sleep', '10'])
+        sleep(0.1)  # hope for unshare to finish
+        self.dummyns = Namespace(net=self.dummyprog.pid)
+        return
+
+    def tearDown(self):
+        self.rtnl.link_del('vjk-test', missing_ok=True)
+        self.dummyprog.kill()
+        return
+
+    def test_veth_add_del(self):
+        self.rtnl.veth_add('vjk-test', 'eth1', peer_netns_fd=self.dummyns.net)
+        self.assertTrue(exists('/sys/class/net/vjk-test'), 'Host side of veth not created!')
+        run(['/usr/bin/nsenter', '-t', str(self.dummyprog.pid), '-n', '/usr/bin/ip', 'link', 'show', 'eth1'], check=True)
+
+        self.rtnl.link_del('vjk-test')
+        self.assertFalse(exists('/sys/class/net/vjk-test'), 'Host side of veth not removed!')
+
+        with self.assertRaises(OSError):
+            self.rtnl.link_del('vjk-test')
+        self.rtnl.link_del('vjk-test', missing_ok=True)
+        return
+
+    def test_batch_recreate(self):
+        for _ in range(2):
+            with self.rtnl.batch() as batch:
+                batch.link_del('vjk-test', missing_ok=True)
+                batch.veth_add('vjk-test', 'eth1', peer_netns_fd=self.dummyns.net)
+        self.assertTrue(exists('/sys/class/net/vjk-test'), 'veth not re-created!')
+        return
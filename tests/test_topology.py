@@ -0,0 +1,141 @@
+import unittest
+import io
+import os
+from ..node_manager.topology import Topology, _JsonStream, _read_json
+from tempfile import TemporaryDirectory
+
+
+class FakeRouter:
+    def __init__(self, hostname: str):
+        self.hostname = hostname
+
+
+class FakeFleet:
+    def __init__(self, hostnames):
+        self.routers = {hostname: FakeRouter(hostname) for hostname in hostnames}
+
+
+class FakeMedium:
+    path_loss_exp = 3.5
+    xg = 0.0
+    default_tx_power = 10.0
+    min_snr = 0.0
+    noise_level = -91.0
+
+    def __init__(self, placements: dict):
+        self._placements = placements
+
+    def placements(self):
+        return self._placements
+
+
+class TestTopologyFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.topology = Topology([('a', 0, 0, None), ('b', 10.5, -3, 15.0)], medium={'path_loss_exp': 3.0})
+        return
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        return
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.tmpdir.name, name)
+
+    def test_json_roundtrip(self):
+        self.topology.save(self.path('t.json'))
+        self.assertEqual(Topology.load(self.path('t.json')), self.topology)
+        return
+
+    def test_jsonl_roundtrip(self):
+        self.topology.save(self.path('t.jsonl'))
+        self.assertEqual(Topology.load(self.path('t.jsonl')), self.topology)
+        return
+
+    def test_toml(self):
+        with open(self.path('t.toml'), 'w') as f:
+            f.write('[medium]\npath_loss_exp = 3.0\n\n[[nodes]]\nhostname = "a"\nx = 0\ny = 0\n\n'
+                    '[[nodes]]\nhostname = "b"\nx = 10.5\ny = -3\ntx_power = 15\n')
+        self.assertEqual(Topology.load(self.path('t.toml')), self.topology)
+        return
+
+    def test_stream_across_chunks(self):
+        # every value cut somewhere by 7 character reads, numbers included
+        document = '{"version": 12345, "nodes": [' + ', '.join(
+            f'{{"hostname": "n{i}", "x": {i * 1.25}, "y": {-i}}}' for i in range(50)
+        ) + '], "medium": {"xg": 2}}'
+        events = list(_read_json(_ChunkedReader(document, 7)))
+
+        self.assertEqual(events[-1], ('medium', {'xg': 2}))
+        self.assertEqual([obj['hostname'] for _, obj in events[:-1]], [f'n{i}' for i in range(50)])
+        return
+
+    def test_stream_trailing_number(self):
+        stream = _JsonStream(io.StringIO('12345'), chunk_size=2)
+        self.assertEqual(stream.value(), 12345)
+        self.assertEqual(stream.peek(), '')
+        return
+
+    def test_rejects_bad_entries(self):
+        with open(self.path('dup.jsonl'), 'w') as f:
+            f.write('{"hostname": "a", "x": 0, "y": 0}\n{"hostname": "a", "x": 1, "y": 0}\n')
+        with open(self.path('param.json'), 'w') as f:
+            f.write('{"medium": {"path_loss": 3}, "nodes": []}')
+        with open(self.path('coord.json'), 'w') as f:
+            f.write('{"nodes": [{"hostname": "a", "x": 0}]}')
+
+        for name in ('dup.jsonl', 'param.json', 'coord.json'):
+            with self.assertRaises(ValueError):
+                Topology.load(self.path(name))
+        return
+
+
+class _ChunkedReader:
+    def __init__(self, text: str, size: int):
+        self.f = io.StringIO(text)
+        self.size = size
+
+    def read(self, n: int) -> str:
+        return self.f.read(min(n, self.size))
+
+
+class TestTopologyDiff(unittest.TestCase):
+
+    def setUp(self):
+        self.fleet = FakeFleet(['a', 'b', 'c', 'd'])
+        routers = self.fleet.routers
+        self.medium = FakeMedium({
+            routers['a']: (0.0, 0.0, None),
+            routers['b']: (10.0, 0.0, None),
+            routers['c']: (20.0, 0.0, 12.0),
+        })
+        return
+
+    def test_same_topology_is_empty(self):
+        self.fleet.routers.pop('d')
+        topology = Topology([('a', 0, 0, None), ('b', 10, 0, None), ('c', 20, 0, 12)])
+        self.assertFalse(topology.diff(self.fleet, self.medium))
+        return
+
+    def test_minimal_changes(self):
+        topology = Topology([('b', 10, 30, None), ('c', 20, 0, None), ('d', 5, 5, None), ('e', 1, 1, 20)], medium={'xg': 0.0, 'path_loss_exp': 3.0})
+        diff = topology.diff(self.fleet, self.medium)
+
+        self.assertEqual(diff.remove, ['a'])
+        self.assertEqual(diff.create, {'e': (1.0, 1.0, 20.0)})
+        self.assertEqual(diff.place, {'d': (5.0, 5.0, None)})
+        self.assertEqual(diff.move, {'b': (10.0, 30.0)})
+        self.assertEqual(diff.tx_power, {'c': None})
+        self.assertEqual(diff.medium, {'path_loss_exp': 3.0})
+        self.assertTrue(diff.needs_restart)
+        return
+
+    def test_moves_only_stay_live(self):
+        self.fleet.routers.pop('d')
+        topology = Topology([('a', 0, 1, None), ('b', 10, 0, None), ('c', 20, 0, 12)])
+        diff = topology.diff(self.fleet, self.medium)
+
+        self.assertEqual(diff.move, {'a': (0.0, 1.0)})
+        self.assertFalse(diff.needs_restart)
+        return
@@ -0,0 +1,181 @@
+import unittest
+import asyncio
+import os
+import sys
+from socket import socketpair, AF_UNIX, SOCK_STREAM
+from subprocess import Popen
+from time import sleep
+from ..node_manager.wmediumd import Wmediumd, AsyncWmediumdClient, WmediumdMsgType
+from ..node_manager.journal import StateJournal
+from tempfile import TemporaryDirectory
+
+
+def message(msg_type: int, payload: bytes = b'') -> bytes:
+    return Wmediumd._struct_header.pack(msg_type, len(payload)) + payload
+
+def tx_start(cookie: int) -> bytes:
+    return message(WmediumdMsgType.TX_START, Wmediumd._struct_tx_start.pack(cookie, 2412))
+
+
+class SmallClient(AsyncWmediumdClient):
+    slot_count = 2
+
+
+class TestAsyncWmediumdClient(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.wmediumd_sock, client_sock = socketpair(AF_UNIX, SOCK_STREAM)
+        client_sock.setblocking(False)
+        self.client_sock = client_sock
+        return
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        self.wmediumd_sock.close()
+        return
+
+    async def feed(self, data: bytes):
+        # let the receive loop take it all in
+        self.wmediumd_sock.sendall(data)
+        for _ in range(100):
+            await asyncio.sleep(0.001)
+
+    async def test_events_in_order(self):
+        self.client = AsyncWmediumdClient(self.client_sock)
+        frames = self.client.subscribe({WmediumdMsgType.TX_START})
+        await self.feed(tx_start(1) + message(WmediumdMsgType.NETLINK, b'ignored') + tx_start(2))
+
+        cookies = [(await anext(frames)).tx_start()[0] for _ in range(2)]
+        self.assertEqual(cookies, [1, 2])
+        self.assertEqual((frames.received, frames.dropped), (2, 0))
+        return
+
+    async def test_subscriber_overflow(self):
+        self.client = AsyncWmediumdClient(self.client_sock)
+        slow = self.client.subscribe({WmediumdMsgType.TX_START}, maxsize=2)
+        fast = self.client.subscribe({WmediumdMsgType.TX_START}, maxsize=10)
+        await self.feed(b''.join(tx_start(cookie) for cookie in range(5)))
+
+        self.assertEqual((slow.received, slow.dropped), (2, 3))
+        self.assertEqual((fast.received, fast.dropped), (5, 0))
+        self.assertEqual(self.client.dropped, 0)
+        self.assertEqual([(await anext(slow)).tx_start()[0] for _ in range(2)], [0, 1])
+        return
+
+    async def test_slots_exhausted(self):
+        self.client = SmallClient(self.client_sock)
+        frames = self.client.subscribe({WmediumdMsgType.TX_START}, maxsize=10)
+        await self.feed(b''.join(tx_start(cookie) for cookie in range(3)))
+
+        # both slots held by queued events, the third has nowhere to go
+        self.assertEqual(self.client.dropped, 1)
+        self.assertEqual(frames.received, 2)
+
+        # consuming frees the slots again
+        await anext(frames)
+        await anext(frames)
+        frames.close()
+        await self.feed(tx_start(3))
+        self.assertEqual(self.client.dropped, 1)
+        self.assertEqual(len(self.client._free_slots), 2)
+        return
+
+    async def test_ack(self):
+        self.client = AsyncWmediumdClient(self.client_sock)
+        register = asyncio.create_task(self.client.register())
+        await asyncio.sleep(0.01)
+        request = self.wmediumd_sock.recv(Wmediumd._struct_header.size)
+        self.assertEqual(Wmediumd._struct_header.unpack(request), (WmediumdMsgType.REGISTER, 0))
+
+        await self.feed(message(WmediumdMsgType.ACK))
+        await asyncio.wait_for(register, 1.0)
+
+        set_snr = asyncio.create_task(self.client.set_snr('02:00:00:00:00:00', '02:00:00:00:01:00', 20))
+        await self.feed(message(WmediumdMsgType.INVALID))
+        with self.assertRaises(ValueError):
+            await asyncio.wait_for(set_snr, 1.0)
+        return
+
+
+# stands in for a wmediumd left running by an earlier controller, acks whatever it gets
+FAKE_WMEDIUMD = '''
+import socket, struct, sys
+server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+server.bind(sys.argv[1])
+server.listen()
+while True:
+    conn, _ = server.accept()
+    while header := conn.recv(8, socket.MSG_WAITALL):
+        _, length = struct.unpack('@II', header)
+        conn.recv(length, socket.MSG_WAITALL) if length else None
+        conn.sendall(struct.pack('@II', 1, 0))
+'''
+
+
+class TestWmediumdReattach(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        StateJournal.enable(self.tmpdir.name)
+        self.sock_path = os.path.join(self.tmpdir.name, 'wmd.sock')
+        self.fake = Popen([sys.executable, '-c', FAKE_WMEDIUMD, self.sock_path])
+        while not os.path.exists(self.sock_path):
+            sleep(0.01)
+        return
+
+    def tearDown(self):
+        Wmediumd.detach()
+        self.fake.kill()
+        self.fake.wait()
+        StateJournal.enable(None)
+        self.tmpdir.cleanup()
+        return
+
+    def test_reattach_and_stop(self):
+        StateJournal.record_wmediumd(pid=self.fake.pid, api_socket=self.sock_path, config='/tmp/jk_wmd_old.conf')
+        self.assertTrue(Wmediumd.reattach())
+        self.assertTrue(Wmediumd.running())
+        Wmediumd.api_set_position('02:00:00:00:00:00', 1.0, 2.0)
+
+        Wmediumd.stop()
+        self.assertIsNotNone(self.fake.wait(1.0), 'Reattached wmediumd not stopped!')
+        self.assertEqual(StateJournal.wmediumd(), {})
+        return
+
+    def test_detach_keeps_it_running(self):
+        StateJournal.record_wmediumd(pid=self.fake.pid, api_socket=self.sock_path, config='/tmp/jk_wmd_old.conf')
+        self.assertTrue(Wmediumd.reattach())
+        Wmediumd.detach()
+
+        self.assertFalse(Wmediumd.running())
+        self.assertIsNone(self.fake.poll())
+        self.assertTrue(os.path.exists(self.sock_path))
+        self.assertEqual(StateJournal.wmediumd()['pid'], self.fake.pid)
+        return
+
+    def test_output_to_log_file(self):
+        tool, config = Wmediumd.tool_wmediumd, Wmediumd._config_path
+        Wmediumd.tool_wmediumd, Wmediumd._config_path = '/bin/echo', '/tmp/jk_wmd_x.conf'
+        try:
+            Wmediumd._process_exec(self.sock_path)
+            Wmediumd._process.wait()
+        finally:
+            Wmediumd.tool_wmediumd, Wmediumd._config_path = tool, config
+            Wmediumd._process = None
+
+        with open(os.path.join(self.tmpdir.name, 'wmediumd.log')) as f:
+            self.assertEqual(f.read(), f'-l 3 -c /tmp/jk_wmd_x.conf -a {self.sock_path}\n')
+        return
+
+    def test_gone_or_reused_pid(self):
+        # a live PID that is not serving the recorded socket
+        StateJournal.record_wmediumd(pid=os.getpid(), api_socket=self.sock_path, config='/tmp/jk_wmd_old.conf')
+        self.assertFalse(Wmediumd.reattach())
+        self.assertEqual(StateJournal.wmediumd(), {}, 'Stale record kept!')
+
+        self.fake.kill()
+        self.fake.wait()
+        StateJournal.record_wmediumd(pid=self.fake.pid, api_socket=self.sock_path, config='/tmp/jk_wmd_old.conf')
+        self.assertFalse(Wmediumd.reattach())
+        self.assertFalse(Wmediumd.running())
+        return